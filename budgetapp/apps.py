@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class BudgetappConfig(AppConfig):
     name = 'budgetapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
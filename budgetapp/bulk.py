@@ -0,0 +1,346 @@
+"""
+Set-based changes to many transactions or payees at once.
+
+Each operation runs as a single UPDATE or DELETE statement. Signals are
+not sent for the affected rows, so category carryover, payee usage and
+tombstones are maintained here for the whole set instead.
+
+Groups, categories and transactions are soft deleted: they are marked with
+`deleted_at`, along with the objects in them, and can be restored until
+they are purged (see purge.py).
+"""
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from . import resolution
+from .models import (BudgetCategory, BudgetCategoryGroup, ImportRule, Payee,
+                     RecurringTransaction, Transaction)
+
+# The soft-deleted models, from the outermost in. Each is in the one
+# before, through the given foreign key.
+SOFT_DELETED = (
+    (BudgetCategoryGroup, None),
+    (BudgetCategory, 'group'),
+    (Transaction, 'budget_category'),
+)
+
+# Lookups from categories to each soft-deleted model, to find the
+# categories whose carryover changes.
+CARRYOVER_LOOKUPS = {
+    BudgetCategoryGroup: 'group__in',
+    BudgetCategory: 'pk__in',
+    Transaction: 'transaction__in',
+}
+
+
+def get_sql(queryset, *fields):
+    return queryset.order_by().values(*fields).query.sql_with_params()
+
+
+def update_derived(category_ids, payee_ids):
+    BudgetCategory.objects.update_carryover(
+        BudgetCategory.objects.carryover_keys(pk__in=set(category_ids)))
+    Payee.objects.update_usage(payee_ids)
+
+
+def recategorize_transactions(queryset, category):
+    """
+    Moves the given transactions to the given category. Returns the number
+    of moved transactions.
+    """
+    sql, params = get_sql(queryset, 'pk', 'budget_category')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE budgetapp_transaction transaction
+            SET budget_category_id = %s, updated_at = now(),
+                version = transaction.version + 1
+            FROM ({}) AS old (id, budget_category_id)
+            WHERE transaction.id = old.id
+            RETURNING old.budget_category_id
+            """.format(sql),
+            [category.pk] + list(params),
+        )
+        category_ids = [row[0] for row in cursor.fetchall()]
+
+    if category_ids:
+        update_derived(category_ids + [category.pk], [])
+
+    return len(category_ids)
+
+
+def get_cascade(model):
+    """
+    Returns the (model, foreign key column) pairs of the given soft-deleted
+    model and the models in it.
+    """
+    models = [item[0] for item in SOFT_DELETED]
+    return [
+        (item, field and item._meta.get_field(field).column)
+        for item, field in SOFT_DELETED[models.index(model):]
+    ]
+
+
+def soft_delete(queryset, owner):
+    """
+    Marks the given groups, categories or transactions of the given user as
+    deleted, along with the categories and transactions in them, recording
+    their tombstones in the same statement. Returns the number of deleted
+    objects of the queryset's model.
+    """
+    keys = BudgetCategory.objects.carryover_keys(**{
+        CARRYOVER_LOOKUPS[queryset.model]: queryset.values('pk'),
+    })
+    sql, params = get_sql(queryset, 'pk')
+    now = timezone.now()
+
+    ctes = []
+    values = []
+    for index, (model, column) in enumerate(get_cascade(queryset.model)):
+        if index == 0:
+            condition = 'id IN ({})'.format(sql)
+            values += [now, now] + list(params)
+        else:
+            condition = '{} IN (SELECT id FROM deleted_{})'.format(
+                column, index - 1)
+            values += [now, now]
+        ctes.append(
+            """
+            deleted_{index} AS (
+                UPDATE {table}
+                SET deleted_at = %s, updated_at = %s, version = version + 1
+                WHERE {condition} AND deleted_at IS NULL
+                RETURNING id{payee}
+            )
+            """.format(
+                index=index,
+                table=model._meta.db_table,
+                condition=condition,
+                payee=', payee_id' if model is Transaction else '',
+            )
+        )
+
+    deleted = ' UNION ALL '.join(
+        'SELECT %s, id FROM deleted_{}'.format(index)
+        for index in range(len(ctes))
+    )
+    values += [owner.pk, now]
+    values += [model._meta.model_name for model, column in
+               get_cascade(queryset.model)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            WITH {ctes}, tombstones AS (
+                INSERT INTO budgetapp_tombstone
+                    (model, object_pk, owner_id, deleted_at)
+                SELECT model, id, %s, %s
+                FROM ({deleted}) AS deleted (model, id)
+            )
+            SELECT
+                (SELECT COUNT(*) FROM deleted_0),
+                ARRAY(SELECT DISTINCT payee_id FROM deleted_{last})
+            """.format(
+                ctes=', '.join(ctes),
+                deleted=deleted,
+                last=len(ctes) - 1,
+            ),
+            values,
+        )
+        count, payee_ids = cursor.fetchone()
+
+    BudgetCategory.objects.update_carryover(keys)
+    Payee.objects.update_usage(payee_ids)
+    if queryset.model is BudgetCategoryGroup:
+        resolution.invalidate(owner.pk)
+
+    return count
+
+
+def restore_deleted(queryset, owner):
+    """
+    Restores the given deleted groups, categories or transactions of the
+    given user, along with the categories and transactions deleted with
+    them. Objects in a deleted category or group are not restored. Returns
+    the number of restored objects of the queryset's model.
+    """
+    cascade = get_cascade(queryset.model)
+    parent = dict(SOFT_DELETED)[queryset.model]
+    if parent:
+        queryset = queryset.filter(**{parent + '__deleted_at__isnull': True})
+    sql, params = get_sql(
+        queryset.filter(deleted_at__isnull=False), 'pk', 'deleted_at')
+    now = timezone.now()
+
+    ctes = []
+    values = []
+    for index, (model, column) in enumerate(cascade):
+        # Objects in the restored ones are restored if they were deleted
+        # along with them, at the same time.
+        if index == 0:
+            source = '({}) AS old (id, deleted_at)'.format(sql)
+            condition = 'object.id = old.id'
+            values += [now] + list(params)
+        else:
+            source = 'restored_{} AS old'.format(index - 1)
+            condition = (
+                'object.{} = old.id AND object.deleted_at = old.deleted_at'
+                .format(column)
+            )
+            values += [now]
+        ctes.append(
+            """
+            restored_{index} AS (
+                UPDATE {table} object
+                SET deleted_at = NULL, updated_at = %s,
+                    version = object.version + 1
+                FROM {source}
+                WHERE {condition}
+                RETURNING object.id, old.deleted_at{extra}
+            )
+            """.format(
+                index=index,
+                table=model._meta.db_table,
+                source=source,
+                condition=condition,
+                extra=(
+                    ', object.budget_category_id, object.payee_id'
+                    if model is Transaction else ''
+                ),
+            )
+        )
+
+    # Tombstones of restored objects are removed, so that syncing clients
+    # keep them.
+    restored = ' UNION ALL '.join(
+        'SELECT %s, id FROM restored_{}'.format(index)
+        for index in range(len(ctes))
+    )
+    values += [owner.pk]
+    values += [model._meta.model_name for model, column in cascade]
+    last = len(ctes) - 1
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            WITH {ctes}, tombstones AS (
+                DELETE FROM budgetapp_tombstone
+                WHERE owner_id = %s AND (model, object_pk) IN ({restored})
+            )
+            SELECT
+                (SELECT COUNT(*) FROM restored_0),
+                ARRAY({categories}),
+                ARRAY(SELECT DISTINCT payee_id FROM restored_{last})
+            """.format(
+                ctes=', '.join(ctes),
+                restored=restored,
+                categories=(
+                    'SELECT budget_category_id FROM restored_{}'.format(last)
+                    if queryset.model is Transaction else
+                    'SELECT id FROM restored_{}'.format(last - 1)
+                ),
+                last=last,
+            ),
+            values,
+        )
+        count, category_ids, payee_ids = cursor.fetchone()
+
+    update_derived(category_ids, payee_ids)
+
+    return count
+
+
+def merge_payees(payees, target):
+    """
+    Moves the transactions of the given payees to the target payee, renames
+    them in the owner's import rules and recurring transactions, and deletes
+    the merged payees. Returns the number of moved transactions.
+    """
+    payees = [payee for payee in payees if payee.pk != target.pk]
+    names = [payee.name for payee in payees]
+
+    # Deleted transactions are moved too, so that they can be restored.
+    moved = Transaction.all_objects.filter(payee__in=payees).update(
+        payee=target, updated_at=timezone.now(), version=F('version') + 1)
+    RecurringTransaction.objects.filter(
+        owner=target.owner_id, payee__in=names,
+    ).update(payee=target.name, version=F('version') + 1)
+    ImportRule.objects.filter(
+        owner=target.owner_id, payee__in=names,
+    ).update(payee=target.name, version=F('version') + 1)
+
+    # The payees have no transactions left, so this only records their
+    # tombstones.
+    Payee.objects.filter(pk__in=[payee.pk for payee in payees]).delete()
+    Payee.objects.update_usage([target.pk])
+
+    return moved
+
+
+def merge_duplicate_categories():
+    """
+    Merges the live categories with the same name in a budget into the
+    first of them: their transactions are moved to it, their limits are
+    added to its limit, and they are soft deleted. Only raw SQL is used, so
+    that it also works before migration 0043, which requires names to be
+    unique. Returns the number of merged categories.
+    """
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            WITH merged AS (
+                SELECT id, owner_id, target_id FROM (
+                    SELECT category.id, budget.owner_id, min(category.id)
+                        OVER (PARTITION BY grp.budget_id, category.category)
+                        AS target_id
+                    FROM budgetapp_budgetcategory category
+                    JOIN budgetapp_budgetcategorygroup grp
+                        ON grp.id = category.group_id
+                    JOIN budgetapp_budget budget ON budget.id = grp.budget_id
+                    WHERE category.deleted_at IS NULL
+                ) category
+                WHERE id <> target_id
+            ), moved AS (
+                -- Deleted transactions are moved too, so that they can be
+                -- restored.
+                UPDATE budgetapp_transaction transaction
+                SET budget_category_id = merged.target_id, updated_at = %s,
+                    version = transaction.version + 1
+                FROM merged
+                WHERE transaction.budget_category_id = merged.id
+            ), deleted AS (
+                UPDATE budgetapp_budgetcategory category
+                SET deleted_at = %s, updated_at = %s,
+                    version = category.version + 1
+                FROM merged
+                WHERE category.id = merged.id
+                RETURNING category.id, merged.owner_id
+            ), tombstones AS (
+                INSERT INTO budgetapp_tombstone
+                    (model, object_pk, owner_id, deleted_at)
+                SELECT 'budgetcategory', id, owner_id, %s FROM deleted
+            ), targets AS (
+                UPDATE budgetapp_budgetcategory category
+                SET "limit" = category."limit" + added."limit",
+                    updated_at = %s, version = category.version + 1
+                FROM (
+                    SELECT merged.target_id, sum(category."limit") AS "limit"
+                    FROM merged
+                    JOIN budgetapp_budgetcategory category
+                        ON category.id = merged.id
+                    GROUP BY merged.target_id
+                ) added
+                WHERE category.id = added.target_id
+                RETURNING category.id
+            )
+            SELECT
+                (SELECT COUNT(*) FROM deleted),
+                ARRAY(SELECT id FROM targets)
+            """,
+            [now, now, now, now, now],
+        )
+        count, category_ids = cursor.fetchone()
+
+    update_derived(category_ids, [])
+
+    return count
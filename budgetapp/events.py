@@ -0,0 +1,209 @@
+"""
+Server-sent events of changes to the budgets, groups, categories and
+transactions of a user, so that clients need not poll for edits made on
+other devices.
+
+Each statement that writes to those tables notifies a channel of each owner
+of the written rows with Postgres' NOTIFY (see migration 0045), listing the
+changed rows, or asking for a resync if there are many. Each process
+listens on one connection for the channels of all users with an open
+stream, and passes the changes on to the queues of their streams. Streams
+do not use a database connection while they are open, and under the gevent
+workers of production each holds a greenlet rather than a worker.
+"""
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.renderers import BaseRenderer
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'budgetapp_changes_{}'
+
+# Seconds between comments sent on idle streams, which keep proxies from
+# closing them and detect clients that went away.
+HEARTBEAT = 15
+
+# Notifications a stream may fall behind by before it is told to resync.
+MAX_PENDING = 1000
+
+# Seconds before the listener reconnects after losing its connection.
+RECONNECT_DELAY = 1
+
+RESYNC = object()
+
+
+def format_event(event, data):
+    return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+
+
+def push(events, change):
+    try:
+        events.put_nowait(change)
+    except queue.Full:
+        # The stream fell behind, so its client is told to fetch the
+        # changes it missed instead.
+        with events.mutex:
+            events.queue.clear()
+        events.put_nowait(RESYNC)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Renders the errors of an event stream request, such as failed
+    authentication, as an error event.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_event('error', data)
+
+
+class Listener:
+    """
+    Listens for the change notifications of the users with open streams, on
+    a connection of its own, and passes each on to the queues of the
+    user's streams.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.lock = threading.Lock()
+        self.queues = defaultdict(set)
+        self.connection = None
+
+    def connect(self):
+        wrapper = connections[self.using]
+        connection = wrapper.get_new_connection(
+            wrapper.get_connection_params())
+        connection.autocommit = True
+        return connection
+
+    def execute(self, statement, owner_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(statement + ' ' + CHANNEL.format(int(owner_id)))
+
+    def subscribe(self, owner_id):
+        """
+        Returns a queue that receives the changes to the given user's
+        objects, until it is unsubscribed.
+        """
+        events = queue.Queue(MAX_PENDING)
+        with self.lock:
+            if self.connection is None:
+                self.connection = self.connect()
+                thread = threading.Thread(
+                    target=self.run, args=(self.connection,), daemon=True)
+                thread.start()
+            if owner_id not in self.queues:
+                self.execute('LISTEN', owner_id)
+            self.queues[owner_id].add(events)
+
+        return events
+
+    def unsubscribe(self, owner_id, events):
+        with self.lock:
+            self.queues[owner_id].discard(events)
+            if not self.queues[owner_id]:
+                del self.queues[owner_id]
+                if self.connection is not None:
+                    try:
+                        self.execute('UNLISTEN', owner_id)
+                    except psycopg2.Error:
+                        # Reconnecting only listens to the remaining users.
+                        pass
+
+    def dispatch(self):
+        # Statements on the connection may receive notifications too, so
+        # they are only read with the lock held.
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            owner_id = int(notify.channel.rsplit('_', 1)[1])
+            payload = json.loads(notify.payload)
+            if payload.get('resync'):
+                changes = [RESYNC]
+            else:
+                changes = [
+                    dict(change, type=payload['type'])
+                    for change in payload['changes']
+                ]
+            for events in self.queues.get(owner_id, ()):
+                for change in changes:
+                    push(events, change)
+
+    def reconnect(self, connection):
+        with self.lock:
+            if self.connection is not connection:
+                # The listener was closed.
+                return connection
+            connection.close()
+            self.connection = self.connect()
+            for owner_id in self.queues:
+                self.execute('LISTEN', owner_id)
+            # Changes may have been missed while disconnected.
+            for owner_queues in self.queues.values():
+                for events in owner_queues:
+                    push(events, RESYNC)
+            return self.connection
+
+    def run(self, connection):
+        while self.connection is connection:
+            try:
+                select.select([connection], [], [], HEARTBEAT)
+                with self.lock:
+                    if self.connection is connection:
+                        connection.poll()
+                        self.dispatch()
+            except (psycopg2.Error, OSError):
+                if self.connection is not connection:
+                    break
+                logger.exception('Lost the change notification connection.')
+                time.sleep(RECONNECT_DELAY)
+                try:
+                    connection = self.reconnect(connection)
+                except psycopg2.Error:
+                    pass
+
+    def stream(self, owner_id):
+        """
+        Returns a generator of the given user's changes as server-sent
+        events. It subscribes once it starts, rather than when it is
+        created, so that a stream closed before it starts, as for a HEAD
+        request, is never left subscribed. It unsubscribes once the client
+        goes away.
+        """
+        events = self.subscribe(owner_id)
+        try:
+            # Clients reconnect after a short delay if the stream is cut.
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    change = events.get(timeout=HEARTBEAT)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+
+                if change is RESYNC:
+                    yield format_event('resync', {})
+                else:
+                    yield format_event('change', change)
+        finally:
+            self.unsubscribe(owner_id, events)
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+listener = Listener()
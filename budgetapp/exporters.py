@@ -0,0 +1,90 @@
+"""
+Streaming export of transactions as CSV or JSON Lines.
+
+Rows are read through a server-side cursor and written out in small
+chunks, so memory use stays flat regardless of the number of transactions.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Number of rows fetched from the database cursor at a time.
+CURSOR_CHUNK_SIZE = 2000
+
+# Number of rows written to the response per chunk.
+WRITE_CHUNK_SIZE = 500
+
+EXPORT_FIELDS = (
+    ('date', 'date'),
+    ('amount', 'amount'),
+    ('payee', 'payee__name'),
+    ('category', 'budget_category__category'),
+    ('group', 'budget_category__group__name'),
+    ('budget_month', 'budget_category__group__budget__month'),
+    ('budget_year', 'budget_category__group__budget__year'),
+)
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+class Echo:
+    """
+    File-like object that returns what is written to it, so that
+    csv.writer can be used to format lines without buffering them.
+    """
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset):
+    """
+    Returns an iterator of value tuples, in the order of EXPORT_FIELDS, for
+    the given transactions.
+    """
+    return (
+        queryset
+        .order_by('date', 'pk')
+        .values_list(*(lookup for name, lookup in EXPORT_FIELDS))
+        .iterator(chunk_size=CURSOR_CHUNK_SIZE)
+    )
+
+
+def chunked(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= WRITE_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+
+    if chunk:
+        yield ''.join(chunk)
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(name for name, lookup in EXPORT_FIELDS)
+    yield from chunked(writer.writerow(row) for row in rows)
+
+
+def stream_jsonl(rows):
+    names = [name for name, lookup in EXPORT_FIELDS]
+    yield from chunked(
+        json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + '\n'
+        for row in rows
+    )
+
+
+STREAMERS = {
+    'csv': stream_csv,
+    'jsonl': stream_jsonl,
+}
+
+
+def stream_export(queryset, file_format):
+    return STREAMERS[file_format](export_rows(queryset))
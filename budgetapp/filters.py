@@ -0,0 +1,44 @@
+"""
+Filters for the list endpoints. Each filter is backed by an index on the
+filtered model (see Meta.indexes), or reaches the budget's unique
+(owner, month, year) index through the owner lookup.
+"""
+from django_filters import rest_framework as filters
+
+from .models import Budget, BudgetCategory, Transaction
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
+
+
+class TransactionFilter(filters.FilterSet):
+    ids = NumberInFilter(field_name='pk')
+    date_after = filters.DateFilter(field_name='date', lookup_expr='gte')
+    date_before = filters.DateFilter(field_name='date', lookup_expr='lte')
+    amount_min = filters.NumberFilter(field_name='amount', lookup_expr='gte')
+    amount_max = filters.NumberFilter(field_name='amount', lookup_expr='lte')
+    payee = filters.CharFilter(field_name='payee__name')
+    month = filters.ChoiceFilter(
+        field_name='budget_category__group__budget__month',
+        choices=Budget.MONTH_CHOICES,
+    )
+    year = filters.NumberFilter(
+        field_name='budget_category__group__budget__year')
+
+    class Meta:
+        model = Transaction
+        fields = ('budget_category',)
+
+
+class BudgetCategoryFilter(filters.FilterSet):
+    month = filters.ChoiceFilter(
+        field_name='group__budget__month',
+        choices=Budget.MONTH_CHOICES,
+    )
+    year = filters.NumberFilter(field_name='group__budget__year')
+    budget = filters.NumberFilter(field_name='group__budget')
+
+    class Meta:
+        model = BudgetCategory
+        fields = ('category', 'group')
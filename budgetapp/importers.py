@@ -0,0 +1,279 @@
+"""
+Streaming import of bank statement exports (CSV and OFX) as transactions.
+
+Statements are read row by row and written in fixed-size batches, so memory
+use does not depend on the size of the statement.
+"""
+import csv
+import html
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .models import Budget, BudgetCategory, ImportRule, Payee, Transaction
+
+DEFAULT_BATCH_SIZE = 500
+
+# Only the first errors are reported back, to keep the summary small.
+MAX_REPORTED_ERRORS = 100
+
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%Y%m%d')
+
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+class RowError(Exception):
+    pass
+
+
+def read_csv(stream):
+    """
+    Yields a dict for each row of a CSV statement. The statement must have
+    a header with date, amount and description (or payee) columns, and may
+    have a category column.
+    """
+    reader = csv.reader(stream)
+    header = [column.strip().lower() for column in next(reader, [])]
+    if 'description' not in header and 'payee' in header:
+        header[header.index('payee')] = 'description'
+
+    for values in reader:
+        if not any(values):
+            continue
+        yield dict(zip(header, values))
+
+
+def read_ofx(stream, chunk_size=64 * 1024):
+    """
+    Yields a dict for each transaction (STMTTRN) of an OFX statement. Both
+    the SGML (1.x) and XML (2.x) flavours are supported. The file is
+    tokenized in chunks rather than parsed as a whole document.
+    """
+    row = None
+    buffer = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += chunk
+
+        # The last tag in the buffer may be incomplete, so it is left for
+        # the next chunk unless the end of the file has been reached.
+        end = buffer.rfind('<') if chunk else len(buffer)
+        if end <= 0 and chunk:
+            continue
+
+        for match in OFX_TAG.finditer(buffer, 0, end):
+            closing, tag, value = match.groups()
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if not closing:
+                    row = {}
+                elif row is not None:
+                    yield {
+                        'date': row.get('DTPOSTED', '')[:8],
+                        'amount': row.get('TRNAMT', ''),
+                        'description': row.get('NAME') or row.get('MEMO', ''),
+                    }
+                    row = None
+            elif row is not None and not closing:
+                row[tag] = html.unescape(value.strip())
+
+        buffer = buffer[end:]
+        if not chunk:
+            break
+
+
+READERS = {
+    'csv': read_csv,
+    'ofx': read_ofx,
+    'qfx': read_ofx,
+}
+
+
+def read_statement(stream, file_format):
+    return READERS[file_format](stream)
+
+
+def parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            pass
+
+    raise RowError('Invalid date "{}".'.format(value))
+
+
+def parse_amount(value):
+    try:
+        amount = Decimal(value.strip().replace(',', '').replace('$', ''))
+    except InvalidOperation:
+        raise RowError('Invalid amount "{}".'.format(value))
+
+    # Statements record money leaving the account as a negative amount,
+    # while transactions record spending as a positive amount.
+    return -amount.quantize(Decimal('0.01'))
+
+
+class StatementImporter:
+    """
+    Imports statement rows as transactions for the given user. Each row
+    is mapped to a payee and category by the user's import rules, falling
+    back to the row's own category column. The category is looked up by
+    name in the budget for the month of the transaction.
+    """
+
+    def __init__(self, owner, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+        self.owner = owner
+        self.batch_size = batch_size
+        self.progress = progress
+        self.rules = list(ImportRule.objects.filter(owner=owner))
+        # Maps (year, month, category name) to a category pk, or None if
+        # the budget has no such category.
+        self.categories = {}
+
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        # Whether the statement could not be read to the end.
+        self.unreadable = False
+
+    def run(self, rows):
+        """
+        Imports all of the given rows and returns a summary. If the
+        statement cannot be decoded or parsed, the rows before the one that
+        cannot be read are still imported.
+        """
+        batch = []
+        for row in self.read(rows):
+            self.rows += 1
+            try:
+                batch.append(self.parse_row(self.rows, row))
+            except RowError as exc:
+                self.add_error(self.rows, str(exc))
+
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                batch = []
+
+        if batch:
+            self.write(batch)
+
+        return self.summary()
+
+    def read(self, rows):
+        try:
+            yield from rows
+        except (UnicodeDecodeError, csv.Error) as exc:
+            self.unreadable = True
+            self.rows += 1
+            self.add_error(
+                self.rows,
+                'The rest of the statement could not be read: {}'.format(exc),
+            )
+
+    def summary(self):
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
+
+    def add_error(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'error': message})
+
+    def parse_row(self, row_number, row):
+        date = parse_date(row.get('date') or '')
+        amount = parse_amount(row.get('amount') or '')
+        description = (row.get('description') or '').strip()
+
+        payee = description
+        category = (row.get('category') or '').strip()
+        for rule in self.rules:
+            if rule.applies_to(description):
+                payee = rule.payee or description
+                category = rule.category
+                break
+
+        if not payee:
+            raise RowError('Missing description.')
+        if not category:
+            raise RowError(
+                'No import rule matches "{}".'.format(description))
+
+        return {
+            'row': row_number,
+            'date': date,
+            'amount': amount,
+            'payee': payee[:30],
+            'category': (
+                date.year, Budget.MONTH_CHOICES[date.month - 1][0], category,
+            ),
+        }
+
+    def resolve_categories(self, keys):
+        """
+        Looks up the categories for the given keys that have not been
+        looked up yet, with one query.
+        """
+        missing = {key for key in keys if key not in self.categories}
+        if not missing:
+            return
+
+        categories = BudgetCategory.objects.filter(
+            group__budget__owner=self.owner,
+            group__budget__year__in={key[0] for key in missing},
+            category__in={key[2] for key in missing},
+        ).values_list(
+            'pk', 'group__budget__year', 'group__budget__month', 'category',
+        )
+        for pk, year, month, category in categories:
+            self.categories[(year, month, category)] = pk
+
+        for key in missing:
+            self.categories.setdefault(key, None)
+
+    def write(self, batch):
+        self.resolve_categories(item['category'] for item in batch)
+
+        items = []
+        for item in batch:
+            category = self.categories[item['category']]
+            if category is None:
+                year, month, name = item['category']
+                self.add_error(
+                    item['row'],
+                    'No category "{}" in the {} {} budget.'.format(
+                        name, month, year),
+                )
+            else:
+                items.append(dict(item, category=category))
+
+        if items:
+            with transaction.atomic():
+                payees = Payee.objects.resolve(
+                    self.owner, (item['payee'] for item in items))
+                Transaction.objects.bulk_create(
+                    Transaction(
+                        amount=item['amount'],
+                        date=item['date'],
+                        payee=payees[item['payee']],
+                        budget_category_id=item['category'],
+                    )
+                    for item in items
+                )
+                BudgetCategory.objects.update_carryover(
+                    BudgetCategory.objects.carryover_keys(
+                        pk__in={item['category'] for item in items})
+                )
+                Payee.objects.update_usage(
+                    payee.pk for payee in payees.values())
+            self.imported += len(items)
+
+        if self.progress:
+            self.progress(self)
@@ -0,0 +1,189 @@
+"""
+A job queue in the database, for operations too slow to run in a request.
+
+Queued jobs are claimed by the run_jobs worker command with SELECT ... FOR
+UPDATE SKIP LOCKED, so any number of workers can run side by side without
+claiming the same job, and no broker is needed. A failed job is retried
+with a growing delay, up to its maximum number of attempts. A claimed job
+is leased to its worker for a while, and can be claimed again once the
+lease expires, so that jobs of a worker that died are not lost.
+"""
+import io
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .importers import StatementImporter, read_statement
+from .models import Budget, CategoryTotal, Job
+from .purge import delete_user
+
+logger = logging.getLogger(__name__)
+
+# How long a worker may run a job before another worker may claim it.
+# Long jobs renew the lease as they make progress.
+LEASE = timedelta(minutes=5)
+
+# Leases of the kinds of jobs that run in one transaction, whose renewals
+# would not be seen by other workers until they commit.
+LEASES = {
+    'copy_budget': timedelta(minutes=30),
+    'refresh_category_totals': timedelta(minutes=30),
+}
+
+# Delay before the first retry of a failed job, doubled for each retry.
+RETRY_DELAY = timedelta(seconds=30)
+
+HANDLERS = {}
+
+
+def handler(kind, max_attempts=3):
+    """
+    Registers the decorated function as the handler of jobs of the given
+    kind. It is called with the job, and returns its JSON result.
+    """
+    def register(func):
+        HANDLERS[kind] = (func, max_attempts)
+        return func
+    return register
+
+
+def enqueue(kind, owner=None, payload='', **params):
+    """
+    Queues a job of the given kind, to be run by a worker.
+    """
+    func, max_attempts = HANDLERS[kind]
+    return Job.objects.create(
+        kind=kind,
+        owner=owner,
+        params=params,
+        payload=payload,
+        max_attempts=max_attempts,
+    )
+
+
+def get_lease(job):
+    return LEASES.get(job.kind, LEASE)
+
+
+def renew_lease(job):
+    Job.objects.filter(pk=job.pk, attempts=job.attempts).update(
+        run_after=timezone.now() + get_lease(job))
+
+
+def claim_job():
+    """
+    Claims the next job that is due, or whose worker's lease expired.
+    Returns None if there is none.
+    """
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            job = (
+                Job.objects
+                .filter(status__in=('QUEUED', 'RUNNING'), run_after__lte=now)
+                .order_by('run_after')
+                .select_for_update(skip_locked=True)
+                .first()
+            )
+            if job is None:
+                return None
+
+            if job.attempts >= job.max_attempts:
+                # Its worker died during the last attempt.
+                job.status = 'FAILED'
+                job.error = 'The job did not finish.'
+                job.finished_at = now
+                job.save()
+                continue
+
+            job.status = 'RUNNING'
+            job.attempts += 1
+            job.run_after = now + get_lease(job)
+            job.save()
+            return job
+
+
+def run_job(job):
+    """
+    Runs a claimed job and records its outcome. A failed job is queued to
+    be retried, unless it has used up its attempts.
+    """
+    now = timezone.now()
+    try:
+        func, max_attempts = HANDLERS[job.kind]
+        result = func(job)
+    except Exception as exc:
+        logger.exception('Job %s (%s) failed.', job.pk, job.kind)
+        if job.attempts < job.max_attempts:
+            changes = {
+                'status': 'QUEUED',
+                'run_after': now + RETRY_DELAY * 2 ** (job.attempts - 1),
+            }
+        else:
+            changes = {'status': 'FAILED', 'finished_at': now}
+        changes['error'] = str(exc) or type(exc).__name__
+    else:
+        changes = {
+            'status': 'DONE',
+            'result': result,
+            'error': '',
+            'finished_at': timezone.now(),
+        }
+
+    # Updated rather than saved, since the job may have deleted itself
+    # along with its owner. Only this attempt's claim is updated, in case
+    # the lease expired and another worker claimed the job again.
+    Job.objects.filter(pk=job.pk, attempts=job.attempts).update(**changes)
+    for field, value in changes.items():
+        setattr(job, field, value)
+
+
+def run_pending(limit=None):
+    """
+    Runs due jobs until there are none left, or until `limit` jobs have
+    run. Returns the number of jobs run.
+    """
+    count = 0
+    while limit is None or count < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+
+    return count
+
+
+@handler('import_statement', max_attempts=1)
+def import_statement(job):
+    # Not retried, since the batches imported before a failure are kept.
+    importer = StatementImporter(
+        job.owner, progress=lambda importer: renew_lease(job))
+    rows = read_statement(io.StringIO(job.payload), job.params['file_format'])
+    return importer.run(rows)
+
+
+@handler('copy_budget')
+def copy_budget(job):
+    params = job.params
+    source = None
+    if params.get('source'):
+        source = Budget.objects.get(pk=params['source'], owner=job.owner)
+    Budget.objects.copy_budget(
+        job.owner,
+        range(params['start'], params['end'] + 1),
+        source,
+        params.get('token', ''),
+    )
+
+
+@handler('delete_user')
+def delete_user_job(job):
+    delete_user(job.owner, progress=lambda: renew_lease(job))
+
+
+@handler('refresh_category_totals')
+def refresh_category_totals(job):
+    CategoryTotal.refresh()
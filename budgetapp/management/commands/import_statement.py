@@ -0,0 +1,55 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from ...importers import (DEFAULT_BATCH_SIZE, READERS, StatementImporter,
+                          read_statement)
+
+
+class Command(BaseCommand):
+    help = 'Imports a CSV or OFX bank statement as transactions for a user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format',
+            dest='file_format',
+            choices=sorted(READERS),
+            help='Statement format. Defaults to the file extension.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of rows written per batch.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(
+                'User "{}" does not exist.'.format(options['username']))
+
+        file_format = options['file_format'] or \
+            options['path'].rpartition('.')[2].lower()
+        if file_format not in READERS:
+            raise CommandError('Unable to determine the format of the file.')
+
+        importer = StatementImporter(
+            user,
+            batch_size=options['batch_size'],
+            progress=self.report_progress,
+        )
+        with open(options['path'], encoding='utf-8-sig', newline='') as f:
+            summary = importer.run(read_statement(f, file_format))
+
+        for error in summary['errors']:
+            self.stderr.write('Row {row}: {error}'.format(**error))
+        self.stdout.write(
+            'Imported {imported} of {rows} rows ({failed} failed).'.format(
+                **summary))
+
+    def report_progress(self, importer):
+        self.stdout.write('{} rows read, {} imported.'.format(
+            importer.rows, importer.imported))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from ...recurring import DEFAULT_BATCH_SIZE, materialize_due
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates the due transactions of all recurring transactions. Safe '
+        'to run repeatedly, e.g. daily from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date',
+            type=parse_date,
+            help='Materialize occurrences due on or before this date '
+                 '(YYYY-MM-DD). Defaults to today.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of recurring transactions processed per batch.',
+        )
+
+    def handle(self, *args, **options):
+        today = options['date'] or timezone.localdate()
+        created, pending = materialize_due(today, options['batch_size'])
+        self.stdout.write(
+            'Created {} transactions. {} occurrences are waiting for a '
+            'budget category.'.format(created, pending))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...bulk import merge_duplicate_categories
+
+
+class Command(BaseCommand):
+    help = (
+        'Merges categories with the same name in a budget into one, adding '
+        'up their limits and moving their transactions. Needs to be run '
+        'before migration 0043 if that migration reports duplicates.'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            merged = merge_duplicate_categories()
+        self.stdout.write('Merged {} categories.'.format(merged))
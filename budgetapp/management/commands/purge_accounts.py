@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from ...purge import DEFAULT_BATCH_SIZE, purge_accounts
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes the accounts whose deletion was requested in the '
+        'background. Safe to run repeatedly, e.g. every few minutes from '
+        'cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of rows deleted per statement.',
+        )
+
+    def handle(self, *args, **options):
+        purged = purge_accounts(options['batch_size'])
+        self.stdout.write('Deleted {} accounts.'.format(purged))
@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...purge import DEFAULT_BATCH_SIZE, purge_deleted
+
+
+class Command(BaseCommand):
+    help = (
+        'Permanently deletes transactions, categories and groups that were '
+        'deleted more than the given number of days ago. Intended to be run '
+        'during off-peak hours, e.g. nightly from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Keep deleted objects restorable for this many days.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of rows deleted per statement.',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.1,
+            help='Seconds to sleep between batches, to throttle the purge.',
+        )
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        purged = purge_deleted(
+            before, options['batch_size'], options['pause'])
+        self.stdout.write(
+            'Deleted {transaction} transactions, {budgetcategory} '
+            'categories and {budgetcategorygroup} groups.'.format(**purged))
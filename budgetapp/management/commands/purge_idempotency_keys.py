@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from ...purge import DEFAULT_BATCH_SIZE, purge_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes the responses stored for idempotency keys that expired. '
+        'Safe to run repeatedly, e.g. daily from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of rows deleted per statement.',
+        )
+
+    def handle(self, *args, **options):
+        purged = purge_idempotency_keys(options['batch_size'])
+        self.stdout.write('Deleted {} idempotency keys.'.format(purged))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from ...jobs import enqueue
+from ...models import CategoryTotal
+
+
+class Command(BaseCommand):
+    help = (
+        'Refreshes the category totals used by reports. Intended to be run '
+        'periodically, e.g. from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--blocking',
+            action='store_true',
+            help='Refresh without CONCURRENTLY, blocking readers.',
+        )
+        parser.add_argument(
+            '--background',
+            action='store_true',
+            help='Queue a concurrent refresh for the run_jobs workers.',
+        )
+
+    def handle(self, *args, **options):
+        if options['background']:
+            enqueue('refresh_category_totals')
+            self.stdout.write('Category totals refresh queued.')
+            return
+
+        CategoryTotal.refresh(concurrently=not options['blocking'])
+        self.stdout.write('Category totals refreshed.')
@@ -0,0 +1,39 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ...models import Budget
+
+MONTH = re.compile(r'^(\d{4})-(\d{2})$')
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates next month\'s budget for every user who has this month\'s, '
+        'copying its groups and categories. Intended to be run before the '
+        'first of each month, e.g. from cron. Safe to run repeatedly.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--month',
+            help='The month to create budgets for (YYYY-MM). Defaults to '
+                 'next month.',
+        )
+
+    def handle(self, *args, **options):
+        if options['month']:
+            match = MONTH.match(options['month'])
+            if not match or not 1 <= int(match.group(2)) <= 12:
+                raise CommandError('The month must be given as YYYY-MM.')
+            year, month = int(match.group(1)), int(match.group(2))
+        else:
+            today = timezone.localdate()
+            year, month = today.year, today.month + 1
+
+        period = year * 12 + month - 1
+        created = Budget.objects.rollover(period)
+        year, month = Budget.from_period(period)
+        self.stdout.write('Created {} budgets for {} {}.'.format(
+            created, month, year))
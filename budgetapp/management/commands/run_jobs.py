@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...jobs import run_pending
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs queued background jobs. Any number of workers can run at '
+        'once.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Exit once no jobs are due, instead of waiting for more.',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1,
+            help='Seconds to wait before checking for new jobs again.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending()
+            if count:
+                self.stdout.write('Ran {} jobs.'.format(count))
+            if options['burst']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,29 @@
+# Generated by Django 2.1.2 on 2026-10-19 18:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('budgetapp', '0027_remove_transaction_inflow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('match', models.CharField(max_length=100)),
+                ('payee', models.CharField(blank=True, max_length=30)),
+                ('category', models.CharField(max_length=100)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_rules', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('pk',),
+            },
+        ),
+    ]
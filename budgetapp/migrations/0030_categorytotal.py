@@ -0,0 +1,70 @@
+# Generated by Django 2.1.2 on 2026-10-19 19:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CREATE_VIEW = """
+CREATE MATERIALIZED VIEW budgetapp_categorytotal AS
+SELECT
+    category.id AS category_id,
+    budget.owner_id,
+    budget.id AS budget_id,
+    budget.year,
+    budget.month,
+    budget.year * 12 + CASE budget.month
+        WHEN 'JAN' THEN 0 WHEN 'FEB' THEN 1 WHEN 'MAR' THEN 2
+        WHEN 'APR' THEN 3 WHEN 'MAY' THEN 4 WHEN 'JUN' THEN 5
+        WHEN 'JUL' THEN 6 WHEN 'AUG' THEN 7 WHEN 'SEP' THEN 8
+        WHEN 'OCT' THEN 9 WHEN 'NOV' THEN 10 WHEN 'DEC' THEN 11
+    END AS period,
+    grp.name AS group_name,
+    category.category AS category_name,
+    category."limit",
+    COALESCE(SUM(transaction.amount), 0) AS spent,
+    COUNT(transaction.id) AS transaction_count
+FROM budgetapp_budgetcategory category
+JOIN budgetapp_budgetcategorygroup grp ON grp.id = category.group_id
+JOIN budgetapp_budget budget ON budget.id = grp.budget_id
+LEFT JOIN budgetapp_transaction transaction
+    ON transaction.budget_category_id = category.id
+GROUP BY category.id, grp.id, budget.id
+WITH DATA;
+
+-- Required for REFRESH MATERIALIZED VIEW CONCURRENTLY.
+CREATE UNIQUE INDEX budgetapp_categorytotal_category_id
+    ON budgetapp_categorytotal (category_id);
+
+CREATE INDEX budgetapp_categorytotal_owner_id_period
+    ON budgetapp_categorytotal (owner_id, period);
+"""
+
+DROP_VIEW = 'DROP MATERIALIZED VIEW budgetapp_categorytotal;'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0029_sync_tracking'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_VIEW, DROP_VIEW),
+        migrations.CreateModel(
+            name='CategoryTotal',
+            fields=[
+                ('category', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='total', serialize=False, to='budgetapp.BudgetCategory')),
+                ('year', models.IntegerField()),
+                ('month', models.CharField(choices=[('JAN', 'January'), ('FEB', 'February'), ('MAR', 'March'), ('APR', 'April'), ('MAY', 'May'), ('JUN', 'June'), ('JUL', 'July'), ('AUG', 'August'), ('SEP', 'September'), ('OCT', 'October'), ('NOV', 'November'), ('DEC', 'December')], max_length=100)),
+                ('period', models.IntegerField()),
+                ('group_name', models.CharField(max_length=100)),
+                ('category_name', models.CharField(max_length=100)),
+                ('limit', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('spent', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('transaction_count', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'budgetapp_categorytotal',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 2.1.2 on 2026-10-19 19:07
+
+from django.db import migrations, models
+
+# Computes the carryover of existing categories in one statement. Runs of
+# consecutive months of a category name are numbered by subtracting the row
+# number from the period, and the carryover is the running sum of
+# limit - spent of the earlier months in the same run.
+POPULATE_CARRYOVER = """
+WITH categories AS (
+    SELECT
+        category.id,
+        budget.owner_id,
+        category.category,
+        category."limit",
+        budget.year * 12 + CASE budget.month
+            WHEN 'JAN' THEN 0 WHEN 'FEB' THEN 1 WHEN 'MAR' THEN 2
+            WHEN 'APR' THEN 3 WHEN 'MAY' THEN 4 WHEN 'JUN' THEN 5
+            WHEN 'JUL' THEN 6 WHEN 'AUG' THEN 7 WHEN 'SEP' THEN 8
+            WHEN 'OCT' THEN 9 WHEN 'NOV' THEN 10 WHEN 'DEC' THEN 11
+        END AS period,
+        COALESCE((
+            SELECT SUM(transaction.amount)
+            FROM budgetapp_transaction transaction
+            WHERE transaction.budget_category_id = category.id
+        ), 0) AS spent
+    FROM budgetapp_budgetcategory category
+    JOIN budgetapp_budgetcategorygroup grp ON grp.id = category.group_id
+    JOIN budgetapp_budget budget ON budget.id = grp.budget_id
+), runs AS (
+    SELECT *, period - ROW_NUMBER() OVER (
+        PARTITION BY owner_id, category ORDER BY period
+    ) AS run
+    FROM categories
+), balances AS (
+    SELECT id, COALESCE(SUM("limit" - spent) OVER (
+        PARTITION BY owner_id, category, run ORDER BY period
+        ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+    ), 0) AS carryover
+    FROM runs
+)
+UPDATE budgetapp_budgetcategory
+SET carryover = balances.carryover
+FROM balances
+WHERE budgetapp_budgetcategory.id = balances.id AND balances.carryover <> 0;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0030_categorytotal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='budgetcategory',
+            name='carryover',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+        migrations.RunSQL(POPULATE_CARRYOVER, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.1.2 on 2026-10-19 19:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('budgetapp', '0031_budgetcategory_carryover'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecurringTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('payee', models.CharField(max_length=30)),
+                ('category', models.CharField(max_length=100)),
+                ('frequency', models.CharField(choices=[('WEEKLY', 'Weekly'), ('MONTHLY', 'Monthly'), ('YEARLY', 'Yearly')], default='MONTHLY', max_length=100)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField(blank=True, null=True)),
+                ('next_date', models.DateField(db_index=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recurring_transactions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='recurring',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='budgetapp.RecurringTransaction'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='transaction',
+            unique_together={('recurring', 'date')},
+        ),
+    ]
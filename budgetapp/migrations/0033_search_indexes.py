@@ -0,0 +1,30 @@
+# Generated by Django 2.1.2 on 2026-10-19 19:20
+
+from django.db import migrations
+
+# The indexed expressions must match the ones built by budgetapp.search,
+# or the planner will not use the indexes.
+INDEXES = (
+    ('budgetapp_payee_name_search', 'budgetapp_payee', 'name'),
+    ('budgetapp_budgetcategory_category_search',
+     'budgetapp_budgetcategory', 'category'),
+    ('budgetapp_budgetcategorygroup_name_search',
+     'budgetapp_budgetcategorygroup', 'name'),
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0032_recurringtransaction'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX {} ON {} USING gin "
+            "(to_tsvector('simple'::regconfig, COALESCE({}, '')))".format(
+                name, table, column),
+            'DROP INDEX {}'.format(name),
+        )
+        for name, table, column in INDEXES
+    ]
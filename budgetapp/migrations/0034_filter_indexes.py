@@ -0,0 +1,40 @@
+# Generated by Django 2.1.2 on 2026-10-19 19:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0033_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='budget_category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='budgetapp.BudgetCategory'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='payee',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='budgetapp.Payee'),
+        ),
+        migrations.AddIndex(
+            model_name='budgetcategory',
+            index=models.Index(fields=['category', 'group'], name='category_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['budget_category', 'date'], name='transaction_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['budget_category', 'amount'], name='transaction_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['payee', 'date'], name='transaction_payee_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.1.2 on 2026-10-19 19:17
+
+from django.db import migrations, models
+
+POPULATE_USAGE = """
+UPDATE budgetapp_payee payee
+SET transaction_count = usage.transaction_count,
+    last_used = usage.last_used
+FROM (
+    SELECT
+        payee_id,
+        COUNT(*) AS transaction_count,
+        MAX(date) AS last_used
+    FROM budgetapp_transaction
+    GROUP BY payee_id
+) usage
+WHERE payee.id = usage.payee_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0034_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payee',
+            name='last_used',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='payee',
+            name='transaction_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunSQL(POPULATE_USAGE, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='payee',
+            index=models.Index(fields=['owner', '-transaction_count', '-last_used'], name='payee_usage_idx'),
+        ),
+    ]
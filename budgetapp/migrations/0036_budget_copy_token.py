@@ -0,0 +1,18 @@
+# Generated by Django 2.1.2 on 2026-10-19 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0035_payee_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='budget',
+            name='copy_token',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.1.2 on 2026-10-19 19:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('budgetapp', '0036_budget_copy_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountDeletion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='deletion', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('requested_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
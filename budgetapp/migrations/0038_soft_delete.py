@@ -0,0 +1,162 @@
+# Generated by Django 2.1.2 on 2026-10-19 19:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+LIVE = 'deleted_at IS NULL'
+DELETED = 'deleted_at IS NOT NULL'
+
+# Indexes on a subset of rows, which Index does not support yet. Filters
+# only read live rows, and the purge only reads deleted ones.
+PARTIAL_INDEXES = (
+    ('category_name_idx', 'budgetapp_budgetcategory',
+     'category, group_id', LIVE),
+    ('transaction_date_idx', 'budgetapp_transaction',
+     'budget_category_id, date', LIVE),
+    ('transaction_amount_idx', 'budgetapp_transaction',
+     'budget_category_id, amount', LIVE),
+    ('transaction_payee_idx', 'budgetapp_transaction',
+     'payee_id, date', LIVE),
+    ('group_deleted_idx', 'budgetapp_budgetcategorygroup',
+     'deleted_at', DELETED),
+    ('category_deleted_idx', 'budgetapp_budgetcategory',
+     'deleted_at', DELETED),
+    ('transaction_deleted_idx', 'budgetapp_transaction',
+     'deleted_at', DELETED),
+)
+
+SEARCH_INDEXES = (
+    ('budgetapp_budgetcategory_category_search',
+     'budgetapp_budgetcategory', 'category'),
+    ('budgetapp_budgetcategorygroup_name_search',
+     'budgetapp_budgetcategorygroup', 'name'),
+)
+
+# The totals only include live categories and transactions. A deleted
+# group's categories are deleted along with it.
+VIEW = """
+DROP MATERIALIZED VIEW budgetapp_categorytotal;
+
+CREATE MATERIALIZED VIEW budgetapp_categorytotal AS
+SELECT
+    category.id AS category_id,
+    budget.owner_id,
+    budget.id AS budget_id,
+    budget.year,
+    budget.month,
+    budget.year * 12 + CASE budget.month
+        WHEN 'JAN' THEN 0 WHEN 'FEB' THEN 1 WHEN 'MAR' THEN 2
+        WHEN 'APR' THEN 3 WHEN 'MAY' THEN 4 WHEN 'JUN' THEN 5
+        WHEN 'JUL' THEN 6 WHEN 'AUG' THEN 7 WHEN 'SEP' THEN 8
+        WHEN 'OCT' THEN 9 WHEN 'NOV' THEN 10 WHEN 'DEC' THEN 11
+    END AS period,
+    grp.name AS group_name,
+    category.category AS category_name,
+    category."limit",
+    COALESCE(SUM(transaction.amount), 0) AS spent,
+    COUNT(transaction.id) AS transaction_count
+FROM budgetapp_budgetcategory category
+JOIN budgetapp_budgetcategorygroup grp ON grp.id = category.group_id
+JOIN budgetapp_budget budget ON budget.id = grp.budget_id
+LEFT JOIN budgetapp_transaction transaction
+    ON transaction.budget_category_id = category.id{transaction_filter}
+{category_filter}GROUP BY category.id, grp.id, budget.id
+WITH DATA;
+
+CREATE UNIQUE INDEX budgetapp_categorytotal_category_id
+    ON budgetapp_categorytotal (category_id);
+
+CREATE INDEX budgetapp_categorytotal_owner_id_period
+    ON budgetapp_categorytotal (owner_id, period);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0037_accountdeletion'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='budgetcategory',
+            name='category_name_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_amount_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_payee_idx',
+        ),
+        migrations.AddField(
+            model_name='budgetcategory',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='budgetcategorygroup',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='budget_category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='budgetapp.BudgetCategory'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='payee',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='budgetapp.Payee'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='budgetcategorygroup',
+            unique_together=set(),
+        ),
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX group_name_uniq '
+            'ON budgetapp_budgetcategorygroup (budget_id, name) '
+            'WHERE deleted_at IS NULL',
+            'DROP INDEX group_name_uniq',
+        ),
+    ] + [
+        migrations.RunSQL(
+            'CREATE INDEX {} ON {} ({}) WHERE {}'.format(
+                name, table, columns, condition),
+            'DROP INDEX {}'.format(name),
+        )
+        for name, table, columns, condition in PARTIAL_INDEXES
+    ] + [
+        # The search indexes of migration 0033 are rebuilt to cover only
+        # live rows.
+        migrations.RunSQL(
+            'DROP INDEX {name}; '
+            'CREATE INDEX {name} ON {table} USING gin '
+            "(to_tsvector('simple'::regconfig, COALESCE({column}, ''))) "
+            'WHERE {condition}'.format(
+                name=name, table=table, column=column, condition=LIVE),
+            'DROP INDEX {name}; '
+            'CREATE INDEX {name} ON {table} USING gin '
+            "(to_tsvector('simple'::regconfig, COALESCE({column}, '')))"
+            .format(name=name, table=table, column=column),
+        )
+        for name, table, column in SEARCH_INDEXES
+    ] + [
+        migrations.RunSQL(
+            VIEW.format(
+                transaction_filter='\n    AND transaction.deleted_at IS NULL',
+                category_filter='WHERE category.deleted_at IS NULL\n',
+            ),
+            VIEW.format(transaction_filter='', category_filter=''),
+        ),
+    ]
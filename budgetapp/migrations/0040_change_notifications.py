@@ -0,0 +1,95 @@
+# Generated by Django 2.1.2 on 2026-10-19 20:05
+
+from django.db import migrations
+
+# Tables whose writes are notified, with the entity type sent for them.
+NOTIFIED = (
+    ('budgetapp_budget', 'budget'),
+    ('budgetapp_budgetcategorygroup', 'budgetcategorygroup'),
+    ('budgetapp_budgetcategory', 'budgetcategory'),
+    ('budgetapp_transaction', 'transaction'),
+)
+
+# Notifies the owner's channel of each written row, with the type and pk of
+# the row and its new version (a sync cursor of its updated_at). Triggers
+# also cover the set-based writes in bulk.py and purge.py, which send no
+# signals. Notifications are only delivered once the transaction commits.
+FUNCTION = """
+CREATE FUNCTION budgetapp_notify_change() RETURNS trigger AS $$
+DECLARE
+    data jsonb;
+    owner integer;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        data := to_jsonb(OLD);
+    ELSE
+        data := to_jsonb(NEW);
+    END IF;
+
+    IF TG_ARGV[0] = 'budget' THEN
+        owner := (data->>'owner_id')::integer;
+    ELSIF TG_ARGV[0] = 'budgetcategorygroup' THEN
+        SELECT budget.owner_id INTO owner
+        FROM budgetapp_budget budget
+        WHERE budget.id = (data->>'budget_id')::integer;
+    ELSIF TG_ARGV[0] = 'budgetcategory' THEN
+        SELECT budget.owner_id INTO owner
+        FROM budgetapp_budgetcategorygroup grp
+        JOIN budgetapp_budget budget ON budget.id = grp.budget_id
+        WHERE grp.id = (data->>'group_id')::integer;
+    ELSE
+        SELECT budget.owner_id INTO owner
+        FROM budgetapp_budgetcategory category
+        JOIN budgetapp_budgetcategorygroup grp ON grp.id = category.group_id
+        JOIN budgetapp_budget budget ON budget.id = grp.budget_id
+        WHERE category.id = (data->>'budget_category_id')::integer;
+    END IF;
+
+    -- The owner is gone if the row is deleted along with its budget.
+    IF owner IS NOT NULL THEN
+        PERFORM pg_notify(
+            'budgetapp_changes_' || owner,
+            json_build_object(
+                'type', TG_ARGV[0],
+                'pk', (data->>'id')::integer,
+                'version', CASE WHEN TG_OP <> 'DELETE' THEN
+                    extract(epoch FROM date_trunc(
+                        'second', (data->>'updated_at')::timestamptz
+                    ))::bigint * 1000000
+                    + extract(microseconds FROM (
+                        data->>'updated_at')::timestamptz)::bigint % 1000000
+                END,
+                'deleted', TG_OP = 'DELETE' OR data->>'deleted_at' IS NOT NULL
+            )::text
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+TRIGGER = """
+CREATE TRIGGER {table}_notify
+AFTER INSERT OR UPDATE OR DELETE ON {table}
+FOR EACH ROW EXECUTE PROCEDURE budgetapp_notify_change('{type}');
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0039_job'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            FUNCTION,
+            'DROP FUNCTION budgetapp_notify_change();',
+        ),
+    ] + [
+        migrations.RunSQL(
+            TRIGGER.format(table=table, type=type_),
+            'DROP TRIGGER {table}_notify ON {table};'.format(table=table),
+        )
+        for table, type_ in NOTIFIED
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.1.2 on 2026-10-19 19:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('budgetapp', '0040_change_notifications'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=255)),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('content', models.BinaryField(default=b'')),
+                ('content_type', models.CharField(blank=True, max_length=255)),
+                ('location', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='idempotencykey',
+            unique_together={('owner', 'key')},
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.1.2 on 2026-10-19 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0041_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='budget',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='budgetcategory',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='budgetcategorygroup',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='importrule',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recurringtransaction',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 2.1.2 on 2026-10-19 20:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+FILL_BUDGET = """
+UPDATE budgetapp_budgetcategory category
+SET budget_id = grp.budget_id
+FROM budgetapp_budgetcategorygroup grp
+WHERE grp.id = category.group_id
+"""
+
+# Uniqueness was only checked when categories were saved through the API,
+# so live duplicates in a budget have to be merged before the index can be
+# created. They are not renamed here, since renaming them would break their
+# carryover and could collide with other names.
+FIND_DUPLICATES = """
+SELECT budget.owner_id, budget.month, budget.year, category.category,
+    count(*)
+FROM budgetapp_budgetcategory category
+JOIN budgetapp_budgetcategorygroup grp ON grp.id = category.group_id
+JOIN budgetapp_budget budget ON budget.id = grp.budget_id
+WHERE category.deleted_at IS NULL
+GROUP BY budget.owner_id, budget.month, budget.year, category.category
+HAVING count(*) > 1
+ORDER BY budget.owner_id, budget.year, budget.month, category.category
+"""
+
+
+def check_duplicates(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(FIND_DUPLICATES)
+        duplicates = cursor.fetchall()
+
+    if duplicates:
+        raise RuntimeError(
+            'Budgets have categories with the same name, which must be '
+            'merged with `manage.py merge_duplicate_categories` before this '
+            'migration:\n' + '\n'.join(
+                '  user {}, {} {}: "{}" ({} categories)'.format(*duplicate)
+                for duplicate in duplicates
+            )
+        )
+
+
+# Keeps the budget of each category in step with its group, whether it is
+# written by the ORM or with SQL.
+TRIGGERS = """
+CREATE FUNCTION budgetapp_category_budget() RETURNS trigger AS $$
+BEGIN
+    SELECT budget_id INTO NEW.budget_id
+    FROM budgetapp_budgetcategorygroup
+    WHERE id = NEW.group_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER budgetapp_budgetcategory_budget
+BEFORE INSERT OR UPDATE OF group_id, budget_id ON budgetapp_budgetcategory
+FOR EACH ROW EXECUTE PROCEDURE budgetapp_category_budget();
+
+CREATE FUNCTION budgetapp_group_budget() RETURNS trigger AS $$
+BEGIN
+    UPDATE budgetapp_budgetcategory
+    SET budget_id = NEW.budget_id
+    WHERE group_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER budgetapp_budgetcategorygroup_budget
+AFTER UPDATE OF budget_id ON budgetapp_budgetcategorygroup
+FOR EACH ROW WHEN (OLD.budget_id IS DISTINCT FROM NEW.budget_id)
+EXECUTE PROCEDURE budgetapp_group_budget();
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER budgetapp_budgetcategorygroup_budget
+    ON budgetapp_budgetcategorygroup;
+DROP FUNCTION budgetapp_group_budget();
+DROP TRIGGER budgetapp_budgetcategory_budget ON budgetapp_budgetcategory;
+DROP FUNCTION budgetapp_category_budget();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0042_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicates, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='budgetcategory',
+            name='budget',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='budgetapp.Budget'),
+        ),
+        migrations.RunSQL(FILL_BUDGET, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='budgetcategory',
+            name='budget',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='budgetapp.Budget'),
+        ),
+        migrations.RunSQL(TRIGGERS, DROP_TRIGGERS),
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX category_name_uniq '
+            'ON budgetapp_budgetcategory (budget_id, category) '
+            'WHERE deleted_at IS NULL',
+            'DROP INDEX category_name_uniq',
+        ),
+    ]
@@ -0,0 +1,126 @@
+# Generated by Django 2.1.2 on 2026-10-19 21:10
+
+from django.db import migrations
+
+# Sends the row's version, which ETag and If-Match use, as `version`, and
+# the sync cursor of its updated_at as `cursor`.
+FUNCTION = """
+CREATE OR REPLACE FUNCTION budgetapp_notify_change() RETURNS trigger AS $$
+DECLARE
+    data jsonb;
+    owner integer;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        data := to_jsonb(OLD);
+    ELSE
+        data := to_jsonb(NEW);
+    END IF;
+
+    IF TG_ARGV[0] = 'budget' THEN
+        owner := (data->>'owner_id')::integer;
+    ELSIF TG_ARGV[0] = 'budgetcategorygroup' THEN
+        SELECT budget.owner_id INTO owner
+        FROM budgetapp_budget budget
+        WHERE budget.id = (data->>'budget_id')::integer;
+    ELSIF TG_ARGV[0] = 'budgetcategory' THEN
+        SELECT budget.owner_id INTO owner
+        FROM budgetapp_budgetcategorygroup grp
+        JOIN budgetapp_budget budget ON budget.id = grp.budget_id
+        WHERE grp.id = (data->>'group_id')::integer;
+    ELSE
+        SELECT budget.owner_id INTO owner
+        FROM budgetapp_budgetcategory category
+        JOIN budgetapp_budgetcategorygroup grp ON grp.id = category.group_id
+        JOIN budgetapp_budget budget ON budget.id = grp.budget_id
+        WHERE category.id = (data->>'budget_category_id')::integer;
+    END IF;
+
+    -- The owner is gone if the row is deleted along with its budget.
+    IF owner IS NOT NULL THEN
+        PERFORM pg_notify(
+            'budgetapp_changes_' || owner,
+            json_build_object(
+                'type', TG_ARGV[0],
+                'pk', (data->>'id')::integer,
+                'version', (data->>'version')::integer,
+                'cursor', CASE WHEN TG_OP <> 'DELETE' THEN
+                    extract(epoch FROM date_trunc(
+                        'second', (data->>'updated_at')::timestamptz
+                    ))::bigint * 1000000
+                    + extract(microseconds FROM (
+                        data->>'updated_at')::timestamptz)::bigint % 1000000
+                END,
+                'deleted', TG_OP = 'DELETE' OR data->>'deleted_at' IS NOT NULL
+            )::text
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# The function of migration 0040, which sent the cursor as `version`.
+OLD_FUNCTION = """
+CREATE OR REPLACE FUNCTION budgetapp_notify_change() RETURNS trigger AS $$
+DECLARE
+    data jsonb;
+    owner integer;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        data := to_jsonb(OLD);
+    ELSE
+        data := to_jsonb(NEW);
+    END IF;
+
+    IF TG_ARGV[0] = 'budget' THEN
+        owner := (data->>'owner_id')::integer;
+    ELSIF TG_ARGV[0] = 'budgetcategorygroup' THEN
+        SELECT budget.owner_id INTO owner
+        FROM budgetapp_budget budget
+        WHERE budget.id = (data->>'budget_id')::integer;
+    ELSIF TG_ARGV[0] = 'budgetcategory' THEN
+        SELECT budget.owner_id INTO owner
+        FROM budgetapp_budgetcategorygroup grp
+        JOIN budgetapp_budget budget ON budget.id = grp.budget_id
+        WHERE grp.id = (data->>'group_id')::integer;
+    ELSE
+        SELECT budget.owner_id INTO owner
+        FROM budgetapp_budgetcategory category
+        JOIN budgetapp_budgetcategorygroup grp ON grp.id = category.group_id
+        JOIN budgetapp_budget budget ON budget.id = grp.budget_id
+        WHERE category.id = (data->>'budget_category_id')::integer;
+    END IF;
+
+    -- The owner is gone if the row is deleted along with its budget.
+    IF owner IS NOT NULL THEN
+        PERFORM pg_notify(
+            'budgetapp_changes_' || owner,
+            json_build_object(
+                'type', TG_ARGV[0],
+                'pk', (data->>'id')::integer,
+                'version', CASE WHEN TG_OP <> 'DELETE' THEN
+                    extract(epoch FROM date_trunc(
+                        'second', (data->>'updated_at')::timestamptz
+                    ))::bigint * 1000000
+                    + extract(microseconds FROM (
+                        data->>'updated_at')::timestamptz)::bigint % 1000000
+                END,
+                'deleted', TG_OP = 'DELETE' OR data->>'deleted_at' IS NOT NULL
+            )::text
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0043_category_budget'),
+    ]
+
+    operations = [
+        migrations.RunSQL(FUNCTION, OLD_FUNCTION),
+    ]
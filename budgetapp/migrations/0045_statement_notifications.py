@@ -0,0 +1,134 @@
+# Generated by Django 2.1.2 on 2026-10-19 22:30
+
+from importlib import import_module
+
+from django.db import migrations
+
+change_notifications = import_module(
+    'budgetapp.migrations.0040_change_notifications')
+notify_version = import_module('budgetapp.migrations.0044_notify_version')
+
+# Tables whose writes are notified, with the entity type sent for them, the
+# owner of a changed row and the joins needed to find it.
+NOTIFIED = (
+    ('budgetapp_budget', 'budget', 'changed.owner_id', ''),
+    ('budgetapp_budgetcategorygroup', 'budgetcategorygroup',
+     'budget.owner_id',
+     'JOIN budgetapp_budget budget ON budget.id = changed.budget_id'),
+    ('budgetapp_budgetcategory', 'budgetcategory', 'budget.owner_id',
+     'JOIN budgetapp_budget budget ON budget.id = changed.budget_id'),
+    ('budgetapp_transaction', 'transaction', 'budget.owner_id',
+     'JOIN budgetapp_budgetcategory category '
+     'ON category.id = changed.budget_category_id '
+     'JOIN budgetapp_budget budget ON budget.id = category.budget_id'),
+)
+
+EVENTS = (
+    ('insert', 'INSERT', 'NEW'),
+    ('update', 'UPDATE', 'NEW'),
+    ('delete', 'DELETE', 'OLD'),
+)
+
+# Notifies the channel of each owner of the rows written by a statement,
+# once per statement, with the pk, version, sync cursor of updated_at and
+# deletion of each row. An owner with more than 50 rows written by one
+# statement, as by the set-based writes in bulk.py, purge.py and the
+# rollover, is told to resync instead, which keeps the notification within
+# the 8000 bytes allowed, and the number of notifications of a transaction
+# small, since Postgres compares each with those already queued.
+FUNCTION = """
+CREATE FUNCTION budgetapp_notify_changes() RETURNS trigger AS $$
+DECLARE
+    notification record;
+BEGIN
+    FOR notification IN EXECUTE format(
+        $query$
+        SELECT owner, count(*) AS total, json_agg(json_build_object(
+            'pk', id,
+            'version', version,
+            'cursor', cursor,
+            'deleted', deleted
+        )) FILTER (WHERE position <= 50) AS changes
+        FROM (
+            SELECT *, row_number() OVER (PARTITION BY owner) AS position
+            FROM (
+                SELECT
+                    %s AS owner,
+                    changed.id,
+                    changed.version,
+                    CASE WHEN %L <> 'DELETE' THEN
+                        extract(epoch FROM date_trunc(
+                            'second', changed.updated_at))::bigint * 1000000
+                        + extract(microseconds FROM changed.updated_at
+                        )::bigint %% 1000000
+                    END AS cursor,
+                    %L = 'DELETE'
+                    OR to_jsonb(changed)->>'deleted_at' IS NOT NULL
+                    AS deleted
+                FROM changed_rows changed %s
+            ) owned
+        ) numbered
+        GROUP BY owner
+        $query$,
+        TG_ARGV[1], TG_OP, TG_OP, TG_ARGV[2]
+    ) LOOP
+        PERFORM pg_notify(
+            'budgetapp_changes_' || notification.owner,
+            CASE WHEN notification.total > 50 THEN
+                json_build_object('type', TG_ARGV[0], 'resync', true)
+            ELSE
+                json_build_object(
+                    'type', TG_ARGV[0], 'changes', notification.changes)
+            END::text
+        );
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+TRIGGER = """
+CREATE TRIGGER {table}_notify_{name}
+AFTER {event} ON {table}
+REFERENCING {transition} TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE budgetapp_notify_changes(
+    '{type}', '{owner}', '{joins}');
+"""
+
+DROP_TRIGGER = 'DROP TRIGGER {table}_notify_{name} ON {table};'
+
+DROP_ROW_TRIGGER = 'DROP TRIGGER {table}_notify ON {table};'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0044_notify_version'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            DROP_ROW_TRIGGER.format(table=table),
+            change_notifications.TRIGGER.format(table=table, type=type_),
+        )
+        for table, type_, owner, joins in NOTIFIED
+    ] + [
+        migrations.RunSQL(
+            'DROP FUNCTION budgetapp_notify_change();',
+            notify_version.FUNCTION,
+        ),
+        migrations.RunSQL(
+            FUNCTION,
+            'DROP FUNCTION budgetapp_notify_changes();',
+        ),
+    ] + [
+        migrations.RunSQL(
+            TRIGGER.format(
+                table=table, name=name, event=event, transition=transition,
+                type=type_, owner=owner, joins=joins,
+            ),
+            DROP_TRIGGER.format(table=table, name=name),
+        )
+        for table, type_, owner, joins in NOTIFIED
+        for name, event, transition in EVENTS
+    ]
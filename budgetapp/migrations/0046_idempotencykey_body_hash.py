@@ -0,0 +1,18 @@
+# Generated by Django 2.1.2 on 2026-10-19 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetapp', '0045_statement_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='body_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -1,13 +1,344 @@
-from datetime import datetime
+from calendar import monthrange
+from datetime import datetime, timedelta
 from decimal import Decimal
 
-from django.db import models
-from django.db.models import Sum
+from django.contrib.postgres.fields import JSONField
+from django.db import connection, models, transaction
+from django.db.models import Case, F, FilteredRelation, Q, Sum, Value, When
 from django.db.models.functions import Coalesce
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import resolution
+
+
+class LiveManager(models.Manager):
+    """
+    Excludes soft-deleted objects. Models using it as their default manager
+    also have an `all_objects` manager that includes them.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class BudgetManager(models.Manager):
+
+    def get_or_create_periods(self, owner, periods, lock=False):
+        """
+        Returns a dict mapping each of the given periods to the owner's
+        budget for it. Missing budgets are created with one insert, which
+        skips budgets created concurrently, and all of them are fetched
+        with one query. With `lock`, the budgets are locked for update, in
+        a consistent order so that concurrent callers do not deadlock.
+        """
+        periods = sorted(set(periods))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO budgetapp_budget
+                    (month, year, owner_id, updated_at, copy_token, version)
+                SELECT new.month, new.year, %s, %s, '', 1
+                FROM unnest(%s::varchar[], %s::integer[]) AS new (month, year)
+                ON CONFLICT (owner_id, month, year) DO NOTHING
+                """,
+                [
+                    owner.pk,
+                    timezone.now(),
+                    [Budget.from_period(period)[1] for period in periods],
+                    [Budget.from_period(period)[0] for period in periods],
+                ],
+            )
+
+        budgets = self.annotate(
+            budget_period=Budget.period_expression(),
+        ).filter(owner=owner, budget_period__in=periods)
+        if lock:
+            budgets = budgets.select_for_update().order_by('pk')
+
+        return {budget.period: budget for budget in budgets}
+
+    def get_or_create_group(self, owner, month, year, name):
+        """
+        Returns the pk of the live group with the given name in the owner's
+        budget for the given month, creating the budget and the group if
+        they do not exist, with one statement.
+        """
+        row = None
+        # A budget or group created concurrently after the statement began
+        # is neither inserted nor seen by it, but is seen when run again.
+        while row is None:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    WITH new_budget AS (
+                        INSERT INTO budgetapp_budget
+                            (month, year, owner_id, updated_at, copy_token,
+                             version)
+                        VALUES (%(month)s, %(year)s, %(owner)s, %(now)s, '', 1)
+                        ON CONFLICT (owner_id, month, year) DO NOTHING
+                        RETURNING id
+                    ), budget AS (
+                        SELECT id FROM new_budget
+                        UNION ALL
+                        SELECT id FROM budgetapp_budget
+                        WHERE owner_id = %(owner)s
+                        AND month = %(month)s AND year = %(year)s
+                    ), new_group AS (
+                        INSERT INTO budgetapp_budgetcategorygroup
+                            (name, budget_id, updated_at, version)
+                        SELECT %(name)s, id, %(now)s, 1 FROM budget
+                        ON CONFLICT (budget_id, name)
+                            WHERE deleted_at IS NULL DO NOTHING
+                        RETURNING id
+                    )
+                    SELECT id FROM new_group
+                    UNION ALL
+                    SELECT grp.id
+                    FROM budgetapp_budgetcategorygroup grp
+                    JOIN budget ON budget.id = grp.budget_id
+                    WHERE grp.name = %(name)s AND grp.deleted_at IS NULL
+                    """,
+                    {
+                        'owner': owner.pk,
+                        'month': month,
+                        'year': year,
+                        'name': name,
+                        'now': timezone.now(),
+                    },
+                )
+                row = cursor.fetchone()
+
+        return row[0]
+
+    def delete_categories(self, budgets):
+        """
+        Deletes the groups and categories of the given budgets of one
+        owner, and the transactions in them, with one statement. Their
+        tombstones are recorded, and carryover and payee usage are
+        recomputed.
+        """
+        budgets = list(budgets)
+        if not budgets:
+            return
+
+        owner_id = budgets[0].owner_id
+        keys = BudgetCategory.objects.carryover_keys(
+            group__budget__in=budgets)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH groups AS (
+                    DELETE FROM budgetapp_budgetcategorygroup
+                    WHERE budget_id = ANY(%(budgets)s)
+                    RETURNING id
+                ), categories AS (
+                    DELETE FROM budgetapp_budgetcategory
+                    WHERE group_id IN (SELECT id FROM groups)
+                    RETURNING id
+                ), transactions AS (
+                    DELETE FROM budgetapp_transaction
+                    WHERE budget_category_id IN (SELECT id FROM categories)
+                    RETURNING id, payee_id
+                ), tombstones AS (
+                    INSERT INTO budgetapp_tombstone
+                        (model, object_pk, owner_id, deleted_at)
+                    SELECT model, id, %(owner)s, %(now)s FROM (
+                        SELECT 'budgetcategorygroup' AS model, id FROM groups
+                        UNION ALL
+                        SELECT 'budgetcategory', id FROM categories
+                        UNION ALL
+                        SELECT 'transaction', id FROM transactions
+                    ) deleted
+                )
+                SELECT DISTINCT payee_id FROM transactions
+                """,
+                {
+                    'budgets': [budget.pk for budget in budgets],
+                    'owner': owner_id,
+                    'now': timezone.now(),
+                },
+            )
+            payee_ids = [row[0] for row in cursor.fetchall()]
+
+        BudgetCategory.objects.update_carryover(keys)
+        Payee.objects.update_usage(payee_ids)
+        resolution.invalidate(owner_id)
+
+    def copy_categories(self, source, targets):
+        """
+        Replaces the groups and categories of the given budgets with copies
+        of the source budget's, with a constant number of statements.
+        """
+        targets = [budget for budget in targets if budget.pk != source.pk]
+        if not targets:
+            return
+
+        self.delete_categories(targets)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH groups AS (
+                    INSERT INTO budgetapp_budgetcategorygroup
+                        (name, budget_id, updated_at, version)
+                    SELECT source.name, target.id, %(now)s, 1
+                    FROM budgetapp_budgetcategorygroup source
+                    CROSS JOIN unnest(%(targets)s::integer[]) AS target (id)
+                    WHERE source.budget_id = %(source)s
+                    AND source.deleted_at IS NULL
+                    RETURNING id, name, budget_id
+                )
+                INSERT INTO budgetapp_budgetcategory
+                    (category, group_id, budget_id, "limit", carryover,
+                     updated_at, version)
+                SELECT category.category, groups.id, groups.budget_id,
+                    category."limit", 0, %(now)s, 1
+                FROM budgetapp_budgetcategory category
+                JOIN budgetapp_budgetcategorygroup source
+                    ON source.id = category.group_id
+                JOIN groups ON groups.name = source.name
+                WHERE source.budget_id = %(source)s
+                AND category.deleted_at IS NULL
+                """,
+                {
+                    'source': source.pk,
+                    'targets': [budget.pk for budget in targets],
+                    'now': timezone.now(),
+                },
+            )
+
+        BudgetCategory.objects.update_carryover(
+            BudgetCategory.objects.carryover_keys(group__budget__in=targets))
+
+    def rollover(self, period):
+        """
+        Creates the budget for the given period for every active user who
+        has a budget for the month before but none for the period, copying
+        the groups and categories of the month before. All users are rolled
+        over with one statement, and categories start with the balance of
+        the category they were copied from. Returns the number of created
+        budgets.
+        """
+        year, month = Budget.from_period(period)
+        previous_year, previous_month = Budget.from_period(period - 1)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH previous AS (
+                    SELECT budget.id, budget.owner_id
+                    FROM budgetapp_budget budget
+                    JOIN auth_user owner ON owner.id = budget.owner_id
+                    WHERE budget.month = %(previous_month)s
+                    AND budget.year = %(previous_year)s
+                    AND owner.is_active
+                ), budgets AS (
+                    INSERT INTO budgetapp_budget
+                        (month, year, owner_id, updated_at, copy_token,
+                         version)
+                    SELECT %(month)s, %(year)s, owner_id, %(now)s, '', 1
+                    FROM previous
+                    ON CONFLICT (owner_id, month, year) DO NOTHING
+                    RETURNING id, owner_id
+                ), groups AS (
+                    INSERT INTO budgetapp_budgetcategorygroup
+                        (name, budget_id, updated_at, version)
+                    SELECT source.name, budgets.id, %(now)s, 1
+                    FROM budgets
+                    JOIN previous ON previous.owner_id = budgets.owner_id
+                    JOIN budgetapp_budgetcategorygroup source
+                        ON source.budget_id = previous.id
+                    WHERE source.deleted_at IS NULL
+                    RETURNING id, name, budget_id
+                ), categories AS (
+                    INSERT INTO budgetapp_budgetcategory
+                        (category, group_id, budget_id, "limit", carryover,
+                         updated_at, version)
+                    SELECT
+                        category.category,
+                        groups.id,
+                        groups.budget_id,
+                        category."limit",
+                        category.carryover + category."limit" - COALESCE((
+                            SELECT SUM(transaction.amount)
+                            FROM budgetapp_transaction transaction
+                            WHERE transaction.budget_category_id = category.id
+                            AND transaction.deleted_at IS NULL
+                        ), 0),
+                        %(now)s,
+                        1
+                    FROM groups
+                    JOIN budgets ON budgets.id = groups.budget_id
+                    JOIN previous ON previous.owner_id = budgets.owner_id
+                    JOIN budgetapp_budgetcategorygroup source
+                        ON source.budget_id = previous.id
+                        AND source.name = groups.name
+                        AND source.deleted_at IS NULL
+                    JOIN budgetapp_budgetcategory category
+                        ON category.group_id = source.id
+                        AND category.deleted_at IS NULL
+                )
+                SELECT id FROM budgets
+                """,
+                {
+                    'month': month,
+                    'year': year,
+                    'previous_month': previous_month,
+                    'previous_year': previous_year,
+                    'now': timezone.now(),
+                },
+            )
+            created = [row[0] for row in cursor.fetchall()]
+
+        # Categories of later budgets, if a user already has any, now carry
+        # over from the new ones.
+        later = self.annotate(period=Budget.period_expression()).filter(
+            owner__budgets__in=created, period__gt=period)
+        if later.exists():
+            BudgetCategory.objects.update_carryover(
+                BudgetCategory.objects.carryover_keys(
+                    group__budget__in=created,
+                    group__budget__owner__in=later.values('owner'),
+                )
+            )
+
+        return len(created)
+
+    def copy_budget(self, owner, periods, source=None, token=''):
+        """
+        Copies the groups and categories of the source budget into the
+        owner's budgets for the given periods, creating them as needed.
+        The source defaults to the budget of the month before the first
+        period. The targets are locked while copying, and a copy with the
+        same token as the last copy into all of them is skipped.
+        """
+        with transaction.atomic():
+            targets = self.get_or_create_periods(owner, periods, lock=True)
+            if token and all(
+                budget.copy_token == token for budget in targets.values()
+            ):
+                return
+
+            if not source:
+                source = targets[periods[0]].previous
+
+            # If there is a source budget, copy the categories. Otherwise,
+            # delete all categories, since the non-existing budget appears
+            # blank in the UI.
+            if source:
+                self.copy_categories(source, targets.values())
+            else:
+                self.delete_categories(targets.values())
+
+            if token:
+                self.filter(
+                    pk__in=[budget.pk for budget in targets.values()],
+                ).update(copy_token=token)
 
 
 class Budget(models.Model):
     related_name = 'budgets'
+    owner_lookup = 'owner'
 
     MONTH_CHOICES = (
         ('JAN', 'January'),
@@ -36,30 +367,57 @@ class Budget(models.Model):
     owner = models.ForeignKey(
         'auth.User', related_name=related_name, on_delete=models.CASCADE
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Incremented on each change by the user, and sent as the ETag.
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # The token of the last copy into this budget, so that a repeated copy
+    # request can be recognized and skipped.
+    copy_token = models.CharField(max_length=100, blank=True)
+
+    objects = BudgetManager()
+
+    @classmethod
+    def get_period(cls, year, month):
+        """
+        Returns a sequential month number for the given year and month,
+        so that months can be compared and counted.
+        """
+        return year * 12 + cls.MONTH_LOOKUP[month]
+
+    @classmethod
+    def from_period(cls, period):
+        """
+        Returns the (year, month) tuple for the given period.
+        """
+        return period // 12, cls.MONTH_CHOICES[period % 12][0]
+
+    @classmethod
+    def period_expression(cls, prefix=''):
+        """
+        Returns a query expression that computes the period of a budget.
+        The prefix is the lookup path to the budget, if any.
+        """
+        return F(prefix + 'year') * 12 + Case(
+            *(
+                When(**{prefix + 'month': month, 'then': Value(index)})
+                for month, index in cls.MONTH_LOOKUP.items()
+            ),
+            output_field=models.IntegerField()
+        )
+
+    @property
+    def period(self):
+        return self.get_period(self.year, self.month)
 
     def copy_categories(self, budget):
         """
         Removes all categories from budget and copies ones
         from the given budget.
         """
-        # Remove existing groups/categories.
-        self.delete_categories()
-
-        # Make copies of groups.
-        for group in budget.budget_category_groups.iterator():
-            categories = group.budget_categories.all()
-            group.pk = None
-            group.budget = self
-            group.save()
-
-            # Make copies of categories.
-            for category in categories:
-                category.pk = None
-                category.group = group
-                category.save()
+        Budget.objects.copy_categories(budget, [self])
 
     def delete_categories(self):
-        self.budget_category_groups.all().delete()
+        Budget.objects.delete_categories([self])
 
     @property
     def previous(self):
@@ -95,42 +453,236 @@ class Budget(models.Model):
 
 class BudgetCategoryGroup(models.Model):
     related_name = 'budget_category_groups'
+    owner_lookup = 'budget__owner'
     name = models.CharField(max_length=100)
     budget = models.ForeignKey(
         Budget, on_delete=models.CASCADE, related_name=related_name
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    # Names are unique among the live groups of a budget. This is enforced
+    # by a partial unique index, created in migration 0038.
 
     @property
     def owner(self):
         return self.budget.owner
 
-    class Meta:
-        unique_together = ('name', 'budget',)
-
     def __str__(self):  # pragma: no cover
         return self.name + ' [owner=' + self.budget.owner.username + ']'
 
 
+class BudgetCategoryManager(LiveManager):
+
+    def create_unique(self, group_id, category, limit, owner, month, year,
+                      group_name):
+        """
+        Creates a category in the given group with one statement, unless
+        the group's budget has a live category with the same name. The
+        group must still be live, with the given name, in the owner's budget
+        for the given month, since its pk may be a stale cache entry.
+        Returns the new category, or None if the name is taken or the group
+        does not match.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO budgetapp_budgetcategory
+                    (category, group_id, budget_id, "limit", carryover,
+                     updated_at, version)
+                SELECT %s, grp.id, grp.budget_id, %s, 0, %s, 1
+                FROM budgetapp_budgetcategorygroup grp
+                JOIN budgetapp_budget budget ON budget.id = grp.budget_id
+                WHERE grp.id = %s AND grp.deleted_at IS NULL
+                AND grp.name = %s AND budget.owner_id = %s
+                AND budget.month = %s AND budget.year = %s
+                ON CONFLICT (budget_id, category)
+                    WHERE deleted_at IS NULL DO NOTHING
+                RETURNING id
+                """,
+                [category, limit, timezone.now(), group_id, group_name,
+                 owner.pk, month, year],
+            )
+            row = cursor.fetchone()
+
+        if row is None:
+            return None
+
+        # Done by the post_save signal for categories saved by the ORM.
+        self.update_carryover(self.carryover_keys(pk=row[0]))
+        return self.select_related('group').get(pk=row[0])
+
+    def carryover_keys(self, **filters):
+        """
+        Returns the (owner pk, category name, period) keys of the
+        categories matching the given filters, for update_carryover().
+        """
+        return list(
+            self.filter(**filters)
+            .annotate(period=Budget.period_expression('group__budget__'))
+            .values_list('group__budget__owner', 'category', 'period')
+        )
+
+    def update_carryover(self, keys):
+        """
+        Recomputes the balance carried over into categories from the
+        same-named category of the previous month. For each given (owner
+        pk, category name, period) key, only the categories with that name
+        from that period onward are recomputed. Categories are loaded with
+        one query and the changed ones are saved with one update.
+
+        Each recomputed chain of same-named categories is locked until the
+        transaction ends, so that concurrent recomputations of a chain run
+        one after the other instead of overwriting each other's carryover.
+        """
+        starts = {}
+        for owner_id, name, period in keys:
+            key = (owner_id, name)
+            starts[key] = min(period, starts.get(key, period))
+
+        if not starts:
+            return
+
+        # Without a savepoint, since it is only needed to hold the locks.
+        with transaction.atomic(savepoint=False):
+            self.lock_chains(sorted(starts))
+            self.recompute_carryover(starts)
+
+    def lock_chains(self, keys):
+        """
+        Takes a transaction-level advisory lock on each of the given
+        (owner pk, category name) keys, in the given order, which must be
+        the same for all callers so that they cannot deadlock.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock('
+                'key.owner_id, hashtext(key.name)) '
+                'FROM unnest(%s::integer[], %s::text[]) WITH ORDINALITY '
+                'AS key (owner_id, name, position) '
+                'ORDER BY key.position',
+                [[owner_id for owner_id, name in keys],
+                 [name for owner_id, name in keys]],
+            )
+
+    def recompute_carryover(self, starts):
+        # The category before each start is loaded as well, to seed the
+        # carryover with its balance.
+        condition = Q()
+        for (owner_id, name), period in starts.items():
+            condition |= Q(
+                group__budget__owner=owner_id,
+                category=name,
+                period__gte=period - 1,
+            )
+
+        categories = (
+            self.annotate(
+                period=Budget.period_expression('group__budget__'),
+                live_transaction=FilteredRelation(
+                    'transaction',
+                    condition=Q(transaction__deleted_at__isnull=True),
+                ),
+                total_spent=Coalesce(
+                    Sum('live_transaction__amount'), Decimal(0)),
+            )
+            .filter(condition)
+            .order_by('group__budget__owner', 'category', 'period')
+            .values_list(
+                'pk', 'group__budget__owner', 'category', 'period',
+                'carryover', 'limit', 'total_spent',
+            )
+        )
+
+        changed = []
+        previous = None
+        balance = Decimal(0)
+        for pk, owner_id, name, period, carryover, limit, spent in categories:
+            # Only a category from the month right before carries over.
+            if previous == (owner_id, name, period - 1):
+                expected = balance
+            else:
+                expected = Decimal(0)
+
+            if period >= starts[(owner_id, name)] and carryover != expected:
+                carryover = expected
+                changed.append((pk, carryover))
+
+            previous = (owner_id, name, period)
+            balance = carryover + limit - spent
+
+        if changed:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'UPDATE {table} SET carryover = changed.carryover, '
+                    'updated_at = %s '
+                    'FROM unnest(%s::integer[], %s::numeric[]) '
+                    'AS changed (id, carryover) '
+                    'WHERE {table}.id = changed.id'.format(
+                        table=self.model._meta.db_table),
+                    [
+                        timezone.now(),
+                        [pk for pk, carryover in changed],
+                        [carryover for pk, carryover in changed],
+                    ]
+                )
+
+
 class BudgetCategory(models.Model):
     related_name = 'budget_categories'
+    owner_lookup = 'group__budget__owner'
     category = models.CharField(max_length=100)
     group = models.ForeignKey(
         BudgetCategoryGroup,
         on_delete=models.CASCADE,
         related_name=related_name
     )
+    # The budget of the group, so that names can be unique per budget. It
+    # is kept in step with the group by database triggers, created in
+    # migration 0043, so it is only up to date on loaded categories.
+    budget = models.ForeignKey(
+        Budget,
+        on_delete=models.CASCADE,
+        related_name='+',
+        editable=False,
+    )
     limit = models.DecimalField(
         max_digits=20, decimal_places=2, default=0
     )
+    # The balance of the same-named category of the previous month,
+    # maintained by BudgetCategoryManager.update_carryover().
+    carryover = models.DecimalField(
+        max_digits=20, decimal_places=2, default=0
+    )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    deleted_at = models.DateTimeField(null=True, blank=True)
 
-    @property
+    objects = BudgetCategoryManager()
+    all_objects = models.Manager()
+
+    # Filtering by category name across budgets is served by a partial
+    # index on live categories, created in migration 0038. Names are
+    # unique among the live categories of a budget, which is enforced by a
+    # partial unique index, created in migration 0043.
+
+    @cached_property
     def spent(self):
+        # Cached, since the balance is derived from it.
         return Decimal(
             Transaction.objects
             .filter(budget_category_id=self.pk)
             .aggregate(spent=Coalesce(Sum('amount'), Decimal(0)))['spent']
         )
 
+    @property
+    def balance(self):
+        return self.carryover + self.limit - self.spent
+
     @property
     def owner(self):
         return self.group.budget.owner
@@ -143,6 +695,7 @@ class BudgetCategory(models.Model):
 
 
 class Transaction(models.Model):
+    owner_lookup = 'budget_category__group__budget__owner'
     amount = models.DecimalField(
         max_digits=20, decimal_places=2
     )
@@ -151,6 +704,27 @@ class Transaction(models.Model):
         'BudgetCategory', on_delete=models.CASCADE
     )
     date = models.DateField()
+    recurring = models.ForeignKey(
+        'RecurringTransaction',
+        null=True,
+        blank=True,
+        related_name='transactions',
+        on_delete=models.SET_NULL,
+    )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        # Makes materializing recurring transactions idempotent. Deleted
+        # occurrences count, so that they are not materialized again.
+        unique_together = ('recurring', 'date')
+        # The filters of TransactionFilter are served by partial indexes on
+        # live transactions, created in migration 0038. The plain foreign
+        # key indexes cover deleted rows too, for cascades and the purge.
 
     @property
     def owner(self):
@@ -164,12 +738,458 @@ class Transaction(models.Model):
                + self.budget_category.group.budget.owner.username + ' '
 
 
+class PayeeManager(models.Manager):
+
+    def resolve(self, owner, names):
+        """
+        Returns a dict mapping each of the given names to the owner's
+        Payee with that name. Existing payees are fetched in one query
+        and the missing ones are created in one insert. Payees created
+        concurrently by another request are fetched again.
+        """
+        payees = self.resolve_keys((owner.pk, name) for name in names)
+        return {name: payee for (owner_id, name), payee in payees.items()}
+
+    def resolve_keys(self, keys):
+        """
+        Like resolve(), but for (owner pk, name) keys of any number of
+        owners.
+        """
+        keys = set(keys)
+        payees = {
+            (payee.owner_id, payee.name): payee
+            for payee in self.filter(
+                owner__in={owner_id for owner_id, name in keys},
+                name__in={name for owner_id, name in keys},
+            )
+            if (payee.owner_id, payee.name) in keys
+        }
+        missing = sorted(keys - set(payees))
+        if not missing:
+            return payees
+
+        # Payees inserted by another request since are skipped, instead of
+        # failing the insert, and fetched below.
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO budgetapp_payee
+                    (name, owner_id, updated_at, transaction_count)
+                SELECT key.name, key.owner_id, %s, 0
+                FROM unnest(%s::integer[], %s::varchar[])
+                    WITH ORDINALITY AS key (owner_id, name, position)
+                ORDER BY key.position
+                ON CONFLICT (name, owner_id) DO NOTHING
+                RETURNING id, owner_id, name
+                """,
+                [now, [owner_id for owner_id, name in missing],
+                 [name for owner_id, name in missing]],
+            )
+            for pk, owner_id, name in cursor.fetchall():
+                payees[(owner_id, name)] = self.model(
+                    pk=pk, owner_id=owner_id, name=name, updated_at=now)
+
+        conflicts = [key for key in missing if key not in payees]
+        if conflicts:
+            condition = Q()
+            for owner_id, name in conflicts:
+                condition |= Q(owner=owner_id, name=name)
+            for payee in self.filter(condition):
+                payees[(payee.owner_id, payee.name)] = payee
+
+        return payees
+
+    def update_usage(self, pks):
+        """
+        Recomputes the transaction count and last used date of the payees
+        with the given pks, with one query. Live transactions are counted
+        through the partial (payee, date) index.
+        """
+        pks = sorted(set(pks) - {None})
+        if not pks:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE budgetapp_payee payee
+                SET transaction_count = usage.transaction_count,
+                    last_used = usage.last_used
+                FROM (
+                    SELECT
+                        payee.id,
+                        COUNT(transaction.id) AS transaction_count,
+                        MAX(transaction.date) AS last_used
+                    FROM unnest(%s::integer[]) AS payee(id)
+                    LEFT JOIN budgetapp_transaction transaction
+                        ON transaction.payee_id = payee.id
+                        AND transaction.deleted_at IS NULL
+                    GROUP BY payee.id
+                ) usage
+                WHERE payee.id = usage.id
+                AND (payee.transaction_count, payee.last_used)
+                    IS DISTINCT FROM (usage.transaction_count, usage.last_used)
+                """,
+                [pks],
+            )
+
+
 class Payee(models.Model):
+    owner_lookup = 'owner'
     name = models.CharField(max_length=30)
     owner = models.ForeignKey('auth.User', on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Usage of the payee, maintained by PayeeManager.update_usage() to rank
+    # autocomplete suggestions without reading transactions.
+    transaction_count = models.PositiveIntegerField(default=0)
+    last_used = models.DateField(null=True, blank=True)
+
+    objects = PayeeManager()
 
     class Meta:
         unique_together = ('name', 'owner',)
+        indexes = [
+            models.Index(
+                fields=['owner', '-transaction_count', '-last_used'],
+                name='payee_usage_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
+
+
+class RecurringTransaction(models.Model):
+    """
+    A transaction that repeats on a schedule, such as rent or a paycheck.
+    Occurrences are created as transactions by the materialize_recurring
+    command, in the category with the given name in that month's budget.
+    """
+    FREQUENCY_CHOICES = (
+        ('WEEKLY', 'Weekly'),
+        ('MONTHLY', 'Monthly'),
+        ('YEARLY', 'Yearly'),
+    )
+
+    amount = models.DecimalField(
+        max_digits=20, decimal_places=2
+    )
+    payee = models.CharField(max_length=30)
+    category = models.CharField(max_length=100)
+    frequency = models.CharField(
+        max_length=100,
+        choices=FREQUENCY_CHOICES,
+        default='MONTHLY',
+    )
+    start_date = models.DateField()
+    end_date = models.DateField(null=True, blank=True)
+    # The date of the next occurrence that has not been materialized.
+    next_date = models.DateField(db_index=True)
+    owner = models.ForeignKey(
+        'auth.User',
+        related_name='recurring_transactions',
+        on_delete=models.CASCADE,
+    )
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    def get_next_date(self, date):
+        """
+        Returns the date of the occurrence after the given one. Monthly
+        and yearly occurrences keep the day of the start date where the
+        month has it, e.g. the 31st falls on the 30th in April.
+        """
+        if self.frequency == 'WEEKLY':
+            return date + timedelta(weeks=1)
+
+        months = 1 if self.frequency == 'MONTHLY' else 12
+        year, month = divmod(date.year * 12 + date.month - 1 + months, 12)
+        month += 1
+        day = min(self.start_date.day, monthrange(year, month)[1])
+        return date.replace(year=year, month=month, day=day)
+
+    def __str__(self):  # pragma: no cover
+        return self.payee + ' ' + str(self.amount) + ' ' + \
+               self.frequency + ' [owner=' + self.owner.username + ']'
+
+
+class ImportRule(models.Model):
+    """
+    Maps imported bank statement rows to a payee and category. A rule
+    applies to a row when its match text appears in the row's
+    description. Rules are tried in order of creation.
+    """
+    match = models.CharField(max_length=100)
+    payee = models.CharField(max_length=30, blank=True)
+    category = models.CharField(max_length=100)
+    owner = models.ForeignKey(
+        'auth.User', related_name='import_rules', on_delete=models.CASCADE
+    )
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        ordering = ('pk',)
+
+    def applies_to(self, description):
+        return self.match.lower() in description.lower()
+
+    def __str__(self):  # pragma: no cover
+        return self.match + ' [owner=' + self.owner.username + ']'
+
+
+class Tombstone(models.Model):
+    """
+    Records the deletion of an object, so that clients syncing changes
+    can remove their copy of it. The owner is not a database constraint,
+    since tombstones are written while the owner itself may be deleted.
+    """
+    model = models.CharField(max_length=100)
+    object_pk = models.IntegerField()
+    owner = models.ForeignKey(
+        'auth.User',
+        related_name='tombstones',
+        on_delete=models.CASCADE,
+        db_constraint=False,
+    )
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        index_together = ('owner', 'deleted_at')
+
+    @classmethod
+    def record(cls, instance):
+        """
+        Records the deletion of the given instance of a synced model.
+        """
+        owner_id = (
+            type(instance)._base_manager
+            .filter(pk=instance.pk)
+            .values_list(instance.owner_lookup, flat=True)
+            .first()
+        )
+        if owner_id is not None:
+            cls.objects.create(
+                model=instance._meta.model_name,
+                object_pk=instance.pk,
+                owner_id=owner_id,
+            )
+
+
+class AccountDeletion(models.Model):
+    """
+    A user account queued for deletion by a delete_user job. The user is
+    deactivated when the deletion is requested, and is hidden from the API
+    until the purge removes them. The purge_accounts command deletes any
+    accounts left over, e.g. by a failed job.
+    """
+    user = models.OneToOneField(
+        'auth.User',
+        primary_key=True,
+        related_name='deletion',
+        on_delete=models.CASCADE,
+    )
+    requested_at = models.DateTimeField(auto_now_add=True)
+
+
+class Job(models.Model):
+    """
+    An operation run in the background by the run_jobs command, such as a
+    statement import. See jobs.py.
+    """
+    STATUS_CHOICES = (
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+
+    kind = models.CharField(max_length=100)
+    owner = models.ForeignKey(
+        'auth.User', related_name='jobs', on_delete=models.CASCADE,
+        null=True, blank=True,
+    )
+    params = JSONField(default=dict)
+    # Input too large for params, such as the contents of a statement.
+    payload = models.TextField(blank=True)
+    status = models.CharField(
+        max_length=100, choices=STATUS_CHOICES, default='QUEUED')
+    result = JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    # When a queued job may run next. While a job is running, this is when
+    # its lease expires, after which another worker may claim it.
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_claim_idx'),
+        ]
+
+    def __str__(self):  # pragma: no cover
+        return self.kind + ' ' + self.status
+
+
+class IdempotencyKeyManager(models.Manager):
+
+    def claim(self, owner, key, method, path, body_hash):
+        """
+        Claims the given key of the given user for a request, unless it was
+        claimed less than TTL ago, or less than LEASE ago by a request that
+        is still in progress. Returns the key and whether it was claimed.
+        """
+        record, created = self.get_or_create(owner=owner, key=key, defaults={
+            'method': method,
+            'path': path,
+            'body_hash': body_hash,
+        })
+        now = timezone.now()
+        if record.status_code is None:
+            expires_at = record.created_at + IdempotencyKey.LEASE
+        else:
+            expires_at = record.created_at + IdempotencyKey.TTL
+        if created or expires_at > now:
+            return record, created
+
+        # The key expired, or the request that claimed it never finished,
+        # so it is claimed again, unless another request claims it first.
+        changes = {
+            'method': method,
+            'path': path,
+            'body_hash': body_hash,
+            'status_code': None,
+            'content': b'',
+            'content_type': '',
+            'location': '',
+            'created_at': now,
+        }
+        claimed = self.filter(
+            pk=record.pk, created_at=record.created_at,
+            status_code=record.status_code,
+        ).update(**changes)
+        if not claimed:
+            return self.get(pk=record.pk), False
+
+        for field, value in changes.items():
+            setattr(record, field, value)
+        return record, True
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response to a request with an Idempotency-Key header, returned
+    again for retries of the request with the same key. The status code is
+    null while the first request is being handled, which may take at most
+    LEASE before the key can be claimed again.
+    """
+    TTL = timedelta(days=1)
+    LEASE = timedelta(minutes=5)
+
+    owner = models.ForeignKey(
+        'auth.User', related_name='idempotency_keys',
+        on_delete=models.CASCADE,
+    )
+    key = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    body_hash = models.CharField(max_length=64, blank=True)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content = models.BinaryField(default=b'')
+    content_type = models.CharField(max_length=255, blank=True)
+    location = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = IdempotencyKeyManager()
+
+    class Meta:
+        unique_together = ('owner', 'key')
+
+    def __str__(self):  # pragma: no cover
+        return self.key
+
+    def store(self, response):
+        """
+        Stores the given rendered response to the request, unless the key
+        was claimed again since.
+        """
+        self.claimed().update(
+            status_code=response.status_code,
+            content=response.content,
+            content_type=response.get('Content-Type', ''),
+            location=response.get('Location', ''),
+        )
+
+    def release(self):
+        """
+        Releases the key after the request failed, so that it can be
+        retried.
+        """
+        self.claimed().delete()
+
+    def claimed(self):
+        # The key as long as it is still claimed by this request.
+        return IdempotencyKey.objects.filter(
+            pk=self.pk, created_at=self.created_at, status_code=None)
+
+    def replay(self):
+        response = HttpResponse(
+            bytes(self.content),
+            status=self.status_code,
+            content_type=self.content_type,
+        )
+        if self.location:
+            response['Location'] = self.location
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+
+class CategoryTotal(models.Model):
+    """
+    Read-only totals per category, backed by a materialized view that joins
+    categories to their transactions, groups and budgets. The view is not
+    updated on writes; it must be refreshed with refresh().
+    """
+    category = models.OneToOneField(
+        BudgetCategory,
+        primary_key=True,
+        related_name='total',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    owner = models.ForeignKey(
+        'auth.User',
+        related_name='category_totals',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    budget = models.ForeignKey(
+        Budget,
+        related_name='category_totals',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    year = models.IntegerField()
+    month = models.CharField(max_length=100, choices=Budget.MONTH_CHOICES)
+    period = models.IntegerField()
+    group_name = models.CharField(max_length=100)
+    category_name = models.CharField(max_length=100)
+    limit = models.DecimalField(max_digits=20, decimal_places=2)
+    spent = models.DecimalField(max_digits=20, decimal_places=2)
+    transaction_count = models.IntegerField()
+
+    class Meta:
+        managed = False
+        db_table = 'budgetapp_categorytotal'
+
+    @classmethod
+    def refresh(cls, concurrently=True):
+        """
+        Recomputes the view. A concurrent refresh does not block readers.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('REFRESH MATERIALIZED VIEW {}{}'.format(
+                'CONCURRENTLY ' if concurrently else '',
+                cls._meta.db_table,
+            ))
@@ -0,0 +1,189 @@
+"""
+Fast deletion of whole budgets and user accounts, and purging of
+soft-deleted objects.
+
+Django's delete() loads every related object into memory and sends signals
+for each of them. Here rows are deleted with set-based statements in
+dependency order, in batches of bounded size, so that no statement holds
+its locks for long. Tombstones, carryover and payee usage are maintained
+for the whole set, as in bulk.py.
+
+Deleting a budget is a single transaction, so the locks of its rows are
+held until all of them are deleted. Budgets are small enough for that, and
+a partly deleted budget would be visible to its owner. Deleting a user
+commits each batch on its own instead, since a user's data may be large
+and nobody is left to see it partly deleted.
+"""
+import time
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import resolution
+from .models import (AccountDeletion, Budget, BudgetCategory,
+                     BudgetCategoryGroup, IdempotencyKey, ImportRule, Payee,
+                     RecurringTransaction, Tombstone, Transaction)
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def delete_batches(queryset, batch_size=DEFAULT_BATCH_SIZE, owner_id=None,
+                   returning='id', pause=0, progress=None):
+    """
+    Deletes the given objects in batches of at most batch_size rows, one
+    statement per batch, sleeping for `pause` seconds between batches.
+    Tombstones are recorded in the same statement if an owner is given.
+    `progress` is called after each batch, if given. Returns the set of
+    values of the `returning` column of the deleted rows.
+    """
+    model = queryset.model
+    sql, params = (
+        queryset.order_by().values('pk')[:batch_size]
+        .query.sql_with_params()
+    )
+    values = set()
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH deleted AS (
+                    DELETE FROM {table}
+                    WHERE id IN ({batch})
+                    RETURNING id, {returning} AS value
+                ), tombstones AS (
+                    INSERT INTO budgetapp_tombstone
+                        (model, object_pk, owner_id, deleted_at)
+                    SELECT %s, id, %s, now() FROM deleted
+                    WHERE %s
+                )
+                SELECT value FROM deleted
+                """.format(
+                    table=model._meta.db_table,
+                    batch=sql,
+                    returning=returning,
+                ),
+                list(params) + [
+                    model._meta.model_name, owner_id, owner_id is not None,
+                ],
+            )
+            rows = cursor.fetchall()
+
+        values.update(row[0] for row in rows)
+        if progress is not None:
+            progress()
+        if len(rows) < batch_size:
+            return values
+        time.sleep(pause)
+
+
+def delete_budget(budget, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Deletes the given budget with its groups, categories and transactions,
+    recording their tombstones. The carryover of the following month and
+    the usage of the budget's payees are recomputed. Unlike delete_user(),
+    all batches run in one transaction, so that the budget is deleted
+    completely or not at all.
+    """
+    owner_id = budget.owner_id
+    keys = BudgetCategory.objects.carryover_keys(group__budget=budget)
+    with transaction.atomic():
+        payee_ids = delete_batches(
+            Transaction.all_objects.filter(
+                budget_category__group__budget=budget),
+            batch_size, owner_id, returning='payee_id',
+        )
+        delete_batches(
+            BudgetCategory.all_objects.filter(group__budget=budget),
+            batch_size, owner_id,
+        )
+        delete_batches(
+            BudgetCategoryGroup.all_objects.filter(budget=budget),
+            batch_size, owner_id,
+        )
+        delete_batches(Budget.objects.filter(pk=budget.pk), 1, owner_id)
+
+        BudgetCategory.objects.update_carryover(keys)
+        Payee.objects.update_usage(payee_ids)
+        resolution.invalidate(owner_id)
+
+
+def delete_user(user, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Deletes the given user and all of their data. No tombstones are
+    recorded, since nobody is left to sync them. Outside of a transaction
+    each batch is committed on its own, so an interrupted purge is resumed
+    by running it again. `progress` is called after each batch, if given.
+    """
+    querysets = (
+        Transaction.all_objects.filter(
+            budget_category__group__budget__owner=user),
+        BudgetCategory.all_objects.filter(group__budget__owner=user),
+        BudgetCategoryGroup.all_objects.filter(budget__owner=user),
+        Budget.objects.filter(owner=user),
+        RecurringTransaction.objects.filter(owner=user),
+        ImportRule.objects.filter(owner=user),
+        Payee.objects.filter(owner=user),
+        Tombstone.objects.filter(owner=user),
+        IdempotencyKey.objects.filter(owner=user),
+    )
+    for queryset in querysets:
+        delete_batches(queryset, batch_size, progress=progress)
+
+    # Only a few rows are left, such as the auth token, and the collector
+    # finds the user's data already gone.
+    user.delete()
+
+
+def request_user_deletion(user):
+    """
+    Deactivates the given user, so that they can no longer sign in, and
+    queues their account for the purge_accounts command.
+    """
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        AccountDeletion.objects.get_or_create(user=user)
+
+
+def purge_accounts(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Deletes all accounts queued for deletion. Returns the number of
+    deleted accounts.
+    """
+    deletions = AccountDeletion.objects.select_related('user') \
+        .order_by('requested_at')
+    purged = 0
+    for deletion in deletions:
+        delete_user(deletion.user, batch_size)
+        purged += 1
+
+    return purged
+
+
+def purge_deleted(before, batch_size=DEFAULT_BATCH_SIZE, pause=0):
+    """
+    Deletes the transactions, categories and groups that were soft deleted
+    before the given time, in throttled batches. Their tombstones were
+    recorded when they were soft deleted. Returns the number of deleted
+    objects of each model.
+    """
+    purged = {}
+    for model in (Transaction, BudgetCategory, BudgetCategoryGroup):
+        purged[model._meta.model_name] = len(delete_batches(
+            model.all_objects.filter(deleted_at__lt=before),
+            batch_size, pause=pause,
+        ))
+
+    return purged
+
+
+def purge_idempotency_keys(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Deletes the stored responses of idempotency keys that expired. Returns
+    the number of deleted keys.
+    """
+    return len(delete_batches(
+        IdempotencyKey.objects.filter(
+            created_at__lt=timezone.now() - IdempotencyKey.TTL),
+        batch_size,
+    ))
@@ -0,0 +1,158 @@
+"""
+Materializes due occurrences of recurring transactions for all users.
+"""
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+
+from .models import (Budget, BudgetCategory, Payee, RecurringTransaction,
+                     Transaction)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def get_occurrences(rule, today):
+    """
+    Returns the dates of the rule's occurrences due on or before today.
+    """
+    dates = []
+    date = rule.next_date
+    while date <= today and (rule.end_date is None or date <= rule.end_date):
+        dates.append(date)
+        date = rule.get_next_date(date)
+
+    return dates
+
+
+def resolve_categories(occurrences):
+    """
+    Returns a dict mapping (owner pk, year, month, category name) keys to
+    category pks for the given (rule, date) occurrences, with one query.
+    """
+    rules = {rule for rule, date in occurrences}
+    categories = BudgetCategory.objects.filter(
+        group__budget__owner__in={rule.owner_id for rule in rules},
+        group__budget__year__in={date.year for rule, date in occurrences},
+        category__in={rule.category for rule in rules},
+    ).values_list(
+        'pk', 'group__budget__owner', 'group__budget__year',
+        'group__budget__month', 'category',
+    )
+    return {
+        (owner_id, year, month, name): pk
+        for pk, owner_id, year, month, name in categories
+    }
+
+
+def category_key(rule, date):
+    return (
+        rule.owner_id,
+        date.year,
+        Budget.MONTH_CHOICES[date.month - 1][0],
+        rule.category,
+    )
+
+
+def materialize_batch(rules, today):
+    """
+    Creates the due transactions of the given rules and advances their next
+    dates, with a fixed number of queries. A rule stops at the first
+    occurrence whose month has no matching category, so that it is retried
+    once the budget exists. Returns the number of created and pending
+    occurrences.
+    """
+    occurrences = [
+        (rule, date) for rule in rules for date in get_occurrences(rule, today)
+    ]
+    if not occurrences:
+        return 0, 0
+
+    categories = resolve_categories(occurrences)
+
+    ready = []
+    next_dates = {rule.pk: rule.next_date for rule in rules}
+    pending = 0
+    for rule, date in occurrences:
+        category = categories.get(category_key(rule, date))
+        if category is None or next_dates[rule.pk] != date:
+            pending += 1
+            continue
+        ready.append((rule, date, category))
+        next_dates[rule.pk] = rule.get_next_date(date)
+
+    # Occurrences materialized by an earlier, interrupted run are skipped,
+    # as are deleted ones.
+    existing = set(
+        Transaction.all_objects.filter(
+            recurring__in=rules,
+            date__in={date for rule, date, category in ready},
+        ).values_list('recurring', 'date')
+    )
+    ready = [item for item in ready if (item[0].pk, item[1]) not in existing]
+
+    payees = Payee.objects.resolve_keys(
+        (rule.owner_id, rule.payee) for rule, date, category in ready)
+    Transaction.objects.bulk_create(
+        Transaction(
+            amount=rule.amount,
+            date=date,
+            payee=payees[(rule.owner_id, rule.payee)],
+            budget_category_id=category,
+            recurring=rule,
+        )
+        for rule, date, category in ready
+    )
+
+    advanced = [
+        rule for rule in rules if next_dates[rule.pk] != rule.next_date
+    ]
+    if advanced:
+        RecurringTransaction.objects.filter(
+            pk__in=[rule.pk for rule in advanced]
+        ).update(
+            next_date=Case(
+                *(
+                    When(pk=rule.pk, then=Value(next_dates[rule.pk]))
+                    for rule in advanced
+                )
+            )
+        )
+
+    BudgetCategory.objects.update_carryover(
+        BudgetCategory.objects.carryover_keys(
+            pk__in={category for rule, date, category in ready})
+    )
+    Payee.objects.update_usage(payee.pk for payee in payees.values())
+
+    return len(ready), pending
+
+
+def materialize_due(today, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Materializes the occurrences of all users' recurring transactions that
+    are due on or before today, in batches of rules. Rules locked by a
+    concurrent run are skipped, and repeated runs do not create duplicates.
+    Returns the number of created and pending occurrences.
+    """
+    created = pending = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            rules = list(
+                RecurringTransaction.objects
+                .filter(pk__gt=last_pk, next_date__lte=today)
+                .filter(
+                    Q(end_date__isnull=True) |
+                    Q(end_date__gte=F('next_date'))
+                )
+                .order_by('pk')
+                .select_for_update(skip_locked=True)[:batch_size]
+            )
+            if not rules:
+                break
+
+            batch_created, batch_pending = materialize_batch(rules, today)
+            created += batch_created
+            pending += batch_pending
+            last_pk = rules[-1].pk
+
+    return created, pending
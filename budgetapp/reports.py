@@ -0,0 +1,167 @@
+"""
+Reports computed from budget and transaction data over a range of months.
+"""
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.db import connection
+
+from .models import Budget, CategoryTotal
+
+ANALYTICS_FIELDS = (
+    'spent', 'year_to_date', 'rolling_3', 'rolling_12', 'change',
+)
+
+# The window frames use RANGE offsets over the period, so months without
+# a category count as zero spent rather than being skipped.
+ANALYTICS_SQL = """
+WITH totals AS (
+    SELECT {key} AS name, period, SUM(spent) AS spent
+    FROM budgetapp_categorytotal
+    WHERE owner_id = %(owner)s AND period BETWEEN %(from)s AND %(end)s
+    GROUP BY {key}, period
+), windowed AS (
+    SELECT
+        name,
+        period,
+        spent,
+        SUM(spent) OVER (
+            PARTITION BY name, period / 12 ORDER BY period
+        ) AS year_to_date,
+        ROUND(SUM(spent) OVER (
+            PARTITION BY name ORDER BY period
+            RANGE BETWEEN 2 PRECEDING AND CURRENT ROW
+        ) / 3, 2) AS rolling_3,
+        ROUND(SUM(spent) OVER (
+            PARTITION BY name ORDER BY period
+            RANGE BETWEEN 11 PRECEDING AND CURRENT ROW
+        ) / 12, 2) AS rolling_12,
+        spent - COALESCE(SUM(spent) OVER (
+            PARTITION BY name ORDER BY period
+            RANGE BETWEEN 1 PRECEDING AND 1 PRECEDING
+        ), 0) AS change
+    FROM totals
+)
+SELECT name, period, {fields}
+FROM windowed
+WHERE period >= %(start)s
+ORDER BY name, period
+"""
+
+
+def spending_report(owner, start, end):
+    """
+    Returns the limit and amount spent of each category and group for each
+    period from start to end, inclusive. The result is column oriented:
+    each category and group has a list of values with one item per period,
+    which is None for periods where it does not exist.
+
+    Totals are read from CategoryTotal, so they are as of its last refresh.
+    """
+    periods = list(range(start, end + 1))
+    rows = (
+        CategoryTotal.objects
+        .filter(owner=owner, period__gte=start, period__lte=end)
+        .order_by('group_name', 'category_name')
+        .values_list(
+            'period', 'group_name', 'category_name', 'limit', 'spent')
+    )
+
+    categories = OrderedDict()
+    groups = OrderedDict()
+    for period, group, category, limit, spent in rows:
+        index = period - start
+        for key, totals in (((group, category), categories),
+                            (group, groups)):
+            if key not in totals:
+                totals[key] = {
+                    'limit': [None] * len(periods),
+                    'spent': [None] * len(periods),
+                }
+            values = totals[key]
+            values['limit'][index] = (values['limit'][index] or 0) + limit
+            values['spent'][index] = (values['spent'][index] or 0) + spent
+
+    return {
+        'periods': [
+            dict(zip(('year', 'month'), Budget.from_period(period)))
+            for period in periods
+        ],
+        'categories': {
+            'group': [group for group, category in categories],
+            'category': [category for group, category in categories],
+            'limit': format_values(categories, 'limit'),
+            'spent': format_values(categories, 'spent'),
+        },
+        'groups': {
+            'group': list(groups),
+            'limit': format_values(groups, 'limit'),
+            'spent': format_values(groups, 'spent'),
+        },
+    }
+
+
+def format_value(value):
+    if value is None:
+        return None
+
+    return str(value.quantize(Decimal('0.01')))
+
+
+def format_values(totals, field):
+    return [
+        [format_value(value) for value in values[field]]
+        for values in totals.values()
+    ]
+
+
+def analytics_report(owner, start, end, key):
+    """
+    Returns spending analytics for each category name or group name (as
+    given by key) for each period from start to end, inclusive:
+
+    - spent: the amount spent in the period.
+    - year_to_date: the amount spent from January through the period.
+    - rolling_3, rolling_12: the average spent over the last 3 and 12
+      months, including the period.
+    - change: the difference in spent from the previous month.
+
+    All figures are computed by the database with window functions, in one
+    query. The result is column oriented, like spending_report().
+    """
+    columns = {'category': 'category_name', 'group': 'group_name'}
+    sql = ANALYTICS_SQL.format(
+        key=columns[key],
+        fields=', '.join(ANALYTICS_FIELDS),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'owner': owner.pk,
+            # The rolling averages include the 11 months before the start.
+            'from': start - 11,
+            'start': start,
+            'end': end,
+        })
+        rows = cursor.fetchall()
+
+    periods = list(range(start, end + 1))
+    totals = OrderedDict()
+    for name, period, *values in rows:
+        if name not in totals:
+            totals[name] = {
+                field: [None] * len(periods) for field in ANALYTICS_FIELDS
+            }
+        for field, value in zip(ANALYTICS_FIELDS, values):
+            totals[name][field][period - start] = value
+
+    result = {
+        'periods': [
+            dict(zip(('year', 'month'), Budget.from_period(period)))
+            for period in periods
+        ],
+        key: list(totals),
+    }
+    for field in ANALYTICS_FIELDS:
+        result[field] = format_values(totals, field)
+
+    return result
@@ -0,0 +1,79 @@
+"""
+A cache of the pks of the groups that categories are created in, by their
+owner and natural key, so that entering many categories in a row does not
+look up the same few budgets and groups for each.
+
+Groups are cached by the month and year of their budget and their name,
+which covers the lookup of the budget too. Each key includes a generation of
+its owner, which is bumped whenever one of their budgets or groups is
+deleted, renamed or moved, invalidating all of their entries at once.
+Entries are only cached, and invalidated, once the transaction that looked
+them up commits.
+
+The cache is Django's default cache, which is local to each process unless a
+shared backend is configured, so another process may still hold a stale pk
+until its entry expires after a few minutes. Inserts into a cached group
+check that it still has the natural key it was cached by, and are retried
+with a fresh lookup if not.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+TIMEOUT = 5 * 60
+
+GENERATION_KEY = 'budgetapp:resolution:{}'
+
+
+def get_generation(owner_id):
+    key = GENERATION_KEY.format(owner_id)
+    generation = cache.get(key)
+    if generation is None:
+        # Started from the clock, so that the entries of a generation that
+        # was evicted are not used again.
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def make_key(owner_id, kind, natural_key):
+    # Hashed, since names may contain characters that are not valid in the
+    # keys of some backends.
+    digest = hashlib.sha1(repr(natural_key).encode()).hexdigest()
+    return 'budgetapp:{}:{}:{}:{}'.format(
+        kind, owner_id, get_generation(owner_id), digest)
+
+
+def resolve(owner_id, kind, natural_key, lookup, cached=True):
+    """
+    Returns the cached pk of the given user's object of the given kind with
+    the given natural key, or else calls lookup() for it and caches the
+    result. With `cached=False`, the cache is not read.
+    """
+    key = make_key(owner_id, kind, natural_key)
+    pk = cache.get(key) if cached else None
+    if pk is None:
+        pk = lookup()
+        # Objects created by a transaction that rolls back are not cached.
+        transaction.on_commit(lambda: cache.set(key, pk, TIMEOUT))
+    return pk
+
+
+def bump_generation(owner_id):
+    try:
+        cache.incr(GENERATION_KEY.format(owner_id))
+    except ValueError:
+        # Nothing is cached for the user.
+        pass
+
+
+def invalidate(owner_id):
+    """
+    Invalidates the cached pks of the given user's objects, now and once
+    the current transaction commits, since others may cache them again
+    before the change is visible.
+    """
+    bump_generation(owner_id)
+    transaction.on_commit(lambda: bump_generation(owner_id))
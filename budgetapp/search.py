@@ -0,0 +1,99 @@
+"""
+Full-text search over transactions by payee, category and group name.
+
+Names are matched word by word with prefix queries, so "amaz" finds
+"Amazon Marketplace". Matching payees, categories and groups can be found
+through the GIN indexes on their names (see migration 0033), and only the
+transactions referencing them are ranked.
+"""
+import re
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db.models import Q
+
+from .models import BudgetCategory, BudgetCategoryGroup, Payee
+
+# The simple configuration neither stems nor drops stop words, which suits
+# names better than a language configuration. It must match the one used
+# by the indexes.
+SEARCH_CONFIG = 'simple'
+
+TERM = re.compile(r'\w+')
+
+
+class PrefixSearchQuery(SearchQuery):
+    """
+    Matches documents containing a word starting with each of the given
+    terms, or with any of them if `match_any` is set.
+    """
+
+    def __init__(self, terms, match_any=False):
+        operator = ' | ' if match_any else ' & '
+        super().__init__(
+            operator.join(term + ':*' for term in terms),
+            config=SEARCH_CONFIG,
+        )
+
+    def as_sql(self, compiler, connection):
+        config_sql, config_params = compiler.compile(self.config)
+        return (
+            'to_tsquery({}::regconfig, %s)'.format(config_sql),
+            config_params + [self.value],
+        )
+
+
+def get_terms(text):
+    return TERM.findall(text.lower())
+
+
+def name_matches(queryset, field, terms):
+    """
+    Filters the given objects to those whose name in `field` contains a
+    word starting with any of the given terms.
+    """
+    return queryset.annotate(
+        document=SearchVector(field, config=SEARCH_CONFIG),
+    ).filter(document=PrefixSearchQuery(terms, match_any=True))
+
+
+def search_transactions(queryset, owner, text):
+    """
+    Filters the given transactions to those whose payee, category and group
+    names together contain all of the words in the given text, and
+    annotates them with a `rank`.
+    """
+    terms = get_terms(text)
+
+    # The few matching payees and categories are looked up first, so that
+    # transactions are found through their foreign key indexes.
+    payees = name_matches(
+        Payee.objects.filter(owner=owner), 'name', terms,
+    ).values_list('pk', flat=True)
+    categories = BudgetCategory.objects.filter(
+        Q(pk__in=name_matches(
+            BudgetCategory.objects.filter(group__budget__owner=owner),
+            'category', terms,
+        ).values('pk')) |
+        Q(group__in=name_matches(
+            BudgetCategoryGroup.objects.filter(budget__owner=owner),
+            'name', terms,
+        ).values('pk'))
+    ).values_list('pk', flat=True)
+
+    # Each term may match a different name, e.g. "amazon shopping", so
+    # candidates matching any term are narrowed down to those matching all.
+    document = (
+        SearchVector('payee__name', config=SEARCH_CONFIG, weight='A') +
+        SearchVector(
+            'budget_category__category', config=SEARCH_CONFIG, weight='B') +
+        SearchVector(
+            'budget_category__group__name', config=SEARCH_CONFIG, weight='C')
+    )
+    all_terms = PrefixSearchQuery(terms)
+    return queryset.filter(
+        Q(payee__in=list(payees)) | Q(budget_category__in=list(categories))
+    ).annotate(
+        document=document,
+        rank=SearchRank(document, all_terms),
+    ).filter(document=all_terms)
@@ -1,18 +1,83 @@
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from rest_framework.utils.serializer_helpers import ReturnDict
+from rest_framework.validators import UniqueTogetherValidator
+
+from . import resolution
+from .exporters import STREAMERS
+from .importers import READERS
+from .models import (Budget, BudgetCategory, BudgetCategoryGroup, ImportRule,
+                     Job, Payee, RecurringTransaction, Transaction)
+from .search import get_terms
+
+
+class OwnedRelatedField:
+    """
+    Mixin for related fields that only accept the objects of the requesting
+    user, found through the `owner_lookup` of the model. Other users'
+    objects are rejected as not existing when the field is validated.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return queryset.filter(**{
+            queryset.model.owner_lookup: self.context['request'].user,
+        })
+
+
+class OwnedPrimaryKeyRelatedField(OwnedRelatedField,
+                                  serializers.PrimaryKeyRelatedField):
+    """
+    A primary key related field scoped to the requesting user. A list
+    serializer may look up the objects of all its items with one query, by
+    calling prefetch() with their values before validating them.
+    """
+    prefetched = None
+
+    def get_pk(self, data):
+        """
+        Returns the given value as a pk, or None if it is not a valid one.
+        """
+        try:
+            if self.pk_field is not None:
+                data = self.pk_field.to_internal_value(data)
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except (serializers.ValidationError, DjangoValidationError):
+            return None
+
+    def prefetch(self, values):
+        pks = {self.get_pk(value) for value in values}
+        self.prefetched = self.get_queryset().in_bulk(pks - {None})
+
+    def to_internal_value(self, data):
+        if self.prefetched is None:
+            return super().to_internal_value(data)
+
+        pk = self.get_pk(data)
+        if pk is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in self.prefetched:
+            self.fail('does_not_exist', pk_value=data)
+        return self.prefetched[pk]
+
+
+class OwnedHyperlinkedRelatedField(OwnedRelatedField,
+                                   serializers.HyperlinkedRelatedField):
+    pass
 
-from .models import (Budget, BudgetCategory, BudgetCategoryGroup, Payee,
-                     Transaction)
 
 # Multi-use fields
 owner_field = serializers.PrimaryKeyRelatedField(
     read_only=True, default=serializers.CurrentUserDefault())
-budget_field = serializers.HyperlinkedRelatedField(
+budget_field = OwnedHyperlinkedRelatedField(
     queryset=Budget.objects.all(),
     view_name='budgetapp:budget-detail'
 )
-budget_category_field = serializers.HyperlinkedRelatedField(
+budget_category_field = OwnedHyperlinkedRelatedField(
     queryset=BudgetCategory.objects.all(),
     view_name='budgetapp:budgetcategory-detail'
 )
@@ -54,88 +119,96 @@ class BudgetCategorySerializer(serializers.HyperlinkedModelSerializer):
     budget_month = serializers.CharField(write_only=True)
     budget_year = serializers.IntegerField(write_only=True)
     spent = serializers.CharField(read_only=True)
+    carryover = serializers.DecimalField(
+        max_digits=20, decimal_places=2, read_only=True)
+    balance = serializers.CharField(read_only=True)
 
-    def validate(self, data):
-        super().validate(data)
-
-        # Enforce uniqueness between category name and budget.
-        budget_month = data.get('budget_month')
-        budget_year = data.get('budget_year')
-        category = data.get('category')
-
-        # If this is an update, default values to the instance
-        # values if updated values were not given.
-        if self.instance:
-            budget_month = budget_month or self.instance.group.budget.month
-            budget_year = budget_year or self.instance.group.budget.year
-            category = category or self.instance.category
-
-        existing = BudgetCategory.objects.filter(
-            group__budget__month=budget_month,
-            group__budget__year=budget_year,
-            group__budget__owner=self.context['request'].user,
-            category=category,
-        )
-
-        if self.instance:
-            existing = existing.exclude(id=self.instance.id)
-
-        if existing.exists():
-            raise serializers.ValidationError(
-                'Category must be unique within this budget.'
-            )
-
-        return data
+    unique_error = 'Category must be unique within this budget.'
 
     def create(self, validated_data):
-        self.get_or_create_related(validated_data)
-        return BudgetCategory.objects.create(**validated_data)
+        """
+        Creates the category, with its budget and group if they do not
+        exist, with two upserts, or one if the group's pk is cached. Names
+        are unique per budget by a database constraint, so a taken name is
+        only found by the insert.
+        """
+        with transaction.atomic():
+            for cached in (True, False):
+                # A cached group may have been deleted, renamed or moved
+                # since, by another process, so the insert is retried with a
+                # fresh lookup.
+                group_id = self.get_group_id(validated_data, cached)
+                category = BudgetCategory.objects.create_unique(
+                    group_id,
+                    validated_data['category'],
+                    validated_data.get(
+                        'limit',
+                        BudgetCategory._meta.get_field('limit').default,
+                    ),
+                    self.context['request'].user,
+                    validated_data['budget_month'],
+                    validated_data['budget_year'],
+                    validated_data['group']['name'],
+                )
+                if category is not None:
+                    return category
+
+            self.raise_unique_error()
 
     def update(self, instance, validated_data):
-        self.get_or_create_related(validated_data)
-        return super().update(instance, validated_data)
-
-    def get_or_create_related(self, validated_data):
+        validated_data['group_id'] = self.get_group_id(validated_data)
+        for field in ('budget_month', 'budget_year', 'group'):
+            validated_data.pop(field, None)
+        if validated_data['group_id'] != instance.group_id:
+            # The cached group is stale once the category moves.
+            BudgetCategory._meta.get_field('group').delete_cached_value(
+                instance)
+
+        try:
+            with transaction.atomic():
+                return super().update(instance, validated_data)
+        except IntegrityError:
+            self.raise_unique_error()
+
+    def raise_unique_error(self):
+        raise serializers.ValidationError({
+            api_settings.NON_FIELD_ERRORS_KEY: [self.unique_error],
+        })
+
+    def get_group_id(self, validated_data, cached=True):
         """
-        Takes given budget/category/group data and either creates
-        the corresponding models, if the don't already exist, or uses
-        the existing ones to populate the required group field.
+        Returns the pk of the group with the given budget month, year and
+        group name, creating the budget and group if they do not exist. For
+        updates, missing values default to the instance's. New categories
+        are resolved through the cache, unless `cached` is False.
         """
         budget_month = validated_data.get('budget_month')
         budget_year = validated_data.get('budget_year')
-        category = validated_data.get('category')
         group = validated_data.get('group', {}).get('name')
 
-        # If this is an update, default values to the instance
-        # values if updated values were not given.
         if self.instance:
+            if not (budget_month or budget_year or group):
+                return self.instance.group_id
             budget_month = budget_month or self.instance.group.budget.month
             budget_year = budget_year or self.instance.group.budget.year
-            category = category or self.instance.category
             group = group or self.instance.group.name
-
-        budget, created = Budget.objects.get_or_create(
-            month=budget_month,
-            year=budget_year,
-            owner=self.context['request'].user,
-        )
-
-        group, created = BudgetCategoryGroup.objects.get_or_create(
-            budget=budget,
-            name=group,
+            # Moving a category is checked by a foreign key only once the
+            # transaction commits, so a stale pk is never used for it.
+            cached = False
+
+        owner = self.context['request'].user
+        return resolution.resolve(
+            owner.pk, 'group', (budget_month, budget_year, group),
+            lambda: Budget.objects.get_or_create_group(
+                owner, budget_month, budget_year, group),
+            cached,
         )
 
-        validated_data.pop('budget_month', None)
-        validated_data.pop('budget_year', None)
-        validated_data.pop('group', None)
-
-        validated_data['group'] = group
-
     class Meta:
         model = BudgetCategory
         fields = (
             'url', 'pk', 'budget_month', 'budget_year', 'category', 'group',
-            'limit', 'spent',
+            'limit', 'spent', 'carryover', 'balance', 'version',
         )
         list_serializer_class = DictSerializer
 
@@ -143,7 +216,7 @@ class BudgetCategorySerializer(serializers.HyperlinkedModelSerializer):
 class TransactionSerializer(serializers.HyperlinkedModelSerializer):
     url = serializers.HyperlinkedIdentityField(
         view_name='budgetapp:transaction-detail')
-    budget_category = serializers.PrimaryKeyRelatedField(
+    budget_category = OwnedPrimaryKeyRelatedField(
         queryset=BudgetCategory.objects.all(),
     )
     payee = serializers.CharField()
@@ -172,11 +245,220 @@ class TransactionSerializer(serializers.HyperlinkedModelSerializer):
         model = Transaction
         fields = (
             'url', 'pk', 'amount', 'budget_category', 'date',
-            'payee',
+            'payee', 'version',
         )
         list_serializer_class = DictSerializer
 
 
+class TransactionBulkListSerializer(serializers.ListSerializer):
+    """
+    Validates and creates a batch of transactions with a fixed number of
+    queries, regardless of the batch size, which is at most `max_items`.
+    Errors are returned per item, in the same order as the submitted
+    transactions.
+    """
+    max_items = 1000
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            message = self.error_messages['not_a_list'].format(
+                input_type=type(data).__name__
+            )
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [message]
+            }, code='not_a_list')
+
+        if not data:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    self.error_messages['empty']
+                ]
+            }, code='empty')
+
+        if len(data) > self.max_items:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Batches cannot have more than {} transactions.'.format(
+                        self.max_items)
+                ]
+            }, code='max_length')
+
+        # The categories of all items are looked up with one query.
+        self.child.fields['budget_category'].prefetch(
+            item.get('budget_category') for item in data
+            if isinstance(item, dict)
+        )
+
+        ret = []
+        errors = []
+        for item in data:
+            try:
+                ret.append(self.child.run_validation(item))
+                errors.append({})
+            except serializers.ValidationError as exc:
+                ret.append(None)
+                errors.append(exc.detail)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        return ret
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            payees = Payee.objects.resolve(
+                self.context['request'].user,
+                (item['payee'] for item in validated_data),
+            )
+            transactions = Transaction.objects.bulk_create(
+                Transaction(**dict(item, payee=payees[item['payee']]))
+                for item in validated_data
+            )
+            BudgetCategory.objects.update_carryover(
+                BudgetCategory.objects.carryover_keys(pk__in={
+                    item['budget_category'].pk for item in validated_data
+                })
+            )
+            Payee.objects.update_usage(
+                payee.pk for payee in payees.values())
+            return transactions
+
+
+class TransactionBulkSerializer(serializers.Serializer):
+    """
+    Input format for one item of a bulk transaction create. The categories
+    of all items are looked up at once by TransactionBulkListSerializer.
+    """
+    amount = serializers.DecimalField(max_digits=20, decimal_places=2)
+    budget_category = OwnedPrimaryKeyRelatedField(
+        queryset=BudgetCategory.objects.all(),
+    )
+    date = serializers.DateField()
+    payee = serializers.CharField(max_length=30)
+
+    class Meta:
+        list_serializer_class = TransactionBulkListSerializer
+
+
+class StatementImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    file_format = serializers.ChoiceField(
+        choices=sorted(READERS), required=False)
+
+    def validate(self, data):
+        # Default the format to the file's extension.
+        if not data.get('file_format'):
+            extension = data['file'].name.rpartition('.')[2].lower()
+            if extension not in READERS:
+                raise serializers.ValidationError(
+                    'Unable to determine the format of the file.'
+                )
+            data['file_format'] = extension
+
+        return data
+
+
+class TransactionExportSerializer(serializers.Serializer):
+    file_format = serializers.ChoiceField(
+        choices=sorted(STREAMERS), default='csv')
+    date_after = serializers.DateField(required=False)
+    date_before = serializers.DateField(required=False)
+    category = serializers.ListField(
+        child=serializers.IntegerField(), required=False)
+
+
+class TransactionSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(required=False, max_length=100)
+    amount_min = serializers.DecimalField(
+        max_digits=20, decimal_places=2, required=False)
+    amount_max = serializers.DecimalField(
+        max_digits=20, decimal_places=2, required=False)
+    date_after = serializers.DateField(required=False)
+    date_before = serializers.DateField(required=False)
+
+    def validate_q(self, value):
+        if not get_terms(value):
+            raise serializers.ValidationError(
+                'Enter at least one word to search for.')
+        return value
+
+
+class TransactionSearchResultSerializer(TransactionSerializer):
+    """
+    Returns search results as a list, to keep them in order of rank.
+    """
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta(TransactionSerializer.Meta):
+        fields = TransactionSerializer.Meta.fields + ('rank',)
+        list_serializer_class = serializers.ListSerializer
+
+
+class TransactionRecategorizeSerializer(serializers.Serializer):
+    budget_category = OwnedPrimaryKeyRelatedField(
+        queryset=BudgetCategory.objects.all(),
+    )
+
+
+class ImportRuleSerializer(serializers.HyperlinkedModelSerializer):
+    url = serializers.HyperlinkedIdentityField(
+        view_name='budgetapp:importrule-detail')
+
+    class Meta:
+        model = ImportRule
+        fields = ('url', 'pk', 'match', 'payee', 'category', 'version')
+        list_serializer_class = DictSerializer
+
+
+class RecurringTransactionSerializer(serializers.HyperlinkedModelSerializer):
+    url = serializers.HyperlinkedIdentityField(
+        view_name='budgetapp:recurringtransaction-detail')
+
+    class Meta:
+        model = RecurringTransaction
+        fields = (
+            'url', 'pk', 'amount', 'payee', 'category', 'frequency',
+            'start_date', 'end_date', 'next_date', 'version',
+        )
+        read_only_fields = ('next_date',)
+        list_serializer_class = DictSerializer
+
+    def validate(self, data):
+        start_date = data.get(
+            'start_date', getattr(self.instance, 'start_date', None))
+        end_date = data.get(
+            'end_date', getattr(self.instance, 'end_date', None))
+        if end_date is not None and end_date < start_date:
+            raise serializers.ValidationError(
+                'The end date must not be before the start date.')
+
+        return data
+
+    def create(self, validated_data):
+        validated_data['next_date'] = validated_data['start_date']
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        # Moving the start date restarts the schedule from the new date.
+        start_date = validated_data.get('start_date', instance.start_date)
+        if start_date != instance.start_date:
+            validated_data['next_date'] = start_date
+        return super().update(instance, validated_data)
+
+
+class JobSerializer(serializers.HyperlinkedModelSerializer):
+    url = serializers.HyperlinkedIdentityField(
+        view_name='budgetapp:job-detail')
+
+    class Meta:
+        model = Job
+        fields = (
+            'url', 'pk', 'kind', 'status', 'result', 'error', 'attempts',
+            'created_at', 'finished_at',
+        )
+        read_only_fields = fields
+
+
 class PayeeSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -185,6 +467,46 @@ class PayeeSerializer(serializers.ModelSerializer):
         list_serializer_class = DictSerializer
 
 
+class PayeeUsageSerializer(PayeeSerializer):
+    """
+    Returns payees as a list, to keep them in order of usage.
+    """
+
+    class Meta(PayeeSerializer.Meta):
+        fields = PayeeSerializer.Meta.fields + (
+            'transaction_count', 'last_used',
+        )
+        list_serializer_class = serializers.ListSerializer
+
+
+class PayeeMergeSerializer(serializers.Serializer):
+    payees = serializers.ListField(
+        child=serializers.IntegerField(), min_length=1)
+    into = serializers.IntegerField()
+
+    def validate(self, data):
+        """
+        Looks up the payees with one query, checking that they all belong
+        to the user.
+        """
+        pks = set(data['payees']) | {data['into']}
+        payees = {
+            payee.pk: payee
+            for payee in Payee.objects.filter(
+                pk__in=pks, owner=self.context['request'].user)
+        }
+        missing = pks - set(payees)
+        if missing:
+            raise serializers.ValidationError(
+                'Invalid payees: {}.'.format(
+                    ', '.join(str(pk) for pk in sorted(missing))))
+
+        return {
+            'payees': [payees[pk] for pk in data['payees']],
+            'into': payees[data['into']],
+        }
+
+
 class BudgetCategoryGroupListSerializer(DictSerializer):
     dict_key = 'name'
 
@@ -192,7 +514,7 @@ class BudgetCategoryGroupListSerializer(DictSerializer):
 class BudgetCategoryGroupSerializer(serializers.HyperlinkedModelSerializer):
     url = serializers.HyperlinkedIdentityField(
         view_name='budgetapp:budgetcategorygroup-detail')
-    budget = serializers.HyperlinkedRelatedField(
+    budget = OwnedHyperlinkedRelatedField(
         queryset=Budget.objects.all(),
         view_name='budgetapp:budget-detail'
     )
@@ -203,8 +525,31 @@ class BudgetCategoryGroupSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = BudgetCategoryGroup
-        fields = ('url', 'pk', 'name', 'budget', 'budget_categories',)
+        fields = (
+            'url', 'pk', 'name', 'budget', 'budget_categories', 'version',
+        )
         list_serializer_class = BudgetCategoryGroupListSerializer
+        # Names are only unique among live groups, so this is not derived
+        # from the model.
+        validators = [
+            UniqueTogetherValidator(
+                queryset=BudgetCategoryGroup.objects.all(),
+                fields=('name', 'budget'),
+            ),
+        ]
+
+    def update(self, instance, validated_data):
+        try:
+            with transaction.atomic():
+                return super().update(instance, validated_data)
+        except IntegrityError:
+            # The group moved into a budget with a category of the same
+            # name as one of its own.
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    BudgetCategorySerializer.unique_error,
+                ],
+            })
 
 
 class BudgetSerializer(serializers.HyperlinkedModelSerializer):
@@ -240,9 +585,12 @@ class BudgetSerializer(serializers.HyperlinkedModelSerializer):
         return serializer.data
 
     def get_payees(self, budget):
+        # Only the payees of the budget's transactions. The rest are found
+        # through the payee autocomplete endpoint.
         payees = Payee.objects.filter(
-            owner=self.context['request'].user,
-        )
+            transaction__budget_category__group__budget=budget,
+            transaction__deleted_at__isnull=True,
+        ).distinct()
         serializer = PayeeSerializer(
             payees,
             many=True,
@@ -254,10 +602,85 @@ class BudgetSerializer(serializers.HyperlinkedModelSerializer):
         model = Budget
         fields = (
             'url', 'pk', 'owner', 'month', 'year', 'budget_category_groups',
-            'budget_categories', 'transactions', 'payees',
+            'budget_categories', 'transactions', 'payees', 'version',
         )
 
 
+class BudgetSummarySerializer(serializers.HyperlinkedModelSerializer):
+    """
+    Serializes a budget without its related objects.
+    """
+    url = serializers.HyperlinkedIdentityField(
+        view_name='budgetapp:budget-detail')
+    owner = owner_field
+
+    class Meta:
+        model = Budget
+        fields = ('url', 'pk', 'owner', 'month', 'year', 'version')
+        list_serializer_class = DictSerializer
+
+
+class ChangesSerializer(serializers.Serializer):
+    since = serializers.IntegerField(min_value=0, required=False)
+
+
+class ReportPeriodSerializer(serializers.Serializer):
+    """
+    Validates the range of months for a report. The end defaults to the
+    current month, and the start defaults to `months` months before the end.
+    """
+    max_months = 120
+
+    start_month = serializers.ChoiceField(
+        choices=Budget.MONTH_CHOICES, required=False)
+    start_year = serializers.IntegerField(required=False)
+    end_month = serializers.ChoiceField(
+        choices=Budget.MONTH_CHOICES, required=False)
+    end_year = serializers.IntegerField(required=False)
+    months = serializers.IntegerField(
+        min_value=1, max_value=max_months, default=12)
+
+    def validate(self, data):
+        for prefix in ('start', 'end'):
+            given = [
+                key for key in (prefix + '_month', prefix + '_year')
+                if key in data
+            ]
+            if len(given) == 1:
+                raise serializers.ValidationError(
+                    'Both {0}_month and {0}_year are required.'.format(prefix)
+                )
+
+        if 'end_year' in data:
+            end = Budget.get_period(data['end_year'], data['end_month'])
+        else:
+            today = timezone.localdate()
+            end = Budget.get_period(
+                today.year, Budget.MONTH_CHOICES[today.month - 1][0])
+
+        if 'start_year' in data:
+            start = Budget.get_period(data['start_year'], data['start_month'])
+        else:
+            start = end - data['months'] + 1
+
+        if start > end:
+            raise serializers.ValidationError(
+                'The start month must not be after the end month.')
+        if end - start >= self.max_months:
+            raise serializers.ValidationError(
+                'Reports cannot span more than {} months.'.format(
+                    self.max_months))
+
+        data['start'] = start
+        data['end'] = end
+        return data
+
+
+class AnalyticsReportSerializer(ReportPeriodSerializer):
+    group_by = serializers.ChoiceField(
+        choices=('category', 'group'), default='category')
+
+
 class UserSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
@@ -0,0 +1,179 @@
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_delete, pre_save)
+
+from . import resolution
+from .models import (Budget, BudgetCategory, BudgetCategoryGroup, ImportRule,
+                     Payee, RecurringTransaction, Tombstone, Transaction)
+
+SYNCED_MODELS = (
+    Budget, BudgetCategoryGroup, BudgetCategory, Transaction, Payee,
+)
+
+VERSIONED_MODELS = (
+    Budget, BudgetCategoryGroup, BudgetCategory, Transaction,
+    RecurringTransaction, ImportRule,
+)
+
+# Models whose pks are cached by their natural key, see resolution.py.
+RESOLVED_MODELS = (Budget, BudgetCategoryGroup)
+
+# Fields whose original values are remembered on load, to detect changes
+# that affect category carryover, payee usage or cached pks.
+TRACKED_FIELDS = {
+    Budget: ('month', 'year'),
+    BudgetCategoryGroup: ('budget_id', 'name'),
+    BudgetCategory: ('group_id', 'category'),
+    Transaction: ('budget_category_id', 'payee_id', 'date'),
+}
+
+
+def record_tombstone(sender, instance, **kwargs):
+    """
+    Records a tombstone for a deleted object. This runs before deletion,
+    while the owner can still be looked up.
+    """
+    Tombstone.record(instance)
+
+
+def invalidate_resolved(sender, instance, **kwargs):
+    # Runs before deletion, while the owner of a group can be looked up.
+    if sender is BudgetCategoryGroup:
+        owner_id = Budget.objects.filter(
+            pk=instance.budget_id).values_list('owner', flat=True).first()
+    else:
+        owner_id = instance.owner_id
+    if owner_id is not None:
+        resolution.invalidate(owner_id)
+
+
+def bump_version(sender, instance, raw, **kwargs):
+    # Fixtures are loaded with their versions as they are.
+    if not instance._state.adding and not raw:
+        instance.version += 1
+
+
+def remember_original(sender, instance, **kwargs):
+    # Read from __dict__ so that deferred fields are not loaded.
+    instance._original = {
+        field: instance.__dict__.get(field)
+        for field in TRACKED_FIELDS[sender]
+    }
+
+
+def get_changed(instance):
+    original = getattr(instance, '_original', {})
+    return {
+        field: value for field, value in original.items()
+        if value != getattr(instance, field)
+    }
+
+
+def update_carryover(keys):
+    BudgetCategory.objects.update_carryover(keys)
+
+
+def budget_saved(sender, instance, created, **kwargs):
+    changed = get_changed(instance)
+    if not created and changed:
+        # Categories in the budget move to a different month.
+        old_period = Budget.get_period(
+            instance._original['year'], instance._original['month'])
+        keys = BudgetCategory.objects.carryover_keys(group__budget=instance)
+        update_carryover(keys + [
+            (owner_id, name, old_period) for owner_id, name, period in keys
+        ])
+        invalidate_resolved(sender, instance)
+
+    remember_original(sender, instance)
+
+
+def group_saved(sender, instance, created, **kwargs):
+    changed = get_changed(instance)
+    if not created and changed:
+        invalidate_resolved(sender, instance)
+    if not created and 'budget_id' in changed:
+        # Categories in the group move to a different budget.
+        old_budget = Budget.objects.filter(
+            pk=instance._original['budget_id']).first()
+        keys = BudgetCategory.objects.carryover_keys(group=instance)
+        if old_budget:
+            keys += [
+                (old_budget.owner_id, name, old_budget.period)
+                for owner_id, name, period in keys
+            ]
+        update_carryover(keys)
+
+    remember_original(sender, instance)
+
+
+def category_saved(sender, instance, created, **kwargs):
+    # Always recomputed, since saving may have written a stale carryover.
+    changed = get_changed(instance)
+    keys = BudgetCategory.objects.carryover_keys(pk=instance.pk)
+    if 'group_id' in changed or 'category' in changed:
+        old_budget = Budget.objects.filter(
+            budget_category_groups=instance._original['group_id'],
+        ).first()
+        if old_budget:
+            keys.append((
+                old_budget.owner_id,
+                instance._original['category'],
+                old_budget.period,
+            ))
+    update_carryover(keys)
+
+    remember_original(sender, instance)
+
+
+def category_deleting(sender, instance, **kwargs):
+    # Remembered before deletion, while the budget can still be looked up.
+    instance._carryover_keys = \
+        BudgetCategory.objects.carryover_keys(pk=instance.pk)
+
+
+def category_deleted(sender, instance, **kwargs):
+    update_carryover(getattr(instance, '_carryover_keys', []))
+
+
+def transaction_saved(sender, instance, created, **kwargs):
+    original = getattr(instance, '_original', {})
+    category_ids = {
+        instance.budget_category_id,
+        original.get('budget_category_id'),
+    }
+    update_carryover(
+        BudgetCategory.objects.carryover_keys(pk__in=category_ids - {None}))
+
+    changed = get_changed(instance)
+    if created or 'payee_id' in changed or 'date' in changed:
+        Payee.objects.update_usage(
+            [instance.payee_id, original.get('payee_id')])
+
+    remember_original(sender, instance)
+
+
+def transaction_deleted(sender, instance, **kwargs):
+    update_carryover(BudgetCategory.objects.carryover_keys(
+        pk=instance.budget_category_id))
+    Payee.objects.update_usage([instance.payee_id])
+
+
+for model in SYNCED_MODELS:
+    pre_delete.connect(record_tombstone, sender=model)
+
+for model in RESOLVED_MODELS:
+    pre_delete.connect(invalidate_resolved, sender=model)
+
+for model in VERSIONED_MODELS:
+    pre_save.connect(bump_version, sender=model)
+
+for model in TRACKED_FIELDS:
+    post_init.connect(remember_original, sender=model)
+
+post_save.connect(budget_saved, sender=Budget)
+post_save.connect(group_saved, sender=BudgetCategoryGroup)
+post_save.connect(category_saved, sender=BudgetCategory)
+pre_delete.connect(category_deleting, sender=BudgetCategory)
+post_delete.connect(category_deleted, sender=BudgetCategory)
+post_save.connect(transaction_saved, sender=Transaction)
+post_delete.connect(transaction_deleted, sender=Transaction)
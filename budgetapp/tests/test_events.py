@@ -0,0 +1,134 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from rest_framework.test import APIClient
+
+from ..bulk import soft_delete
+from ..events import RESYNC, Listener, listener
+from ..models import (Budget, BudgetCategory, BudgetCategoryGroup, Payee,
+                      Transaction)
+from ..utils.sync import to_cursor
+
+
+# Notifications are only sent once a transaction commits.
+class ListenerTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test', password='test')
+        self.other = User.objects.create(username='other', password='test')
+        self.listener = Listener()
+        self.addCleanup(self.listener.close)
+
+    def test_changes(self):
+        events = self.listener.subscribe(self.user.pk)
+        budget = Budget.objects.create(
+            month='JAN', year=2000, owner=self.user)
+        Budget.objects.create(month='JAN', year=2000, owner=self.other)
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 1', budget=budget)
+
+        self.assertEqual(events.get(timeout=5), {
+            'type': 'budget',
+            'pk': budget.pk,
+            'version': 1,
+            'cursor': to_cursor(budget.updated_at),
+            'deleted': False,
+        })
+        self.assertEqual(events.get(timeout=5), {
+            'type': 'budgetcategorygroup',
+            'pk': group.pk,
+            'version': 1,
+            'cursor': to_cursor(group.updated_at),
+            'deleted': False,
+        })
+        self.assertTrue(events.empty())
+
+        budget.save()
+        change = events.get(timeout=5)
+        self.assertEqual(change['version'], 2)
+        self.assertEqual(change['cursor'], to_cursor(budget.updated_at))
+
+    def test_set_based_deletes(self):
+        budget = Budget.objects.create(
+            month='JAN', year=2000, owner=self.user)
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 1', budget=budget)
+        category = BudgetCategory.objects.create(
+            category='Shopping', group=group, limit=100)
+        transaction = Transaction.objects.create(
+            amount=10,
+            date='2000-01-01',
+            budget_category=category,
+            payee=Payee.objects.create(name='Amazon', owner=self.user),
+        )
+
+        events = self.listener.subscribe(self.user.pk)
+        soft_delete(BudgetCategory.objects.filter(pk=category.pk), self.user)
+        changes = set()
+        while len(changes) < 2:
+            change = events.get(timeout=5)
+            if change['deleted']:
+                changes.add((change['type'], change['pk']))
+
+        self.assertEqual(changes, {
+            ('budgetcategory', category.pk),
+            ('transaction', transaction.pk),
+        })
+
+    def test_large_statements(self):
+        # Statements that write many rows of a user ask for a resync.
+        budget = Budget.objects.create(
+            month='JAN', year=2000, owner=self.user)
+        events = self.listener.subscribe(self.user.pk)
+        BudgetCategoryGroup.objects.bulk_create(
+            BudgetCategoryGroup(name='Group {}'.format(i), budget=budget)
+            for i in range(60)
+        )
+        self.assertIs(events.get(timeout=5), RESYNC)
+        self.assertTrue(events.empty())
+
+    def test_unsubscribe(self):
+        events = self.listener.subscribe(self.user.pk)
+        self.listener.unsubscribe(self.user.pk, events)
+        Budget.objects.create(month='JAN', year=2000, owner=self.user)
+
+        events = self.listener.subscribe(self.other.pk)
+        budget = Budget.objects.create(
+            month='JAN', year=2000, owner=self.other)
+        self.assertEqual(events.get(timeout=5)['pk'], budget.pk)
+
+
+class EventsViewTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test', password='test')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.addCleanup(listener.close)
+
+    def test_stream(self):
+        response = self.client.get('/events/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        content = iter(response.streaming_content)
+        self.assertEqual(next(content), b'retry: 3000\n\n')
+        budget = Budget.objects.create(
+            month='JAN', year=2000, owner=self.user)
+        event, data = next(content).decode().split('\n')[:2]
+        self.assertEqual(event, 'event: change')
+        self.assertEqual(json.loads(data[len('data: '):])['pk'], budget.pk)
+
+        response.close()
+        self.assertFalse(listener.queues)
+
+    def test_closed_before_start(self):
+        response = self.client.get('/events/')
+        response.close()
+        self.assertFalse(listener.queues)
+
+    def test_unauthenticated(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get('/events/')
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,189 @@
+import io
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from ..importers import StatementImporter, read_csv, read_ofx
+from ..models import (Budget, BudgetCategory, BudgetCategoryGroup, ImportRule,
+                      Payee, Transaction)
+
+OFX_SGML = '''OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+
+<OFX>
+<BANKMSGSRSV1>
+<STMTTRNRS>
+<STMTRS>
+<BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20000115120000
+<TRNAMT>-45.10
+<NAME>AMAZON MKTPLACE
+</STMTTRN>
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20000120
+<TRNAMT>1000.00
+<NAME>PAYROLL &amp; CO
+<MEMO>January
+</STMTTRN>
+</BANKTRANLIST>
+</STMTRS>
+</STMTTRNRS>
+</BANKMSGSRSV1>
+</OFX>
+'''
+
+OFX_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<OFX><BANKTRANLIST><STMTTRN><TRNTYPE>DEBIT</TRNTYPE>
+<DTPOSTED>20000115</DTPOSTED><TRNAMT>-45.10</TRNAMT>
+<NAME>AMAZON MKTPLACE</NAME></STMTTRN></BANKTRANLIST></OFX>
+'''
+
+
+class ReaderTests(TestCase):
+
+    def test_read_csv(self):
+        stream = io.StringIO(
+            'Date,Amount,Payee,Category\n'
+            '2000-01-15,-45.10,Amazon,Shopping\n'
+            '\n'
+            '01/16/2000,-5,Coffee,\n'
+        )
+        self.assertEqual(list(read_csv(stream)), [
+            {
+                'date': '2000-01-15', 'amount': '-45.10',
+                'description': 'Amazon', 'category': 'Shopping',
+            },
+            {
+                'date': '01/16/2000', 'amount': '-5',
+                'description': 'Coffee', 'category': '',
+            },
+        ])
+
+    def test_read_ofx_sgml(self):
+        rows = list(read_ofx(io.StringIO(OFX_SGML)))
+        self.assertEqual(rows, [
+            {
+                'date': '20000115', 'amount': '-45.10',
+                'description': 'AMAZON MKTPLACE',
+            },
+            {
+                'date': '20000120', 'amount': '1000.00',
+                'description': 'PAYROLL & CO',
+            },
+        ])
+
+    def test_read_ofx_small_chunks(self):
+        """
+        Tags split across chunks are parsed correctly.
+        """
+        rows = list(read_ofx(io.StringIO(OFX_SGML), chunk_size=7))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1]['description'], 'PAYROLL & CO')
+
+    def test_read_ofx_xml(self):
+        rows = list(read_ofx(io.StringIO(OFX_XML)))
+        self.assertEqual(rows, [{
+            'date': '20000115', 'amount': '-45.10',
+            'description': 'AMAZON MKTPLACE',
+        }])
+
+
+class StatementImporterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        budget = Budget.objects.create(
+            month='JAN',
+            year=2000,
+            owner=self.user,
+        )
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=budget,
+        )
+        self.shopping = BudgetCategory.objects.create(
+            category='Shopping',
+            group=group,
+            limit=100,
+        )
+        self.income = BudgetCategory.objects.create(
+            category='Income',
+            group=group,
+            limit=0,
+        )
+        ImportRule.objects.create(
+            match='amazon',
+            payee='Amazon',
+            category='Shopping',
+            owner=self.user,
+        )
+
+    def test_import(self):
+        rows = [
+            {
+                'date': '2000-01-15', 'amount': '-45.10',
+                'description': 'AMAZON MKTPLACE',
+            },
+            {
+                'date': '2000-01-20', 'amount': '1000',
+                'description': 'Payroll', 'category': 'Income',
+            },
+        ]
+        summary = StatementImporter(self.user).run(rows)
+        self.assertEqual(summary, {
+            'rows': 2, 'imported': 2, 'failed': 0, 'errors': [],
+        })
+
+        transaction = Transaction.objects.get(budget_category=self.shopping)
+        self.assertEqual(transaction.amount, Decimal('45.10'))
+        self.assertEqual(transaction.payee.name, 'Amazon')
+        self.assertEqual(transaction.date, date(2000, 1, 15))
+        self.assertEqual(self.income.spent, Decimal(-1000))
+
+    def test_import_errors(self):
+        rows = [
+            {'date': 'bad', 'amount': '-1', 'description': 'Amazon'},
+            {'date': '2000-01-15', 'amount': 'bad', 'description': 'Amazon'},
+            {'date': '2000-01-15', 'amount': '-1', 'description': 'Other'},
+            {'date': '2000-02-15', 'amount': '-1', 'description': 'Amazon'},
+            {'date': '2000-01-15', 'amount': '-1', 'description': 'Amazon'},
+        ]
+        summary = StatementImporter(self.user).run(rows)
+        self.assertEqual(summary['imported'], 1)
+        self.assertEqual(summary['failed'], 4)
+        self.assertEqual(
+            [error['row'] for error in summary['errors']], [1, 2, 3, 4])
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_import_batches(self):
+        """
+        Rows are written in batches of the given size, with the same
+        payee and category shared across batches.
+        """
+        batches = []
+        rows = [
+            {
+                'date': '2000-01-15', 'amount': '-1',
+                'description': 'Amazon',
+            }
+            for i in range(5)
+        ]
+        importer = StatementImporter(
+            self.user,
+            batch_size=2,
+            progress=lambda importer: batches.append(importer.imported),
+        )
+        importer.run(rows)
+
+        self.assertEqual(batches, [2, 4, 5])
+        self.assertEqual(Transaction.objects.count(), 5)
+        self.assertEqual(Payee.objects.filter(owner=self.user).count(), 1)
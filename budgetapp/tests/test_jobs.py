@@ -0,0 +1,191 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ..jobs import HANDLERS, claim_job, enqueue, run_job, run_pending
+from ..models import (AccountDeletion, Budget, BudgetCategory,
+                      BudgetCategoryGroup, Job, Transaction)
+
+
+def fail(job):
+    raise ValueError('Failed.')
+
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        handlers = mock.patch.dict(HANDLERS, {
+            'fail': (fail, 2),
+            'succeed': (lambda job: {'pk': job.pk}, 3),
+        })
+        handlers.start()
+        self.addCleanup(handlers.stop)
+
+    def test_run(self):
+        job = enqueue('succeed', self.user)
+        self.assertEqual(run_pending(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'DONE')
+        self.assertEqual(job.result, {'pk': job.pk})
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(run_pending(), 0)
+
+    def test_retry(self):
+        job = enqueue('fail', self.user)
+        self.assertEqual(run_pending(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'QUEUED')
+        self.assertEqual(job.error, 'Failed.')
+        self.assertGreater(job.run_after, timezone.now())
+        # Not due until the retry delay has passed.
+        self.assertEqual(run_pending(), 0)
+
+        Job.objects.update(run_after=timezone.now())
+        self.assertEqual(run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'FAILED')
+        self.assertEqual(job.attempts, 2)
+
+    def test_claim_leases(self):
+        job = enqueue('succeed', self.user)
+        self.assertEqual(claim_job(), job)
+        # Claimed jobs are not claimed again while their lease lasts.
+        self.assertIsNone(claim_job())
+
+        # The worker died, so the job is claimed again.
+        Job.objects.update(run_after=timezone.now() - timedelta(seconds=1))
+        claimed = claim_job()
+        self.assertEqual(claimed, job)
+        self.assertEqual(claimed.attempts, 2)
+
+    def test_reclaimed_job_not_overwritten(self):
+        job = enqueue('succeed', self.user)
+        first = claim_job()
+        Job.objects.update(run_after=timezone.now() - timedelta(seconds=1))
+        second = claim_job()
+        self.assertEqual(second.attempts, 2)
+
+        # The first worker finishes after its lease expired.
+        run_job(first)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'RUNNING')
+        run_job(second)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'DONE')
+
+    def test_leases(self):
+        enqueue('copy_budget', self.user)
+        job = claim_job()
+        self.assertGreater(
+            job.run_after, timezone.now() + timedelta(minutes=29))
+
+    def test_claim_expired_without_attempts(self):
+        job = enqueue('fail', self.user)
+        Job.objects.update(
+            status='RUNNING', attempts=2, run_after=timezone.now())
+        self.assertIsNone(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'FAILED')
+
+
+class JobViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        budget = Budget.objects.create(
+            month='JAN',
+            year=2000,
+            owner=self.user,
+        )
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=budget,
+        )
+        BudgetCategory.objects.create(
+            category='Shopping',
+            group=group,
+            limit=100,
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_import_in_background(self):
+        statement = SimpleUploadedFile(
+            'statement.csv',
+            b'date,amount,description,category\n'
+            b'2000-01-15,-45.10,Amazon,Shopping\n'
+            b'2000-01-16,-5.00,Coffee,Dining\n',
+        )
+        response = self.client.post(
+            '/transactions/import/?background=true', {'file': statement})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'QUEUED')
+        self.assertEqual(response['Location'], response.data['url'])
+        self.assertFalse(Transaction.objects.exists())
+
+        run_pending()
+        response = self.client.get(response.data['url'])
+        self.assertEqual(response.data['status'], 'DONE')
+        self.assertEqual(response.data['result']['imported'], 1)
+        self.assertEqual(response.data['result']['failed'], 1)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_copy_in_background(self):
+        response = self.client.post(
+            '/copy-budget/?background=true',
+            {'target_year': 2000, 'target_month': 'FEB', 'end_year': 2000,
+             'end_month': 'MAR'},
+        )
+        self.assertEqual(response.status_code, 202)
+
+        run_pending()
+        self.assertEqual(Job.objects.get().status, 'DONE')
+        self.assertEqual(
+            list(
+                BudgetCategory.objects
+                .filter(group__budget__month__in=('FEB', 'MAR'))
+                .values_list('category', flat=True)
+            ),
+            ['Shopping', 'Shopping'],
+        )
+
+    def test_delete_user_renews_lease(self):
+        enqueue('delete_user', self.user)
+        with mock.patch('budgetapp.jobs.renew_lease') as renew_lease:
+            run_pending()
+        self.assertTrue(renew_lease.called)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+
+    def test_delete_user_in_background(self):
+        response = self.client.delete(
+            '/users/{}/?background=true'.format(self.user.pk))
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(AccountDeletion.objects.exists())
+
+        run_pending()
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_jobs_of_other_users(self):
+        other = User.objects.create(username='other', password='test')
+        job = enqueue('refresh_category_totals', other)
+        response = self.client.get('/jobs/{}/'.format(job.pk))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/jobs/')
+        self.assertEqual(response.data['count'], 0)
@@ -1,9 +1,14 @@
-from datetime import datetime
+import io
+import threading
+import time
+from datetime import datetime, timezone
 from decimal import Decimal
 
 from budgetapp import models
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
 
 
 class BudgetTests(TestCase):
@@ -83,6 +88,18 @@ class BudgetTests(TestCase):
     def test_previous_none(self):
         self.assertEqual(self.budget1.previous, None)
 
+    def test_period(self):
+        self.assertEqual(self.budget2.period, 2000 * 12 + 1)
+        self.assertEqual(
+            models.Budget.from_period(self.budget2.period), (2000, 'FEB'))
+
+    def test_period_expression(self):
+        periods = models.Budget.objects.annotate(
+            period=models.Budget.period_expression(),
+        ).order_by('period').values_list('period', flat=True)
+        self.assertEqual(
+            list(periods), [self.budget1.period, self.budget2.period])
+
     def test_previous_jan(self):
         jan_99 = models.Budget.objects.create(
             month='DEC',
@@ -160,3 +177,346 @@ class BudgetCategoryTests(TestCase):
             date=datetime.now(),
         )
         self.assertEqual(category.spent, Decimal(-100))
+
+
+class CarryoverTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        self.payee = models.Payee.objects.create(
+            name='Payee 1',
+            owner=self.user,
+        )
+        self.categories = [
+            self.create_category(year, month)
+            for year, month in ((2000, 'JAN'), (2000, 'FEB'), (2000, 'MAR'))
+        ]
+
+    def create_category(self, year, month, limit=100):
+        budget, created = models.Budget.objects.get_or_create(
+            month=month,
+            year=year,
+            owner=self.user,
+        )
+        group, created = models.BudgetCategoryGroup.objects.get_or_create(
+            name='Group 1',
+            budget=budget,
+        )
+        return models.BudgetCategory.objects.create(
+            category='Category 1',
+            group=group,
+            limit=limit,
+        )
+
+    def get_carryovers(self):
+        return [
+            models.BudgetCategory.objects.get(pk=category.pk).carryover
+            for category in self.categories
+        ]
+
+    def test_carryover_created(self):
+        self.assertEqual(self.get_carryovers(), [0, 100, 200])
+
+    def test_carryover_transaction(self):
+        transaction = models.Transaction.objects.create(
+            budget_category=self.categories[0],
+            payee=self.payee,
+            amount=30,
+            date=datetime.now(),
+        )
+        self.assertEqual(self.get_carryovers(), [0, 70, 170])
+
+        # Moving the transaction updates both months.
+        transaction.budget_category = self.categories[1]
+        transaction.save()
+        self.assertEqual(self.get_carryovers(), [0, 100, 170])
+
+        transaction.delete()
+        self.assertEqual(self.get_carryovers(), [0, 100, 200])
+
+    def test_carryover_limit(self):
+        category = self.categories[1]
+        category.limit = 50
+        category.save()
+        self.assertEqual(self.get_carryovers(), [0, 100, 150])
+
+    def test_carryover_only_later_months(self):
+        """
+        Only the changed month and later months are loaded.
+        """
+        category = models.BudgetCategory.objects.get(
+            pk=self.categories[2].pk)
+        with self.assertNumQueries(4):
+            # Save, carryover key lookup, lock, category lookup.
+            category.limit = 50
+            category.save()
+
+    def test_carryover_gap(self):
+        """
+        A month without the category resets the carryover.
+        """
+        self.categories[1].delete()
+        self.categories.pop(1)
+        self.assertEqual(self.get_carryovers(), [0, 0])
+
+        self.categories.insert(1, self.create_category(2000, 'FEB', 10))
+        self.assertEqual(self.get_carryovers(), [0, 100, 110])
+
+    def test_carryover_locked(self):
+        """
+        The recomputed chains stay locked until the transaction ends.
+        """
+        keys = models.BudgetCategory.objects.carryover_keys(
+            pk=self.categories[0].pk)
+        with transaction.atomic():
+            models.BudgetCategory.objects.update_carryover(keys)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT count(*) FROM pg_locks WHERE locktype = "
+                    "'advisory' AND pid = pg_backend_pid() AND granted")
+                self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_merge_duplicate_categories(self):
+        # Duplicates could be created before migration 0043.
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX category_name_uniq')
+        group = models.BudgetCategoryGroup.objects.create(
+            name='Group 2',
+            budget=self.categories[0].group.budget,
+        )
+        duplicate = models.BudgetCategory.objects.create(
+            category='Category 1',
+            group=group,
+            limit=50,
+        )
+        models.Transaction.objects.create(
+            budget_category=duplicate,
+            payee=self.payee,
+            amount=30,
+            date=datetime.now(),
+        )
+
+        out = io.StringIO()
+        call_command('merge_duplicate_categories', stdout=out)
+        self.assertEqual(out.getvalue(), 'Merged 1 categories.\n')
+
+        category = models.BudgetCategory.objects.get(
+            pk=self.categories[0].pk)
+        self.assertEqual(category.limit, 150)
+        self.assertEqual(category.spent, 30)
+        self.assertFalse(
+            models.BudgetCategory.objects.filter(pk=duplicate.pk).exists())
+        self.assertTrue(models.Tombstone.objects.filter(
+            model='budgetcategory', object_pk=duplicate.pk).exists())
+        self.assertEqual(self.get_carryovers(), [0, 120, 220])
+
+    def test_carryover_rename(self):
+        category = self.categories[1]
+        category.category = 'Category 2'
+        category.save()
+        self.assertEqual(self.get_carryovers(), [0, 0, 0])
+
+    def test_balance(self):
+        models.Transaction.objects.create(
+            budget_category=self.categories[1],
+            payee=self.payee,
+            amount=30,
+            date=datetime.now(),
+        )
+        category = models.BudgetCategory.objects.get(
+            pk=self.categories[1].pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(category.balance, Decimal(170))
+            self.assertEqual(category.spent, Decimal(30))
+
+
+class RolloverTests(TestCase):
+
+    def setUp(self):
+        self.users = [
+            User.objects.create(username=name, password='test')
+            for name in ('user1', 'user2', 'inactive')
+        ]
+        self.users[2].is_active = False
+        self.users[2].save()
+        payee = models.Payee.objects.create(
+            name='Payee 1',
+            owner=self.users[0],
+        )
+        for user in self.users:
+            budget = models.Budget.objects.create(
+                month='JAN',
+                year=2000,
+                owner=user,
+            )
+            group = models.BudgetCategoryGroup.objects.create(
+                name='Group 1',
+                budget=budget,
+            )
+            category = models.BudgetCategory.objects.create(
+                category='Category 1',
+                group=group,
+                limit=100,
+            )
+            models.BudgetCategory.objects.create(
+                category='Category 2',
+                group=group,
+                limit=50,
+                deleted_at=datetime.now(timezone.utc),
+            )
+            if user == self.users[0]:
+                models.Transaction.objects.create(
+                    budget_category=category,
+                    payee=payee,
+                    amount=30,
+                    date=datetime(2000, 1, 5),
+                )
+        # The second user already has next month's budget.
+        models.Budget.objects.create(
+            month='FEB',
+            year=2000,
+            owner=self.users[1],
+        )
+
+    def test_rollover(self):
+        period = models.Budget.get_period(2000, 'FEB')
+        with self.assertNumQueries(2):
+            self.assertEqual(models.Budget.objects.rollover(period), 1)
+
+        categories = models.BudgetCategory.objects.filter(
+            group__budget__month='FEB',
+        ).values_list(
+            'group__budget__owner', 'group__name', 'category', 'limit',
+            'carryover',
+        )
+        self.assertEqual(list(categories), [
+            (self.users[0].pk, 'Group 1', 'Category 1', 100, 70),
+        ])
+
+        # Running again creates nothing.
+        self.assertEqual(models.Budget.objects.rollover(period), 0)
+
+    def test_rollover_command(self):
+        out = io.StringIO()
+        call_command('rollover_budgets', month='2000-02', stdout=out)
+        self.assertEqual(out.getvalue(), 'Created 1 budgets for FEB 2000.\n')
+
+    def test_rollover_before_later_budget(self):
+        march = models.Budget.objects.create(
+            month='MAR',
+            year=2000,
+            owner=self.users[0],
+        )
+        group = models.BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=march,
+        )
+        category = models.BudgetCategory.objects.create(
+            category='Category 1',
+            group=group,
+            limit=100,
+        )
+        self.assertEqual(category.carryover, 0)
+
+        models.Budget.objects.rollover(models.Budget.get_period(2000, 'FEB'))
+        category.refresh_from_db()
+        self.assertEqual(category.carryover, 170)
+
+
+class PayeeResolveTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+
+    def test_resolve(self):
+        payee = models.Payee.objects.create(name='Payee 1', owner=self.user)
+        with self.assertNumQueries(2):
+            payees = models.Payee.objects.resolve(
+                self.user, ['Payee 1', 'Payee 2', 'Payee 2'])
+        self.assertEqual(payees['Payee 1'], payee)
+        self.assertEqual(
+            payees['Payee 2'], models.Payee.objects.get(name='Payee 2'))
+
+    def test_resolve_concurrently_created(self):
+        """
+        A payee created by another transaction after it was looked up is
+        fetched instead of failing the insert.
+        """
+        inserted = threading.Event()
+
+        def create():
+            try:
+                with transaction.atomic():
+                    models.Payee.objects.create(
+                        name='Payee 1', owner=self.user)
+                    inserted.set()
+                    time.sleep(0.2)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=create)
+        thread.start()
+        inserted.wait()
+        payees = models.Payee.objects.resolve(self.user, ['Payee 1'])
+        thread.join()
+
+        self.assertEqual(
+            payees['Payee 1'], models.Payee.objects.get(name='Payee 1'))
+
+
+class CategoryTotalTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        budget = models.Budget.objects.create(
+            month='FEB',
+            year=2000,
+            owner=user,
+        )
+        group = models.BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=budget,
+        )
+        self.category = models.BudgetCategory.objects.create(
+            category='Category 1',
+            group=group,
+            limit=100,
+        )
+        self.payee = models.Payee.objects.create(
+            name='Payee 1',
+            owner=user,
+        )
+
+    def test_refresh(self):
+        models.CategoryTotal.refresh()
+        total = models.CategoryTotal.objects.get(category=self.category)
+        self.assertEqual(total.spent, Decimal(0))
+        self.assertEqual(total.period, 2000 * 12 + 1)
+        self.assertEqual(total.group_name, 'Group 1')
+        self.assertEqual(total.category_name, 'Category 1')
+
+        models.Transaction.objects.create(
+            budget_category=self.category,
+            payee=self.payee,
+            amount=100,
+            date=datetime.now(),
+        )
+        models.Transaction.objects.create(
+            budget_category=self.category,
+            payee=self.payee,
+            amount=-25,
+            date=datetime.now(),
+        )
+        models.CategoryTotal.refresh()
+        total = models.CategoryTotal.objects.get(category=self.category)
+        self.assertEqual(total.spent, Decimal(75))
+        self.assertEqual(total.transaction_count, 2)
@@ -0,0 +1,168 @@
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from ..models import (Budget, BudgetCategory, BudgetCategoryGroup, Payee,
+                      RecurringTransaction, Transaction)
+from ..recurring import materialize_due
+
+
+class RecurringTransactionTests(TestCase):
+
+    def test_get_next_date(self):
+        rule = RecurringTransaction(start_date=date(2000, 1, 31))
+        self.assertEqual(rule.get_next_date(date(2000, 1, 31)),
+                         date(2000, 2, 29))
+        self.assertEqual(rule.get_next_date(date(2000, 2, 29)),
+                         date(2000, 3, 31))
+        self.assertEqual(rule.get_next_date(date(2000, 12, 31)),
+                         date(2001, 1, 31))
+
+        rule.frequency = 'YEARLY'
+        rule.start_date = date(2000, 2, 29)
+        self.assertEqual(rule.get_next_date(date(2000, 2, 29)),
+                         date(2001, 2, 28))
+        self.assertEqual(rule.get_next_date(date(2003, 2, 28)),
+                         date(2004, 2, 29))
+
+        rule.frequency = 'WEEKLY'
+        self.assertEqual(rule.get_next_date(date(2000, 2, 29)),
+                         date(2000, 3, 7))
+
+
+class MaterializeTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        self.categories = {}
+        for month in ('JAN', 'FEB'):
+            budget = Budget.objects.create(
+                month=month,
+                year=2000,
+                owner=self.user,
+            )
+            group = BudgetCategoryGroup.objects.create(
+                name='Group 1',
+                budget=budget,
+            )
+            self.categories[month] = BudgetCategory.objects.create(
+                category='Rent',
+                group=group,
+                limit=1000,
+            )
+        self.rule = RecurringTransaction.objects.create(
+            amount=900,
+            payee='Landlord',
+            category='Rent',
+            start_date=date(2000, 1, 1),
+            next_date=date(2000, 1, 1),
+            owner=self.user,
+        )
+
+    def test_materialize(self):
+        self.assertEqual(materialize_due(date(2000, 2, 15)), (2, 0))
+
+        self.rule.refresh_from_db()
+        self.assertEqual(self.rule.next_date, date(2000, 3, 1))
+        for category in self.categories.values():
+            transaction = Transaction.objects.get(budget_category=category)
+            self.assertEqual(transaction.amount, Decimal(900))
+            self.assertEqual(transaction.payee.name, 'Landlord')
+            self.assertEqual(transaction.recurring, self.rule)
+
+        # The carry-over of February includes January's spending.
+        self.categories['FEB'].refresh_from_db()
+        self.assertEqual(self.categories['FEB'].carryover, Decimal(100))
+
+    def test_materialize_repeated(self):
+        """
+        Running again does not create duplicates, including for
+        occurrences created by an earlier run that was interrupted
+        before advancing the rule.
+        """
+        materialize_due(date(2000, 2, 15))
+        RecurringTransaction.objects.update(next_date=date(2000, 1, 1))
+
+        self.assertEqual(materialize_due(date(2000, 2, 15)), (0, 0))
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.rule.refresh_from_db()
+        self.assertEqual(self.rule.next_date, date(2000, 3, 1))
+
+    def test_materialize_missing_category(self):
+        """
+        A rule waits at the first occurrence without a category, and
+        continues once the category exists.
+        """
+        self.categories['JAN'].delete()
+        self.assertEqual(materialize_due(date(2000, 2, 15)), (0, 2))
+        self.rule.refresh_from_db()
+        self.assertEqual(self.rule.next_date, date(2000, 1, 1))
+
+        self.rule.category = 'Other'
+        self.rule.save()
+        BudgetCategory.objects.create(
+            category='Other',
+            group=self.categories['FEB'].group,
+            limit=0,
+        )
+        self.assertEqual(materialize_due(date(2000, 2, 15)), (0, 2))
+
+    def test_materialize_end_date(self):
+        self.rule.end_date = date(2000, 1, 31)
+        self.rule.save()
+
+        self.assertEqual(materialize_due(date(2000, 2, 15)), (1, 0))
+        self.assertEqual(materialize_due(date(2000, 2, 15)), (0, 0))
+
+    def test_materialize_batches(self):
+        RecurringTransaction.objects.create(
+            amount=50,
+            payee='Landlord',
+            category='Rent',
+            start_date=date(2000, 1, 15),
+            next_date=date(2000, 1, 15),
+            owner=self.user,
+        )
+        self.assertEqual(
+            materialize_due(date(2000, 2, 15), batch_size=1), (4, 0))
+        self.assertEqual(Payee.objects.filter(owner=self.user).count(), 1)
+
+
+class RecurringTransactionViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_create(self):
+        response = self.client.post('/recurringtransactions/', {
+            'amount': '900.00',
+            'payee': 'Landlord',
+            'category': 'Rent',
+            'frequency': 'MONTHLY',
+            'start_date': '2000-01-31',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['next_date'], '2000-01-31')
+        rule = RecurringTransaction.objects.get()
+        self.assertEqual(rule.owner, self.user)
+
+    def test_create_end_before_start(self):
+        response = self.client.post('/recurringtransactions/', {
+            'amount': '900.00',
+            'payee': 'Landlord',
+            'category': 'Rent',
+            'start_date': '2000-01-31',
+            'end_date': '2000-01-01',
+        })
+        self.assertEqual(response.status_code, 400)
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from django.test import RequestFactory, TestCase
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import force_authenticate
 
 from ..models import Budget, BudgetCategory, BudgetCategoryGroup
@@ -66,8 +67,11 @@ class SerializerTests(TestCase):
                 'request': request,
             },
         )
-        self.assertFalse(serializer.is_valid())
-        self.assertEqual(serializer.errors, {
+        # Uniqueness is enforced by the database when saving.
+        self.assertTrue(serializer.is_valid())
+        with self.assertRaises(ValidationError) as context:
+            serializer.save()
+        self.assertEqual(context.exception.detail, {
             'non_field_errors': ['Category must be unique within this budget.']
         })
 
@@ -1,15 +1,33 @@
+import io
 import json
-from datetime import date
+import threading
+import time
+from datetime import date, timedelta
 from decimal import Decimal
+from unittest import mock
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
 from rest_framework.test import APIClient, APIRequestFactory
 
-from ..models import (Budget, BudgetCategory, BudgetCategoryGroup, Payee,
-                      Transaction)
-from ..views import ObtainAuthTokenCookieView, logout
+from ..models import (AccountDeletion, Budget, BudgetCategory,
+                      BudgetCategoryGroup, BudgetManager, CategoryTotal,
+                      IdempotencyKey, ImportRule, Payee, RecurringTransaction,
+                      Tombstone, Transaction)
+from ..purge import delete_budget, delete_user
+from ..search import name_matches
+from ..views import (BudgetCategoryViewSet, CopyBudgetView,
+                     ObtainAuthTokenCookieView, TransactionViewSet, logout)
 
 
 class AuthViewTests(TestCase):
@@ -255,6 +273,95 @@ class BudgetCategoryViewTests(TestCase):
         data = json.loads(response.content)
         self.assertEqual(data['limit'], '200.00')
 
+    def test_budget_category_unique_in_budget(self):
+        response = self.client.post('/budgetcategories/', {
+            'budget_year': 2000,
+            'budget_month': 'JAN',
+            'category': 'Category 1',
+            'group': 'Group 2',
+            'limit': 100,
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['non_field_errors'],
+            ['Category must be unique within this budget.'],
+        )
+        self.assertEqual(BudgetCategory.objects.count(), 1)
+
+        # Renaming into a taken name is rejected as well.
+        category = BudgetCategory.objects.create(
+            category='Category 2',
+            group=self.group,
+        )
+        response = self.client.patch(
+            '/budgetcategories/{}/'.format(category.pk),
+            {'category': 'Category 1'},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['non_field_errors'],
+            ['Category must be unique within this budget.'],
+        )
+
+    def test_budget_category_unique_constraint(self):
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 2',
+            budget=self.group.budget,
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BudgetCategory.objects.create(category='Category 1', group=group)
+
+        # Deleted categories do not take up their name.
+        self.client.delete('/budgetcategories/{}/'.format(self.category.pk))
+        response = self.client.post('/budgetcategories/', {
+            'budget_year': 2000,
+            'budget_month': 'JAN',
+            'category': 'Category 1',
+            'group': 'Group 2',
+        })
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(
+            '/budgetcategories/{}/restore/'.format(self.category.pk))
+        self.assertEqual(response.status_code, 400)
+
+    def test_budget_category_follows_group(self):
+        budget = Budget.objects.create(
+            month='FEB',
+            year=2000,
+            owner=self.user,
+        )
+        response = self.client.patch(
+            '/budgetcategories/{}/'.format(self.category.pk),
+            {'budget_month': 'FEB', 'group': 'Group 2'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['group'], 'Group 2')
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.budget, budget)
+
+        # Moving a group moves its categories.
+        self.client.patch(
+            '/budgetcategorygroups/{}/'.format(self.category.group_id),
+            {'budget': reverse('budgetapp:budget-detail',
+                               args=[self.group.budget_id])},
+        )
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.budget_id, self.group.budget_id)
+
+        # Unless the budget has a category with the same name.
+        other = BudgetCategory.objects.create(
+            category='Category 1',
+            group=BudgetCategoryGroup.objects.create(
+                name='Group 3', budget=budget),
+        )
+        response = self.client.patch(
+            '/budgetcategorygroups/{}/'.format(self.category.group_id),
+            {'budget': reverse('budgetapp:budget-detail', args=[budget.pk])},
+        )
+        self.assertEqual(response.status_code, 400)
+        other.refresh_from_db()
+        self.assertEqual(other.budget, budget)
+
 
 class TransactionViewTests(TestCase):
 
@@ -325,6 +432,35 @@ class TransactionViewTests(TestCase):
         self.assertEqual(data['date'], '2019-01-16')
         self.assertEqual(data['payee'], 'Non-Existing Payee')
 
+    def test_other_users_category(self):
+        other = User.objects.create(username='other', password='test')
+        budget = Budget.objects.create(month='JAN', year=2000, owner=other)
+        category = BudgetCategory.objects.create(
+            category='Category 1',
+            group=BudgetCategoryGroup.objects.create(
+                name='Group 1', budget=budget),
+            limit=100,
+        )
+        response = self.client.post('/transactions/', {
+            'amount': 100,
+            'budget_category': category.pk,
+            'date': '2019-01-16',
+            'payee': 'Payee 1'
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['budget_category'], [
+            'Invalid pk "{}" - object does not exist.'.format(category.pk),
+        ])
+
+        response = self.client.post('/budgetcategorygroups/', {
+            'name': 'Group 2',
+            'budget': 'http://testserver/budgets/{}/'.format(budget.pk),
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('budget', response.data)
+        self.assertFalse(budget.budget_category_groups.filter(
+            name='Group 2').exists())
+
     def test_budget_category_put_payee_existing(self):
         response = self.client.put(
             '/transactions/{}/'.format(self.transaction.pk), {
@@ -399,161 +535,1387 @@ class TransactionViewTests(TestCase):
         self.assertEqual(data['payee'], 'Payee 1')
 
 
-class CopyBudgetViewTests(TestCase):
+class TransactionBulkViewTests(TestCase):
 
     def setUp(self):
         self.user = User.objects.create(
             username='test',
             password='test',
         )
-        self.budget1 = Budget.objects.create(
+        budget = Budget.objects.create(
             month='JAN',
             year=2000,
             owner=self.user,
         )
-        self.group1 = BudgetCategoryGroup.objects.create(
+        group = BudgetCategoryGroup.objects.create(
             name='Group 1',
-            budget=self.budget1,
+            budget=budget,
         )
-        self.category1 = BudgetCategory.objects.create(
+        self.category = BudgetCategory.objects.create(
             category='Category 1',
-            group=self.group1,
+            group=group,
             limit=100,
         )
-        self.category2 = BudgetCategory.objects.create(
-            category='Category 2',
-            group=self.group1,
-            limit=100,
+        self.payee = Payee.objects.create(
+            name='Payee 1',
+            owner=self.user,
         )
 
-        self.budget2 = Budget.objects.create(
-            month='FEB',
-            year=2000,
-            owner=self.user,
+        other_user = User.objects.create(
+            username='test2',
+            password='test2',
         )
-        self.group2 = BudgetCategoryGroup.objects.create(
-            name='Group 2',
-            budget=self.budget2,
+        other_budget = Budget.objects.create(
+            month='JAN',
+            year=2000,
+            owner=other_user,
         )
-        self.category3 = BudgetCategory.objects.create(
-            category='Category 3',
-            group=self.group2,
-            limit=200,
+        other_group = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=other_budget,
         )
-        self.category4 = BudgetCategory.objects.create(
-            category='Category 4',
-            group=self.group2,
-            limit=200,
+        self.other_category = BudgetCategory.objects.create(
+            category='Category 1',
+            group=other_group,
+            limit=100,
         )
 
         self.client = APIClient()
         self.client.force_authenticate(user=self.user)
 
-    def test_basic_request(self):
-        response = self.client.post('/copy-budget/', {
-            'source': self.budget1.pk,
-            'target_year': 2000,
-            'target_month': 'FEB',
-        })
-        self.assertEqual(response.status_code, 200)
+    def test_bulk_create(self):
+        response = self.client.post('/transactions/bulk/', [
+            {
+                'amount': 100,
+                'budget_category': self.category.pk,
+                'date': '2000-01-16',
+                'payee': 'Payee 1',
+            },
+            {
+                'amount': 50,
+                'budget_category': self.category.pk,
+                'date': '2000-01-17',
+                'payee': 'New Payee',
+            },
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
 
-    def test_bad_request(self):
-        response = self.client.post('/copy-budget/', {
-            'source': self.budget1.pk,
-            'target_year': 2000,
-        })
-        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.content)
+        self.assertEqual(
+            sorted(item['payee'] for item in data.values()),
+            ['New Payee', 'Payee 1'],
+        )
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(
+            Payee.objects.filter(owner=self.user).count(), 2)
+        self.assertEqual(self.category.spent, Decimal(150))
 
-    def test_copy_existing_to_existing(self):
-        response = self.client.post('/copy-budget/', {
-            'source': self.budget1.pk,
-            'target_year': 2000,
-            'target_month': 'FEB',
-        })
-        self.assertEqual(response.status_code, 200)
+    def test_bulk_create_query_count(self):
+        """
+        The number of queries does not depend on the number
+        of transactions.
+        """
+        transactions = [
+            {
+                'amount': 1,
+                'budget_category': self.category.pk,
+                'date': '2000-01-16',
+                'payee': 'Payee {}'.format(i),
+            }
+            for i in range(50)
+        ]
+        # Category lookup, payee lookup, savepoint, payee insert,
+        # transaction insert, carryover key lookup, lock, category lookup,
+        # payee usage update, savepoint release.
+        with self.assertNumQueries(10):
+            response = self.client.post(
+                '/transactions/bulk/', transactions, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Transaction.objects.count(), 50)
 
-        groups = \
-            self.budget2.budget_category_groups.values_list('name', flat=True)
-        self.assertEqual(list(groups), ['Group 1'])
+    def test_bulk_create_errors(self):
+        """
+        Errors are returned per item and nothing is created.
+        """
+        response = self.client.post('/transactions/bulk/', [
+            {
+                'amount': 100,
+                'budget_category': self.category.pk,
+                'date': '2000-01-16',
+                'payee': 'Payee 1',
+            },
+            {
+                'amount': 100,
+                'budget_category': self.other_category.pk,
+                'date': '2000-01-16',
+                'payee': 'Payee 1',
+            },
+            {
+                'budget_category': self.category.pk,
+                'date': '2000-01-16',
+                'payee': 'Payee 1',
+            },
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
 
-        categories = (
-            self.budget2
-            .budget_category_groups.first()
-            .budget_categories.values_list('category', flat=True)
+        data = json.loads(response.content)
+        self.assertEqual(len(data), 3)
+        self.assertEqual(data[0], {})
+        self.assertIn('budget_category', data[1])
+        self.assertIn('amount', data[2])
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_bulk_create_not_list(self):
+        response = self.client.post('/transactions/bulk/', {
+            'amount': 100,
+            'budget_category': self.category.pk,
+            'date': '2000-01-16',
+            'payee': 'Payee 1',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_create_too_many(self):
+        transaction = {
+            'amount': 1,
+            'budget_category': self.category.pk,
+            'date': '2000-01-16',
+            'payee': 'Payee 1',
+        }
+        with self.assertNumQueries(0):
+            response = self.client.post(
+                '/transactions/bulk/', [transaction] * 1001, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.content)['non_field_errors'],
+            ['Batches cannot have more than 1000 transactions.'],
         )
-        self.assertEqual(list(categories), ['Category 1', 'Category 2'])
 
-    def test_copy_existing_to_nonexisting(self):
-        response = self.client.post('/copy-budget/', {
-            'source': self.budget1.pk,
-            'target_year': 3000,
-            'target_month': 'FEB',
-        })
-        self.assertEqual(response.status_code, 200)
 
-        budget = Budget.objects.get(
-            year=3000,
-            month='FEB',
+class TransactionBulkOperationViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        budget = Budget.objects.create(
+            month='JAN',
+            year=2000,
             owner=self.user,
         )
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=budget,
+        )
+        self.category1 = BudgetCategory.objects.create(
+            category='Category 1',
+            group=group,
+            limit=100,
+        )
+        self.category2 = BudgetCategory.objects.create(
+            category='Category 2',
+            group=group,
+            limit=100,
+        )
+        self.payee1 = Payee.objects.create(name='Payee 1', owner=self.user)
+        self.payee2 = Payee.objects.create(name='Payee 2', owner=self.user)
+        for i in range(10):
+            Transaction.objects.create(
+                amount=10,
+                payee=self.payee1 if i % 2 else self.payee2,
+                budget_category=self.category1,
+                date=date(2000, 1, i + 1),
+            )
 
-        groups = \
-            budget.budget_category_groups.values_list('name', flat=True)
-        self.assertEqual(list(groups), ['Group 1'])
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
 
-        categories = (
-            budget
-            .budget_category_groups.first()
-            .budget_categories.values_list('category', flat=True)
+    def test_recategorize(self):
+        # Category lookup, savepoint, update, carryover key lookup, lock,
+        # category lookup, savepoint release.
+        with self.assertNumQueries(7):
+            response = self.client.post(
+                '/transactions/recategorize/?payee=Payee 1',
+                {'budget_category': self.category2.pk},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'updated': 5})
+        self.assertEqual(self.category2.spent, Decimal(50))
+        self.assertEqual(self.category1.spent, Decimal(50))
+
+    def test_recategorize_other_users_category(self):
+        other = User.objects.create(username='other', password='other')
+        category = BudgetCategory.objects.create(
+            category='Other',
+            group=BudgetCategoryGroup.objects.create(
+                name='Group 1',
+                budget=Budget.objects.create(
+                    month='JAN', year=2000, owner=other),
+            ),
+            limit=0,
         )
-        self.assertEqual(list(categories), ['Category 1', 'Category 2'])
+        response = self.client.post(
+            '/transactions/recategorize/?payee=Payee 1',
+            {'budget_category': category.pk},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(category.spent, 0)
 
-    def test_copy_nonexisting(self):
-        response = self.client.post('/copy-budget/', {
-            'source': -1,
-            'target_year': 3000,
-            'target_month': 'FEB',
-        })
+    def test_filter_required(self):
+        response = self.client.post(
+            '/transactions/recategorize/',
+            {'budget_category': self.category2.pk},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/transactions/bulk-delete/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.objects.count(), 10)
+
+    def test_empty_filter(self):
+        # Empty values are ignored by the filters, so they match everything.
+        response = self.client.post(
+            '/transactions/recategorize/?payee=',
+            {'budget_category': self.category2.pk},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.category2.transaction_set.exists())
+        response = self.client.post('/transactions/bulk-delete/?payee=')
         self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.objects.count(), 10)
 
-    def test_copy_another_users(self):
-        user = User.objects.create(
-            username='test2',
-            password='test2',
+    def test_bulk_delete(self):
+        response = self.client.post(
+            '/transactions/bulk-delete/?date_after=2000-01-05&payee=Payee 2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'deleted': 3})
+        self.assertEqual(Transaction.objects.count(), 7)
+        self.assertEqual(self.category1.spent, Decimal(70))
+        self.assertEqual(
+            Tombstone.objects.filter(
+                owner=self.user, model='transaction').count(), 3)
+
+        self.payee2.refresh_from_db()
+        self.assertEqual(self.payee2.transaction_count, 2)
+        self.assertEqual(self.payee2.last_used, date(2000, 1, 3))
+
+    def test_bulk_delete_ids(self):
+        pks = list(
+            Transaction.objects.values_list('pk', flat=True)[:2])
+        response = self.client.post(
+            '/transactions/bulk-delete/?ids={},{}'.format(*pks))
+        self.assertEqual(response.data, {'deleted': 2})
+
+    def test_merge_payees(self):
+        rule = ImportRule.objects.create(
+            match='payee',
+            payee='Payee 2',
+            category='Category 1',
+            owner=self.user,
+        )
+        response = self.client.post('/payees/merge/', {
+            'payees': [self.payee2.pk],
+            'into': self.payee1.pk,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'updated': 5})
+
+        self.assertFalse(Payee.objects.filter(pk=self.payee2.pk).exists())
+        self.payee1.refresh_from_db()
+        self.assertEqual(self.payee1.transaction_count, 10)
+        rule.refresh_from_db()
+        self.assertEqual(rule.payee, 'Payee 1')
+        self.assertTrue(
+            Tombstone.objects.filter(
+                model='payee', object_pk=self.payee2.pk).exists())
+
+    def test_merge_other_users_payee(self):
+        other = User.objects.create(username='other', password='other')
+        payee = Payee.objects.create(name='Other', owner=other)
+        response = self.client.post('/payees/merge/', {
+            'payees': [payee.pk],
+            'into': self.payee1.pk,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Payee.objects.filter(pk=payee.pk).exists())
+
+
+class StatementImportViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
         )
         budget = Budget.objects.create(
             month='JAN',
             year=2000,
-            owner=user,
+            owner=self.user,
+        )
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=budget,
+        )
+        self.category = BudgetCategory.objects.create(
+            category='Shopping',
+            group=group,
+            limit=100,
         )
-        response = self.client.post('/copy-budget/', {
-            'source': budget.pk,
-            'target_year': 3000,
-            'target_month': 'FEB',
-        })
-        self.assertEqual(response.status_code, 400)
 
-    def test_copy_previous_month(self):
-        """
-        Defaults to the previous month's budget from the target
-        month if no source is given.
-        """
-        response = self.client.post('/copy-budget/', {
-            'target_year': 2000,
-            'target_month': 'FEB',
-        })
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_import_csv(self):
+        statement = SimpleUploadedFile(
+            'statement.csv',
+            b'date,amount,description,category\n'
+            b'2000-01-15,-45.10,Amazon,Shopping\n'
+            b'2000-01-16,-5.00,Coffee,Dining\n',
+        )
+        response = self.client.post(
+            '/transactions/import/', {'file': statement})
         self.assertEqual(response.status_code, 200)
 
-        groups = \
-            self.budget2.budget_category_groups.values_list('name', flat=True)
-        self.assertEqual(list(groups), ['Group 1'])
+        data = json.loads(response.content)
+        self.assertEqual(data['rows'], 2)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(data['errors'][0]['row'], 2)
+        self.assertEqual(self.category.spent, Decimal('45.10'))
+
+    def test_import_unreadable(self):
+        statement = SimpleUploadedFile(
+            'statement.csv',
+            b'date,amount,description,category\n'
+            b'2000-01-15,-45.10,Amazon,Shopping\n'
+            b'2000-01-16,-5.00,Coffee\0,Shopping\n',
+        )
+        response = self.client.post(
+            '/transactions/import/', {'file': statement})
+        self.assertEqual(response.status_code, 400)
 
-        categories = (
-            self.budget2
-            .budget_category_groups.first()
-            .budget_categories.values_list('category', flat=True)
+        # The rows before the one that cannot be read are imported.
+        data = json.loads(response.content)
+        self.assertEqual(data['rows'], 2)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(data['errors'][0]['row'], 2)
+        self.assertEqual(self.category.spent, Decimal('45.10'))
+
+    def test_import_not_utf8(self):
+        statement = SimpleUploadedFile(
+            'statement.csv',
+            b'date,amount,description,category\n'
+            b'2000-01-15,-45.10,Caf\xe9,Shopping\n',
         )
-        self.assertEqual(list(categories), ['Category 1', 'Category 2'])
+        response = self.client.post(
+            '/transactions/import/', {'file': statement})
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.content)
+        self.assertEqual(data['imported'], 0)
+        self.assertIn('could not be read', data['errors'][0]['error'])
+
+        statement.seek(0)
+        response = self.client.post(
+            '/transactions/import/?background=true', {'file': statement})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file', json.loads(response.content))
+
+    def test_import_unknown_format(self):
+        statement = SimpleUploadedFile('statement.txt', b'')
+        response = self.client.post(
+            '/transactions/import/', {'file': statement})
+        self.assertEqual(response.status_code, 400)
+
+    def test_import_rule_create(self):
+        response = self.client.post('/importrules/', {
+            'match': 'amazon',
+            'payee': 'Amazon',
+            'category': 'Shopping',
+        })
+        self.assertEqual(response.status_code, 201)
+
+        rule = ImportRule.objects.get()
+        self.assertEqual(rule.owner, self.user)
+        self.assertEqual(rule.category, 'Shopping')
+
+
+class TransactionExportViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        budget = Budget.objects.create(
+            month='JAN',
+            year=2000,
+            owner=self.user,
+        )
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=budget,
+        )
+        self.category1 = BudgetCategory.objects.create(
+            category='Category 1',
+            group=group,
+            limit=100,
+        )
+        self.category2 = BudgetCategory.objects.create(
+            category='Category 2',
+            group=group,
+            limit=100,
+        )
+        payee = Payee.objects.create(
+            name='Payee 1',
+            owner=self.user,
+        )
+        Transaction.objects.create(
+            amount=100,
+            payee=payee,
+            budget_category=self.category1,
+            date=date(2000, 1, 1),
+        )
+        Transaction.objects.create(
+            amount=50,
+            payee=payee,
+            budget_category=self.category2,
+            date=date(2000, 1, 15),
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def get_content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_csv(self):
+        response = self.client.get('/transactions/export/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(self.get_content(response).splitlines(), [
+            'date,amount,payee,category,group,budget_month,budget_year',
+            '2000-01-01,100.00,Payee 1,Category 1,Group 1,JAN,2000',
+            '2000-01-15,50.00,Payee 1,Category 2,Group 1,JAN,2000',
+        ])
+
+    def test_export_jsonl(self):
+        response = self.client.get(
+            '/transactions/export/', {'file_format': 'jsonl'})
+        self.assertEqual(response.status_code, 200)
+
+        rows = [
+            json.loads(line)
+            for line in self.get_content(response).splitlines()
+        ]
+        self.assertEqual(rows[0], {
+            'date': '2000-01-01',
+            'amount': '100.00',
+            'payee': 'Payee 1',
+            'category': 'Category 1',
+            'group': 'Group 1',
+            'budget_month': 'JAN',
+            'budget_year': 2000,
+        })
+        self.assertEqual(len(rows), 2)
+
+    def test_export_filters(self):
+        response = self.client.get('/transactions/export/', {
+            'date_after': '2000-01-02',
+            'category': [self.category1.pk, self.category2.pk],
+        })
+        lines = self.get_content(response).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('2000-01-15,'))
+
+        response = self.client.get('/transactions/export/', {
+            'date_before': '2000-01-31',
+            'category': self.category1.pk,
+        })
+        lines = self.get_content(response).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('2000-01-01,'))
+
+    def test_export_other_user(self):
+        user = User.objects.create(
+            username='test2',
+            password='test2',
+        )
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/transactions/export/')
+        self.assertEqual(len(self.get_content(response).splitlines()), 1)
+
+    def test_export_bad_format(self):
+        response = self.client.get(
+            '/transactions/export/', {'file_format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class FilterViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        payee1 = Payee.objects.create(name='Payee 1', owner=self.user)
+        payee2 = Payee.objects.create(name='Payee 2', owner=self.user)
+        self.categories = {}
+        self.transactions = {}
+        for month in ('JAN', 'FEB'):
+            budget = Budget.objects.create(
+                month=month,
+                year=2000,
+                owner=self.user,
+            )
+            group = BudgetCategoryGroup.objects.create(
+                name='Group 1',
+                budget=budget,
+            )
+            category = BudgetCategory.objects.create(
+                category='Category 1',
+                group=group,
+                limit=100,
+            )
+            BudgetCategory.objects.create(
+                category='Category 2',
+                group=group,
+                limit=100,
+            )
+            day = date(2000, Budget.MONTH_LOOKUP[month] + 1, 10)
+            self.categories[month] = category
+            self.transactions[month] = [
+                Transaction.objects.create(
+                    amount=10,
+                    payee=payee1,
+                    budget_category=category,
+                    date=day,
+                ),
+                Transaction.objects.create(
+                    amount=50,
+                    payee=payee2,
+                    budget_category=category,
+                    date=day.replace(day=20),
+                ),
+            ]
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def get_pks(self, url, params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return {int(pk) for pk in response.data}
+
+    def test_transaction_filters(self):
+        jan, feb = self.transactions['JAN'], self.transactions['FEB']
+        cases = (
+            ({'date_after': '2000-01-15', 'date_before': '2000-02-15'},
+             {jan[1].pk, feb[0].pk}),
+            ({'amount_min': '20'}, {jan[1].pk, feb[1].pk}),
+            ({'amount_max': '20'}, {jan[0].pk, feb[0].pk}),
+            ({'payee': 'Payee 1'}, {jan[0].pk, feb[0].pk}),
+            ({'budget_category': self.categories['FEB'].pk},
+             {feb[0].pk, feb[1].pk}),
+            ({'month': 'JAN', 'year': 2000}, {jan[0].pk, jan[1].pk}),
+            ({'month': 'JAN', 'payee': 'Payee 2'}, {jan[1].pk}),
+        )
+        for params, expected in cases:
+            with self.subTest(params=params):
+                self.assertEqual(
+                    self.get_pks('/transactions/', params), expected)
+
+    def test_budget_category_filters(self):
+        cases = (
+            ({'category': 'Category 1'},
+             {self.categories['JAN'].pk, self.categories['FEB'].pk}),
+            ({'category': 'Category 1', 'month': 'FEB', 'year': 2000},
+             {self.categories['FEB'].pk}),
+            ({'category': 'Category 1',
+              'budget': self.categories['JAN'].group.budget_id},
+             {self.categories['JAN'].pk}),
+            ({'group': self.categories['JAN'].group_id, 'category': 'Other'},
+             set()),
+        )
+        for params, expected in cases:
+            with self.subTest(params=params):
+                self.assertEqual(
+                    self.get_pks('/budgetcategories/', params), expected)
+
+    def test_filters_use_indexes(self):
+        """
+        Every filter can be answered with index scans alone. Sequential
+        scans are disabled, as the planner prefers them for the small test
+        tables, so a filter without a usable index still shows one.
+        """
+        viewsets = (
+            (TransactionViewSet, (
+                {'date_after': '2000-01-15', 'date_before': '2000-02-15'},
+                {'amount_min': '20', 'amount_max': '40'},
+                {'payee': 'Payee 1'},
+                {'budget_category': self.categories['JAN'].pk,
+                 'date_after': '2000-01-15'},
+                {'month': 'JAN', 'year': 2000},
+            )),
+            (BudgetCategoryViewSet, (
+                {'category': 'Category 1'},
+                {'month': 'JAN', 'year': 2000},
+                {'budget': self.categories['JAN'].group.budget_id},
+                {'group': self.categories['JAN'].group_id},
+            )),
+        )
+        factory = APIRequestFactory()
+        for viewset, cases in viewsets:
+            for params in cases:
+                request = Request(factory.get('/', params))
+                request.user = self.user
+                view = viewset(request=request, format_kwarg=None)
+                queryset = view.filter_queryset(view.get_queryset())
+                with connection.cursor() as cursor:
+                    cursor.execute('SET enable_seqscan = off')
+                    plan = queryset.explain()
+                    cursor.execute('SET enable_seqscan = on')
+
+                with self.subTest(viewset=viewset.__name__, params=params):
+                    self.assertNotIn('Seq Scan', plan)
+
+
+class TransactionSearchViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        budget = Budget.objects.create(
+            month='MAR',
+            year=2000,
+            owner=self.user,
+        )
+        group = BudgetCategoryGroup.objects.create(
+            name='Everyday',
+            budget=budget,
+        )
+        shopping = BudgetCategory.objects.create(
+            category='Shopping',
+            group=group,
+            limit=100,
+        )
+        groceries = BudgetCategory.objects.create(
+            category='Groceries',
+            group=group,
+            limit=100,
+        )
+        amazon = Payee.objects.create(
+            name='Amazon Marketplace',
+            owner=self.user,
+        )
+        market = Payee.objects.create(
+            name='Farmers Market',
+            owner=self.user,
+        )
+        self.amazon1 = Transaction.objects.create(
+            amount=45,
+            payee=amazon,
+            budget_category=shopping,
+            date=date(2000, 3, 10),
+        )
+        self.amazon2 = Transaction.objects.create(
+            amount=20,
+            payee=amazon,
+            budget_category=groceries,
+            date=date(2000, 3, 20),
+        )
+        self.market = Transaction.objects.create(
+            amount=30,
+            payee=market,
+            budget_category=groceries,
+            date=date(2000, 3, 15),
+        )
+
+        # Another user's matching transaction is never returned.
+        other = User.objects.create(username='other', password='other')
+        other_budget = Budget.objects.create(
+            month='MAR',
+            year=2000,
+            owner=other,
+        )
+        Transaction.objects.create(
+            amount=45,
+            payee=Payee.objects.create(name='Amazon', owner=other),
+            budget_category=BudgetCategory.objects.create(
+                category='Shopping',
+                group=BudgetCategoryGroup.objects.create(
+                    name='Everyday',
+                    budget=other_budget,
+                ),
+                limit=100,
+            ),
+            date=date(2000, 3, 10),
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def search(self, **params):
+        response = self.client.get('/transactions/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [result['pk'] for result in response.data['results']]
+
+    def test_search_prefix(self):
+        self.assertEqual(
+            self.search(q='amaz'), [self.amazon2.pk, self.amazon1.pk])
+
+    def test_search_across_names(self):
+        """
+        Each word may match a different name.
+        """
+        self.assertEqual(self.search(q='amazon shop'), [self.amazon1.pk])
+        self.assertEqual(
+            self.search(q='market'),
+            [self.amazon2.pk, self.market.pk, self.amazon1.pk])
+        self.assertEqual(len(self.search(q='everyday')), 3)
+
+    def test_search_ranges(self):
+        self.assertEqual(
+            self.search(q='amazon', amount_min='30'), [self.amazon1.pk])
+        self.assertEqual(
+            self.search(date_after='2000-03-12', date_before='2000-03-31'),
+            [self.amazon2.pk, self.market.pk])
+
+    def test_search_paginated(self):
+        response = self.client.get(
+            '/transactions/search/', {'q': 'groceries', 'page_size': 1})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_search_no_terms(self):
+        response = self.client.get('/transactions/search/', {'q': '%&!'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_uses_indexes(self):
+        """
+        Names can be matched with the GIN indexes. Sequential scans are
+        disabled, as the planner prefers them for the small test tables.
+        Other names are added, so that scanning all live categories or
+        groups through another partial index costs more.
+        """
+        budget = Budget.objects.create(month='APR', year=2000, owner=self.user)
+        groups = BudgetCategoryGroup.objects.bulk_create(
+            BudgetCategoryGroup(name='Group {}'.format(i), budget=budget)
+            for i in range(1000)
+        )
+        BudgetCategory.objects.bulk_create(
+            BudgetCategory(category='Category {}'.format(i), group=groups[0])
+            for i in range(1000)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'ANALYZE budgetapp_budgetcategory, '
+                'budgetapp_budgetcategorygroup')
+
+        lookups = (
+            (Payee, 'name', 'budgetapp_payee_name_search'),
+            (BudgetCategory, 'category',
+             'budgetapp_budgetcategory_category_search'),
+            (BudgetCategoryGroup, 'name',
+             'budgetapp_budgetcategorygroup_name_search'),
+        )
+        for model, field, index in lookups:
+            queryset = name_matches(model.objects.all(), field, ['amazon'])
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+                plan = queryset.explain()
+                cursor.execute('SET enable_seqscan = on')
+            self.assertIn(index, plan)
+
+
+class PayeeViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        budget = Budget.objects.create(
+            month='JAN',
+            year=2000,
+            owner=self.user,
+        )
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=budget,
+        )
+        self.category = BudgetCategory.objects.create(
+            category='Category 1',
+            group=group,
+            limit=100,
+        )
+        self.payees = {
+            name: Payee.objects.create(name=name, owner=self.user)
+            for name in ('Amazon', 'Amtrak', 'Apple', 'Bakery')
+        }
+        uses = (
+            ('Amazon', date(2000, 1, 1)),
+            ('Amtrak', date(2000, 1, 20)),
+            ('Amtrak', date(2000, 1, 2)),
+            ('Bakery', date(2000, 1, 3)),
+            ('Apple', date(2000, 1, 25)),
+        )
+        for name, day in uses:
+            Transaction.objects.create(
+                amount=1,
+                payee=self.payees[name],
+                budget_category=self.category,
+                date=day,
+            )
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def get_names(self, params=None):
+        response = self.client.get('/payees/', params or {})
+        self.assertEqual(response.status_code, 200)
+        return [payee['name'] for payee in response.data['results']]
+
+    def test_list_ranked(self):
+        """
+        Payees are ordered by transaction count, then by last use.
+        """
+        self.assertEqual(
+            self.get_names(), ['Amtrak', 'Apple', 'Bakery', 'Amazon'])
+
+    def test_autocomplete(self):
+        self.assertEqual(
+            self.get_names({'search': 'am'}), ['Amtrak', 'Amazon'])
+        self.assertEqual(self.get_names({'search': 'x'}), [])
+
+    def test_autocomplete_reads_payees_only(self):
+        # Count and page queries.
+        with self.assertNumQueries(2):
+            self.client.get('/payees/', {'search': 'am'})
+
+    def test_usage_maintained(self):
+        amazon = self.payees['Amazon']
+        transaction = Transaction.objects.get(payee=amazon)
+        transaction.payee = self.payees['Bakery']
+        transaction.save()
+        amazon.refresh_from_db()
+        self.assertEqual(amazon.transaction_count, 0)
+        self.assertIsNone(amazon.last_used)
+
+        self.client.post('/transactions/bulk/', [
+            {
+                'amount': 1,
+                'budget_category': self.category.pk,
+                'date': '2000-01-30',
+                'payee': 'Amazon',
+            },
+        ], format='json')
+        amazon.refresh_from_db()
+        self.assertEqual(amazon.transaction_count, 1)
+        self.assertEqual(amazon.last_used, date(2000, 1, 30))
+
+        Transaction.objects.filter(payee=self.payees['Amtrak'])[0].delete()
+        self.assertEqual(
+            self.get_names(), ['Bakery', 'Amazon', 'Apple', 'Amtrak'])
+
+    def test_paginated(self):
+        response = self.client.get('/payees/', {'page_size': 2})
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class ChangesViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        self.budget = Budget.objects.create(
+            month='JAN',
+            year=2000,
+            owner=self.user,
+        )
+        self.group = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=self.budget,
+        )
+        self.category = BudgetCategory.objects.create(
+            category='Category 1',
+            group=self.group,
+            limit=100,
+        )
+        self.payee = Payee.objects.create(
+            name='Payee 1',
+            owner=self.user,
+        )
+        self.transaction = Transaction.objects.create(
+            amount=100,
+            payee=self.payee,
+            budget_category=self.category,
+            date=date(2000, 1, 1),
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def get_changes(self, since=None):
+        params = {'since': since} if since is not None else {}
+        response = self.client.get('/changes/', params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_changes_full(self):
+        data = self.get_changes()
+        self.assertEqual(list(data['budgets']), [str(self.budget.pk)])
+        self.assertEqual(
+            list(data['budget_category_groups']), [str(self.group.pk)])
+        self.assertEqual(
+            list(data['budget_categories']), [str(self.category.pk)])
+        self.assertEqual(
+            list(data['transactions']), [str(self.transaction.pk)])
+        self.assertEqual(list(data['payees']), [str(self.payee.pk)])
+
+    def backdate(self):
+        # Changes within the sync window are returned again.
+        past = timezone.now() - timedelta(hours=1)
+        for model in (Budget, BudgetCategoryGroup, BudgetCategory,
+                      Transaction, Payee):
+            model.objects.update(updated_at=past)
+
+    def test_changes_since(self):
+        self.backdate()
+        cursor = self.get_changes()['cursor']
+
+        data = self.get_changes(cursor)
+        self.assertEqual(data['budgets'], {})
+        self.assertEqual(data['transactions'], {})
+        self.assertEqual(data['deleted']['transactions'], [])
+
+        self.category.limit = 200
+        self.category.save()
+        data = self.get_changes(cursor)
+        self.assertEqual(
+            list(data['budget_categories']), [str(self.category.pk)])
+        self.assertEqual(data['budget_category_groups'], {})
+        self.assertGreater(data['cursor'], cursor)
+
+    def test_changes_deleted(self):
+        cursor = self.get_changes()['cursor']
+        transaction_pk = self.transaction.pk
+        category_pk = self.category.pk
+        self.category.delete()
+
+        data = self.get_changes(cursor)
+        self.assertEqual(data['deleted']['transactions'], [transaction_pk])
+        self.assertEqual(data['deleted']['budget_categories'], [category_pk])
+        self.assertEqual(data['deleted']['budgets'], [])
+        self.assertEqual(
+            Tombstone.objects.filter(owner=self.user).count(), 2)
+
+    def test_changes_other_user(self):
+        user = User.objects.create(
+            username='test2',
+            password='test2',
+        )
+        self.client.force_authenticate(user=user)
+        data = self.get_changes()
+        self.assertEqual(data['budgets'], {})
+        self.assertEqual(data['payees'], {})
+
+    def test_changes_bad_cursor(self):
+        response = self.client.get('/changes/', {'since': 'bad'})
+        self.assertEqual(response.status_code, 400)
+
+
+class LateCommitChangesViewTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def get_changes(self, since=None):
+        params = {'since': since} if since is not None else {}
+        return self.client.get('/changes/', params).data
+
+    @mock.patch('budgetapp.utils.sync.SYNC_WINDOW', timedelta(0))
+    def test_late_commit(self):
+        """
+        A change whose transaction commits after a sync is returned by the
+        next one, although its updated_at is before the first's cursor.
+        """
+        written = threading.Event()
+        synced = threading.Event()
+        created = []
+
+        def write():
+            try:
+                with transaction.atomic():
+                    # Begins the transaction before the write. A write that
+                    # begins it is covered by the window, disabled here.
+                    Budget.objects.exists()
+                    created.append(Budget.objects.create(
+                        month='JAN', year=2000, owner=self.user))
+                    written.set()
+                    synced.wait(5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        written.wait(5)
+        data = self.get_changes()
+        self.assertEqual(data['budgets'], {})
+        self.assertGreater(data['cursor'], 0)
+        synced.set()
+        thread.join()
+
+        data = self.get_changes(data['cursor'])
+        self.assertEqual(list(data['budgets']), [created[0].pk])
+
+
+class SpendingReportViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        payee = Payee.objects.create(
+            name='Payee 1',
+            owner=self.user,
+        )
+        for month, amounts in (('DEC', (10, 20)), ('FEB', (30,))):
+            budget = Budget.objects.create(
+                month=month,
+                year=1999 if month == 'DEC' else 2000,
+                owner=self.user,
+            )
+            group = BudgetCategoryGroup.objects.create(
+                name='Group 1',
+                budget=budget,
+            )
+            category = BudgetCategory.objects.create(
+                category='Category 1',
+                group=group,
+                limit=100,
+            )
+            BudgetCategory.objects.create(
+                category='Category 2',
+                group=group,
+                limit=50,
+            )
+            for amount in amounts:
+                Transaction.objects.create(
+                    amount=amount,
+                    payee=payee,
+                    budget_category=category,
+                    date=date(2000, 1, 1),
+                )
+        CategoryTotal.refresh()
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_report(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/reports/spending/', {
+                'start_month': 'DEC',
+                'start_year': 1999,
+                'end_month': 'FEB',
+                'end_year': 2000,
+            })
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.content)
+        self.assertEqual(data['periods'], [
+            {'year': 1999, 'month': 'DEC'},
+            {'year': 2000, 'month': 'JAN'},
+            {'year': 2000, 'month': 'FEB'},
+        ])
+        self.assertEqual(data['categories'], {
+            'group': ['Group 1', 'Group 1'],
+            'category': ['Category 1', 'Category 2'],
+            'limit': [
+                ['100.00', None, '100.00'],
+                ['50.00', None, '50.00'],
+            ],
+            'spent': [['30.00', None, '30.00'], ['0.00', None, '0.00']],
+        })
+        self.assertEqual(data['groups'], {
+            'group': ['Group 1'],
+            'limit': [['150.00', None, '150.00']],
+            'spent': [['30.00', None, '30.00']],
+        })
+
+    def test_report_months(self):
+        response = self.client.get('/reports/spending/', {
+            'end_month': 'FEB',
+            'end_year': 2000,
+            'months': 2,
+        })
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.content)
+        self.assertEqual(len(data['periods']), 2)
+        self.assertEqual(data['groups']['limit'], [[None, '150.00']])
+
+    def test_report_bad_range(self):
+        response = self.client.get('/reports/spending/', {
+            'start_month': 'FEB',
+            'start_year': 2000,
+            'end_month': 'JAN',
+            'end_year': 2000,
+        })
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get('/reports/spending/', {
+            'start_month': 'FEB',
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+class AnalyticsReportViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        payee = Payee.objects.create(
+            name='Payee 1',
+            owner=self.user,
+        )
+        for year, month, amount in ((1999, 'NOV', 30), (1999, 'DEC', 60),
+                                    (2000, 'FEB', 90)):
+            budget = Budget.objects.create(
+                month=month,
+                year=year,
+                owner=self.user,
+            )
+            group = BudgetCategoryGroup.objects.create(
+                name='Living',
+                budget=budget,
+            )
+            category = BudgetCategory.objects.create(
+                category='Food',
+                group=group,
+                limit=100,
+            )
+            Transaction.objects.create(
+                amount=amount,
+                payee=payee,
+                budget_category=category,
+                date=date(2000, 1, 1),
+            )
+        CategoryTotal.refresh()
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_analytics(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/reports/analytics/', {
+                'start_month': 'DEC',
+                'start_year': 1999,
+                'end_month': 'FEB',
+                'end_year': 2000,
+            })
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.content)
+        self.assertEqual(len(data['periods']), 3)
+        self.assertEqual(data['category'], ['Food'])
+        self.assertEqual(data['spent'], [['60.00', None, '90.00']])
+        self.assertEqual(data['year_to_date'], [['90.00', None, '90.00']])
+        self.assertEqual(data['rolling_3'], [['30.00', None, '50.00']])
+        self.assertEqual(data['rolling_12'], [['7.50', None, '15.00']])
+        self.assertEqual(data['change'], [['30.00', None, '90.00']])
+
+    def test_analytics_by_group(self):
+        response = self.client.get('/reports/analytics/', {
+            'end_month': 'FEB',
+            'end_year': 2000,
+            'months': 1,
+            'group_by': 'group',
+        })
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.content)
+        self.assertEqual(data['group'], ['Living'])
+        self.assertEqual(data['spent'], [['90.00']])
+
+    def test_analytics_bad_group_by(self):
+        response = self.client.get(
+            '/reports/analytics/', {'group_by': 'payee'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CopyBudgetViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        self.budget1 = Budget.objects.create(
+            month='JAN',
+            year=2000,
+            owner=self.user,
+        )
+        self.group1 = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=self.budget1,
+        )
+        self.category1 = BudgetCategory.objects.create(
+            category='Category 1',
+            group=self.group1,
+            limit=100,
+        )
+        self.category2 = BudgetCategory.objects.create(
+            category='Category 2',
+            group=self.group1,
+            limit=100,
+        )
+
+        self.budget2 = Budget.objects.create(
+            month='FEB',
+            year=2000,
+            owner=self.user,
+        )
+        self.group2 = BudgetCategoryGroup.objects.create(
+            name='Group 2',
+            budget=self.budget2,
+        )
+        self.category3 = BudgetCategory.objects.create(
+            category='Category 3',
+            group=self.group2,
+            limit=200,
+        )
+        self.category4 = BudgetCategory.objects.create(
+            category='Category 4',
+            group=self.group2,
+            limit=200,
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_basic_request(self):
+        response = self.client.post('/copy-budget/', {
+            'source': self.budget1.pk,
+            'target_year': 2000,
+            'target_month': 'FEB',
+        })
+        self.assertEqual(response.status_code, 200)
+
+    def test_bad_request(self):
+        response = self.client.post('/copy-budget/', {
+            'source': self.budget1.pk,
+            'target_year': 2000,
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_copy_existing_to_existing(self):
+        response = self.client.post('/copy-budget/', {
+            'source': self.budget1.pk,
+            'target_year': 2000,
+            'target_month': 'FEB',
+        })
+        self.assertEqual(response.status_code, 200)
+
+        groups = \
+            self.budget2.budget_category_groups.values_list('name', flat=True)
+        self.assertEqual(list(groups), ['Group 1'])
+
+        categories = (
+            self.budget2
+            .budget_category_groups.first()
+            .budget_categories.values_list('category', flat=True)
+        )
+        self.assertEqual(list(categories), ['Category 1', 'Category 2'])
+
+    def test_copy_existing_to_nonexisting(self):
+        response = self.client.post('/copy-budget/', {
+            'source': self.budget1.pk,
+            'target_year': 3000,
+            'target_month': 'FEB',
+        })
+        self.assertEqual(response.status_code, 200)
+
+        budget = Budget.objects.get(
+            year=3000,
+            month='FEB',
+            owner=self.user,
+        )
+
+        groups = \
+            budget.budget_category_groups.values_list('name', flat=True)
+        self.assertEqual(list(groups), ['Group 1'])
+
+        categories = (
+            budget
+            .budget_category_groups.first()
+            .budget_categories.values_list('category', flat=True)
+        )
+        self.assertEqual(list(categories), ['Category 1', 'Category 2'])
+
+    def test_copy_nonexisting(self):
+        response = self.client.post('/copy-budget/', {
+            'source': -1,
+            'target_year': 3000,
+            'target_month': 'FEB',
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_copy_another_users(self):
+        user = User.objects.create(
+            username='test2',
+            password='test2',
+        )
+        budget = Budget.objects.create(
+            month='JAN',
+            year=2000,
+            owner=user,
+        )
+        response = self.client.post('/copy-budget/', {
+            'source': budget.pk,
+            'target_year': 3000,
+            'target_month': 'FEB',
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_copy_previous_month(self):
+        """
+        Defaults to the previous month's budget from the target
+        month if no source is given.
+        """
+        response = self.client.post('/copy-budget/', {
+            'target_year': 2000,
+            'target_month': 'FEB',
+        })
+        self.assertEqual(response.status_code, 200)
+
+        groups = \
+            self.budget2.budget_category_groups.values_list('name', flat=True)
+        self.assertEqual(list(groups), ['Group 1'])
+
+        categories = (
+            self.budget2
+            .budget_category_groups.first()
+            .budget_categories.values_list('category', flat=True)
+        )
+        self.assertEqual(list(categories), ['Category 1', 'Category 2'])
 
     def test_copy_no_previous_month(self):
         """
@@ -568,3 +1930,958 @@ class CopyBudgetViewTests(TestCase):
         groups = \
             self.budget1.budget_category_groups.count()
         self.assertEqual(groups, 0)
+
+    def get_structure(self, budget):
+        return list(
+            BudgetCategory.objects
+            .filter(group__budget=budget)
+            .order_by('group__name', 'category')
+            .values_list('group__name', 'category', 'limit')
+        )
+
+    def test_copy_range(self):
+        """
+        The number of queries does not depend on the number of months.
+        """
+        with self.assertNumQueries(15):
+            response = self.client.post('/copy-budget/', {
+                'source': self.budget1.pk,
+                'target_year': 2000,
+                'target_month': 'FEB',
+                'end_year': 2001,
+                'end_month': 'JAN',
+            })
+        self.assertEqual(response.status_code, 200)
+
+        budgets = Budget.objects.filter(owner=self.user)
+        self.assertEqual(budgets.count(), 13)
+        expected = self.get_structure(self.budget1)
+        for budget in budgets:
+            self.assertEqual(self.get_structure(budget), expected)
+
+        # Carryover runs through the copied months.
+        category = BudgetCategory.objects.get(
+            category='Category 1',
+            group__budget__year=2000,
+            group__budget__month='MAR',
+        )
+        self.assertEqual(category.carryover, Decimal(200))
+
+    def test_copy_range_default_source(self):
+        """
+        Without a source, the month before the range is copied.
+        """
+        response = self.client.post('/copy-budget/', {
+            'target_year': 2000,
+            'target_month': 'FEB',
+            'end_year': 2000,
+            'end_month': 'APR',
+        })
+        self.assertEqual(response.status_code, 200)
+        apr = Budget.objects.get(owner=self.user, year=2000, month='APR')
+        self.assertEqual(
+            self.get_structure(apr), self.get_structure(self.budget1))
+
+    def test_copy_range_includes_source(self):
+        response = self.client.post('/copy-budget/', {
+            'source': self.budget2.pk,
+            'target_year': 2000,
+            'target_month': 'JAN',
+            'end_year': 2000,
+            'end_month': 'MAR',
+        })
+        self.assertEqual(response.status_code, 200)
+        groups = self.budget2.budget_category_groups.all()
+        self.assertEqual([group.name for group in groups], ['Group 2'])
+        mar = Budget.objects.get(owner=self.user, year=2000, month='MAR')
+        self.assertEqual(
+            self.get_structure(mar), self.get_structure(self.budget2))
+
+    def test_copy_replaces_transactions(self):
+        transaction = Transaction.objects.create(
+            amount=10,
+            payee=Payee.objects.create(name='Payee 1', owner=self.user),
+            budget_category=self.category3,
+            date=date(2000, 2, 1),
+        )
+        response = self.client.post('/copy-budget/', {
+            'source': self.budget1.pk,
+            'target_year': 2000,
+            'target_month': 'FEB',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            Transaction.objects.filter(pk=transaction.pk).exists())
+        self.assertEqual(
+            set(
+                Tombstone.objects.filter(owner=self.user)
+                .values_list('model', 'object_pk')
+            ),
+            {
+                ('transaction', transaction.pk),
+                ('budgetcategory', self.category3.pk),
+                ('budgetcategory', self.category4.pk),
+                ('budgetcategorygroup', self.group2.pk),
+            },
+        )
+        self.assertEqual(
+            Payee.objects.get(name='Payee 1').transaction_count, 0)
+
+    def test_copy_range_invalid(self):
+        for params in (
+            {'end_year': 2000},
+            {'end_year': 1999, 'end_month': 'DEC'},
+            {'end_year': 2010, 'end_month': 'FEB'},
+            {'end_year': 2000, 'end_month': 'BAD'},
+        ):
+            response = self.client.post('/copy-budget/', dict(
+                params,
+                source=self.budget1.pk,
+                target_year=2000,
+                target_month='FEB',
+            ))
+            self.assertEqual(response.status_code, 400)
+
+    def test_copy_token(self):
+        """
+        A repeated copy with the same token is skipped.
+        """
+        params = {
+            'source': self.budget1.pk,
+            'target_year': 2000,
+            'target_month': 'FEB',
+            'token': 'abc',
+        }
+        self.client.post('/copy-budget/', params)
+        groups = list(self.budget2.budget_category_groups.all())
+
+        response = self.client.post('/copy-budget/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(self.budget2.budget_category_groups.all()), groups)
+
+        response = self.client.post(
+            '/copy-budget/', dict(params, token='def'))
+        self.assertNotEqual(
+            list(self.budget2.budget_category_groups.all()), groups)
+
+    def test_copy_locks_targets(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/copy-budget/', {
+                'source': self.budget1.pk,
+                'target_year': 2000,
+                'target_month': 'FEB',
+            })
+        self.assertTrue(any(
+            query['sql'].endswith('FOR UPDATE') for query in queries))
+
+
+class ConcurrentCopyBudgetTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        self.source = Budget.objects.create(
+            month='JAN',
+            year=2000,
+            owner=self.user,
+        )
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=self.source,
+        )
+        BudgetCategory.objects.create(
+            category='Category 1',
+            group=group,
+            limit=100,
+        )
+        for month in ('FEB', 'MAR', 'APR'):
+            Budget.objects.create(month=month, year=2000, owner=self.user)
+
+    def copy_concurrently(self, token):
+        """
+        Runs two copies into the same budgets at once.
+        """
+        periods = range(
+            Budget.get_period(2000, 'FEB'), Budget.get_period(2000, 'MAY'))
+        barrier = threading.Barrier(2)
+        errors = []
+        copy_categories = BudgetManager.copy_categories
+
+        def slow_copy_categories(manager, source, targets):
+            # Makes sure that the two copies overlap.
+            time.sleep(0.2)
+            copy_categories(manager, source, targets)
+
+        def copy():
+            try:
+                barrier.wait()
+                CopyBudgetView().copy_budget(
+                    periods, self.user, self.source, token)
+            except Exception as exc:  # pragma: no cover
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=copy) for i in range(2)]
+        with mock.patch.object(
+            BudgetManager, 'copy_categories', slow_copy_categories,
+        ):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Budget.objects.count(), 4)
+        for budget in Budget.objects.exclude(pk=self.source.pk):
+            self.assertEqual(
+                list(
+                    BudgetCategory.objects.filter(group__budget=budget)
+                    .values_list('group__name', 'category')
+                ),
+                [('Group 1', 'Category 1')],
+            )
+
+    def test_concurrent_copies(self):
+        self.copy_concurrently('')
+        # The second copy replaced the groups of the first.
+        self.assertEqual(
+            Tombstone.objects.filter(model='budgetcategorygroup').count(), 3)
+
+    def test_concurrent_copies_with_token(self):
+        self.copy_concurrently('abc')
+        # The second copy was skipped.
+        self.assertFalse(Tombstone.objects.exists())
+
+
+class DeleteViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        self.other_user = User.objects.create(
+            username='other',
+            password='test',
+        )
+        self.payee = Payee.objects.create(name='Payee 1', owner=self.user)
+        self.budgets = []
+        for month in ('JAN', 'FEB'):
+            budget = Budget.objects.create(
+                month=month,
+                year=2000,
+                owner=self.user,
+            )
+            group = BudgetCategoryGroup.objects.create(
+                name='Group 1',
+                budget=budget,
+            )
+            category = BudgetCategory.objects.create(
+                category='Category 1',
+                group=group,
+                limit=100,
+            )
+            for i in range(3):
+                Transaction.objects.create(
+                    amount=10,
+                    payee=self.payee,
+                    budget_category=category,
+                    date=date(2000, len(self.budgets) + 1, i + 1),
+                )
+            self.budgets.append(budget)
+        RecurringTransaction.objects.create(
+            amount=10,
+            payee='Payee 1',
+            category='Category 1',
+            start_date=date(2000, 1, 1),
+            next_date=date(2000, 3, 1),
+            owner=self.user,
+        )
+        ImportRule.objects.create(
+            match='payee', category='Category 1', owner=self.user)
+        Token.objects.create(user=self.user)
+        Budget.objects.create(month='JAN', year=2000, owner=self.other_user)
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_delete_budget(self):
+        january, february = self.budgets
+        february_category = BudgetCategory.objects.get(group__budget=february)
+        self.assertEqual(february_category.carryover, 70)
+        Tombstone.objects.all().delete()
+
+        response = self.client.delete('/budgets/{}/'.format(january.pk))
+        self.assertEqual(response.status_code, 204)
+
+        self.assertFalse(Budget.objects.filter(pk=january.pk).exists())
+        self.assertEqual(
+            Transaction.objects.filter(
+                budget_category__group__budget__owner=self.user).count(),
+            3,
+        )
+        february_category.refresh_from_db()
+        self.assertEqual(february_category.carryover, 0)
+        self.payee.refresh_from_db()
+        self.assertEqual(self.payee.transaction_count, 3)
+        self.assertEqual(
+            sorted(
+                Tombstone.objects.filter(owner=self.user)
+                .values_list('model', flat=True)
+            ),
+            ['budget', 'budgetcategory', 'budgetcategorygroup'] +
+            ['transaction'] * 3,
+        )
+
+    def test_delete_budget_in_batches(self):
+        january = self.budgets[0]
+        delete_budget(january, batch_size=2)
+        self.assertFalse(
+            Transaction.objects.filter(
+                budget_category__group__budget=january).exists())
+        self.assertEqual(
+            Tombstone.objects.filter(model='transaction').count(), 3)
+
+    def test_delete_user(self):
+        response = self.client.delete('/users/{}/'.format(self.user.pk))
+        self.assertEqual(response.status_code, 204)
+
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        for model in (BudgetCategoryGroup, BudgetCategory, Transaction,
+                      Payee, RecurringTransaction, ImportRule, Tombstone,
+                      Token):
+            self.assertFalse(model.objects.exists())
+        self.assertEqual(
+            list(Budget.objects.values_list('owner', flat=True)),
+            [self.other_user.pk],
+        )
+
+    def test_delete_user_in_batches(self):
+        delete_user(self.user, batch_size=2)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_delete_other_user(self):
+        response = self.client.delete(
+            '/users/{}/'.format(self.other_user.pk))
+        self.assertEqual(response.status_code, 403)
+
+    def test_delete_user_in_background(self):
+        response = self.client.delete(
+            '/users/{}/?background=true'.format(self.user.pk))
+        self.assertEqual(response.status_code, 202)
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertTrue(
+            AccountDeletion.objects.filter(user=self.user).exists())
+        self.assertEqual(Transaction.objects.count(), 6)
+
+        # The account is hidden until it is purged.
+        response = self.client.get('/users/{}/'.format(self.user.pk))
+        self.assertEqual(response.status_code, 404)
+        admin = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(user=admin)
+        response = self.client.get('/users/')
+        self.assertEqual(
+            [user['username'] for user in response.data],
+            ['other', 'admin'],
+        )
+
+        out = io.StringIO()
+        call_command('purge_accounts', stdout=out)
+        self.assertEqual(out.getvalue(), 'Deleted 1 accounts.\n')
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(AccountDeletion.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+
+
+class SoftDeleteViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        self.payee = Payee.objects.create(name='Payee 1', owner=self.user)
+        self.categories = []
+        for month in ('JAN', 'FEB'):
+            budget = Budget.objects.create(
+                month=month,
+                year=2000,
+                owner=self.user,
+            )
+            group = BudgetCategoryGroup.objects.create(
+                name='Group 1',
+                budget=budget,
+            )
+            self.categories.append(BudgetCategory.objects.create(
+                category='Category 1',
+                group=group,
+                limit=100,
+            ))
+        self.group = self.categories[0].group
+        self.transactions = [
+            Transaction.objects.create(
+                amount=10,
+                payee=self.payee,
+                budget_category=self.categories[0],
+                date=date(2000, 1, i + 1),
+            )
+            for i in range(2)
+        ]
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def assertCarryover(self, carryover):
+        category = BudgetCategory.objects.get(pk=self.categories[1].pk)
+        self.assertEqual(category.carryover, carryover)
+
+    def test_delete_transaction(self):
+        transaction = self.transactions[0]
+        response = self.client.delete(
+            '/transactions/{}/'.format(transaction.pk))
+        self.assertEqual(response.status_code, 204)
+
+        self.assertFalse(
+            Transaction.objects.filter(pk=transaction.pk).exists())
+        self.assertIsNotNone(
+            Transaction.all_objects.get(pk=transaction.pk).deleted_at)
+        self.assertTrue(Tombstone.objects.filter(
+            model='transaction', object_pk=transaction.pk).exists())
+        self.assertCarryover(90)
+        self.payee.refresh_from_db()
+        self.assertEqual(self.payee.transaction_count, 1)
+
+        response = self.client.get(
+            '/transactions/{}/'.format(transaction.pk))
+        self.assertEqual(response.status_code, 404)
+
+    def test_restore_transaction(self):
+        transaction = self.transactions[0]
+        self.client.delete('/transactions/{}/'.format(transaction.pk))
+
+        response = self.client.post(
+            '/transactions/{}/restore/'.format(transaction.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['pk'], transaction.pk)
+
+        self.assertIsNone(
+            Transaction.objects.get(pk=transaction.pk).deleted_at)
+        self.assertFalse(Tombstone.objects.filter(
+            model='transaction', object_pk=transaction.pk).exists())
+        self.assertCarryover(80)
+        self.payee.refresh_from_db()
+        self.assertEqual(self.payee.transaction_count, 2)
+
+    def test_restore_live_transaction(self):
+        response = self.client.post(
+            '/transactions/{}/restore/'.format(self.transactions[0].pk))
+        self.assertEqual(response.status_code, 404)
+
+    def test_delete_category(self):
+        category = self.categories[0]
+        response = self.client.delete(
+            '/budgetcategories/{}/'.format(category.pk))
+        self.assertEqual(response.status_code, 204)
+
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(
+            Transaction.all_objects.filter(deleted_at__isnull=False).count(),
+            2,
+        )
+        self.assertCarryover(0)
+        self.payee.refresh_from_db()
+        self.assertEqual(self.payee.transaction_count, 0)
+
+        # A transaction cannot be restored into a deleted category.
+        response = self.client.post(
+            '/transactions/{}/restore/'.format(self.transactions[0].pk))
+        self.assertEqual(response.status_code, 400)
+
+    def test_restore_category(self):
+        category = self.categories[0]
+        # Deleted before the category, so not restored with it.
+        self.client.delete('/transactions/{}/'.format(self.transactions[0].pk))
+        self.client.delete('/budgetcategories/{}/'.format(category.pk))
+
+        response = self.client.post(
+            '/budgetcategories/{}/restore/'.format(category.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(Transaction.objects.values_list('pk', flat=True)),
+            [self.transactions[1].pk],
+        )
+        self.assertCarryover(90)
+
+    def test_delete_group(self):
+        response = self.client.delete(
+            '/budgetcategorygroups/{}/'.format(self.group.pk))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(
+            BudgetCategory.objects.filter(group=self.group).exists())
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(
+            sorted(Tombstone.objects.values_list('model', flat=True)),
+            ['budgetcategory', 'budgetcategorygroup'] + ['transaction'] * 2,
+        )
+
+        # The name of a deleted group can be used again, but then the
+        # deleted group cannot be restored.
+        BudgetCategoryGroup.objects.create(
+            name='Group 1', budget=self.group.budget)
+        response = self.client.post(
+            '/budgetcategorygroups/{}/restore/'.format(self.group.pk))
+        self.assertEqual(response.status_code, 400)
+
+    def test_restore_group(self):
+        self.client.delete('/budgetcategorygroups/{}/'.format(self.group.pk))
+        response = self.client.post(
+            '/budgetcategorygroups/{}/restore/'.format(self.group.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertFalse(Tombstone.objects.exists())
+        self.assertCarryover(80)
+
+    def test_category_totals_exclude_deleted(self):
+        self.client.delete('/transactions/{}/'.format(self.transactions[0].pk))
+        self.client.delete(
+            '/budgetcategories/{}/'.format(self.categories[1].pk))
+        CategoryTotal.refresh(concurrently=False)
+        self.assertEqual(
+            list(CategoryTotal.objects.values_list('category', 'spent')),
+            [(self.categories[0].pk, 10)],
+        )
+
+    def test_purge_deleted(self):
+        self.client.delete(
+            '/budgetcategories/{}/'.format(self.categories[0].pk))
+        self.client.delete(
+            '/budgetcategories/{}/'.format(self.categories[1].pk))
+        BudgetCategory.all_objects.filter(pk=self.categories[0].pk).update(
+            deleted_at=timezone.now() - timedelta(days=40))
+        Transaction.all_objects.update(
+            deleted_at=timezone.now() - timedelta(days=40))
+
+        out = io.StringIO()
+        call_command('purge_deleted', pause=0, stdout=out)
+        self.assertEqual(
+            out.getvalue(),
+            'Deleted 2 transactions, 1 categories and 0 groups.\n')
+        self.assertEqual(
+            list(BudgetCategory.all_objects.values_list('pk', flat=True)),
+            [self.categories[1].pk],
+        )
+        self.assertFalse(Transaction.all_objects.exists())
+
+
+class IdempotencyViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        self.budget = Budget.objects.create(
+            month='JAN',
+            year=2000,
+            owner=self.user,
+        )
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=self.budget,
+        )
+        self.category = BudgetCategory.objects.create(
+            category='Category 1',
+            group=group,
+            limit=100,
+        )
+        self.data = {
+            'amount': 100,
+            'budget_category': self.category.pk,
+            'date': '2000-01-16',
+            'payee': 'Payee 1',
+        }
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_retry_replays_response(self):
+        response = self.client.post(
+            '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, 201)
+
+        # Only the stored response is read.
+        with self.assertNumQueries(1):
+            retry = self.client.post(
+                '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, response.content)
+        self.assertEqual(retry['Content-Type'], 'application/json')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.count(), 1)
+
+        # Other keys, or no key, create again.
+        response = self.client.post(
+            '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key-2')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/transactions/', self.data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Transaction.objects.count(), 3)
+
+    def test_errors_replayed(self):
+        data = dict(self.data, amount='abc')
+        response = self.client.post(
+            '/transactions/', data, HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEqual(response.status_code, 400)
+        retry = self.client.post(
+            '/transactions/', data, HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEqual(retry.status_code, 400)
+        self.assertEqual(retry.content, response.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+    def test_server_errors_released(self):
+        with mock.patch.object(
+                TransactionViewSet, 'perform_create',
+                side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(
+                    '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key')
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = self.client.post(
+            '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEqual(response.status_code, 201)
+
+    def test_in_progress(self):
+        self.client.post(
+            '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key')
+        IdempotencyKey.objects.update(status_code=None)
+        response = self.client.post(
+            '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_abandoned(self):
+        self.client.post(
+            '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key')
+        IdempotencyKey.objects.update(
+            status_code=None,
+            created_at=timezone.now() - timedelta(minutes=10),
+        )
+        abandoned = IdempotencyKey.objects.get()
+
+        # Claimed again once the first request has not finished in time.
+        response = self.client.post(
+            '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+        # The first request no longer stores its response if it finishes.
+        abandoned.store(HttpResponse(status=500))
+        record = IdempotencyKey.objects.get()
+        self.assertEqual(record.status_code, 201)
+
+    def test_other_body(self):
+        self.client.post(
+            '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key')
+        data = dict(self.data, amount=200)
+        response = self.client.post(
+            '/transactions/', data, HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+        # The order of the fields does not matter.
+        response = self.client.post(
+            '/transactions/', dict(reversed(list(self.data.items()))),
+            HTTP_IDEMPOTENCY_KEY='key',
+        )
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+    def test_files(self):
+        def post(content):
+            statement = SimpleUploadedFile(
+                'statement.csv',
+                b'date,amount,description,category\n' + content,
+            )
+            return self.client.post(
+                '/transactions/import/', {'file': statement},
+                HTTP_IDEMPOTENCY_KEY='key',
+            )
+
+        response = post(b'2000-01-15,-45.10,Amazon,Category 1\n')
+        self.assertEqual(response.data['imported'], 1)
+        response = post(b'2000-01-15,-45.10,Amazon,Category 1\n')
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        response = post(b'2000-01-15,-50.00,Amazon,Category 1\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_other_request(self):
+        self.client.post(
+            '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key')
+        response = self.client.post(
+            '/budgetcategorygroups/',
+            {'name': 'Group 2', 'budget': self.budget.pk},
+            HTTP_IDEMPOTENCY_KEY='key',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(
+            BudgetCategoryGroup.objects.filter(name='Group 2').exists())
+
+    def test_keys_per_user(self):
+        self.client.post(
+            '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key')
+        other = User.objects.create(username='other', password='test')
+        self.client.force_authenticate(user=other)
+        response = self.client.post(
+            '/budgets/', {'month': 'JAN', 'year': 2000},
+            HTTP_IDEMPOTENCY_KEY='key',
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_expired(self):
+        self.client.post(
+            '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key')
+        IdempotencyKey.objects.update(
+            created_at=timezone.now() - timedelta(days=2))
+        response = self.client.post(
+            '/transactions/', self.data, HTTP_IDEMPOTENCY_KEY='key')
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+        IdempotencyKey.objects.update(
+            created_at=timezone.now() - timedelta(days=2))
+        out = io.StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertEqual(out.getvalue(), 'Deleted 1 idempotency keys.\n')
+
+    def test_copy_budget(self):
+        data = {'target_year': 2000, 'target_month': 'FEB'}
+        response = self.client.post(
+            '/copy-budget/', data, HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEqual(response.status_code, 200)
+        with mock.patch.object(BudgetManager, 'copy_budget') as copy_budget:
+            response = self.client.post(
+                '/copy-budget/', data, HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEqual(response.status_code, 200)
+        copy_budget.assert_not_called()
+
+
+class VersionViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        budget = Budget.objects.create(
+            month='JAN',
+            year=2000,
+            owner=self.user,
+        )
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=budget,
+        )
+        self.category1 = BudgetCategory.objects.create(
+            category='Category 1',
+            group=group,
+            limit=100,
+        )
+        self.category2 = BudgetCategory.objects.create(
+            category='Category 2',
+            group=group,
+            limit=100,
+        )
+        self.transaction = Transaction.objects.create(
+            amount=10,
+            date=date(2000, 1, 15),
+            budget_category=self.category1,
+            payee=Payee.objects.create(name='Payee 1', owner=self.user),
+        )
+        self.url = '/budgetcategories/{}/'.format(self.category1.pk)
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['ETag'], '"1"')
+        self.assertEqual(response.data['version'], 1)
+
+        response = self.client.patch(self.url, {'limit': 200})
+        self.assertEqual(response['ETag'], '"2"')
+        response = self.client.get(self.url)
+        self.assertEqual(response['ETag'], '"2"')
+
+        # Lists have no ETag, but include the versions.
+        response = self.client.get('/budgetcategories/')
+        self.assertNotIn('ETag', response)
+        self.assertEqual(response.data[self.category1.pk]['version'], 2)
+
+    def test_update_if_match(self):
+        response = self.client.patch(
+            self.url, {'limit': 200}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, 200)
+
+        # Made with the version before the last update.
+        response = self.client.patch(
+            self.url, {'limit': 300}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, 412)
+        self.category1.refresh_from_db()
+        self.assertEqual(self.category1.limit, 200)
+
+        response = self.client.patch(
+            self.url, {'limit': 300}, HTTP_IF_MATCH='"0", "2"')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(
+            self.url, {'limit': 400}, HTTP_IF_MATCH='*')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"4"')
+
+    def test_delete_if_match(self):
+        url = '/transactions/{}/'.format(self.transaction.pk)
+        response = self.client.delete(url, HTTP_IF_MATCH='"2"')
+        self.assertEqual(response.status_code, 412)
+        self.assertTrue(Transaction.objects.exists())
+
+        response = self.client.delete(url, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_set_based_changes(self):
+        self.client.post(
+            '/transactions/recategorize/?payee=Payee 1',
+            {'budget_category': self.category2.pk},
+        )
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.version, 2)
+
+        self.client.delete(self.url)
+        self.client.post(self.url + 'restore/')
+        self.category1.refresh_from_db()
+        self.assertEqual(self.category1.version, 3)
+
+    def test_carryover_keeps_version(self):
+        # Carryover is derived, so clients cannot overwrite it.
+        budget = Budget.objects.create(
+            month='FEB',
+            year=2000,
+            owner=self.user,
+        )
+        group = BudgetCategoryGroup.objects.create(
+            name='Group 1',
+            budget=budget,
+        )
+        category = BudgetCategory.objects.create(
+            category='Category 1',
+            group=group,
+            limit=100,
+        )
+        self.client.patch(
+            '/transactions/{}/'.format(self.transaction.pk), {'amount': 20})
+        category.refresh_from_db()
+        self.assertEqual(category.carryover, 80)
+        self.assertEqual(category.version, 1)
+
+
+# Lookups are only cached once their transaction commits.
+class ResolutionCacheViewTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='test',
+            password='test',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def create_category(self, name, group='Group 1'):
+        return self.client.post('/budgetcategories/', {
+            'budget_month': 'JAN',
+            'budget_year': 2000,
+            'group': group,
+            'category': name,
+            'limit': 100,
+        })
+
+    def test_cached_groups(self):
+        with mock.patch.object(
+            Budget.objects, 'get_or_create_group',
+            wraps=Budget.objects.get_or_create_group,
+        ) as get_or_create_group:
+            self.assertEqual(self.create_category('Shopping').status_code, 201)
+            self.assertEqual(self.create_category('Dining').status_code, 201)
+            self.assertEqual(get_or_create_group.call_count, 1)
+
+            # A taken name is checked against a fresh lookup.
+            self.assertEqual(self.create_category('Dining').status_code, 400)
+            self.assertEqual(get_or_create_group.call_count, 2)
+
+        self.assertEqual(BudgetCategoryGroup.objects.count(), 1)
+        self.assertEqual(BudgetCategory.objects.count(), 2)
+
+    def test_deleted_groups(self):
+        self.create_category('Shopping')
+        group = BudgetCategoryGroup.objects.get()
+        self.client.delete('/budgetcategorygroups/{}/'.format(group.pk))
+
+        response = self.create_category('Dining')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotEqual(
+            BudgetCategory.objects.get(pk=response.data['pk']).group_id,
+            group.pk,
+        )
+
+    def test_stale_groups(self):
+        # Deleted by another process, whose cache is not shared.
+        self.create_category('Shopping')
+        BudgetCategoryGroup.objects.update(deleted_at=timezone.now())
+
+        response = self.create_category('Dining')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(BudgetCategoryGroup.objects.count(), 1)
+
+    def test_stale_renamed_groups(self):
+        # Renamed by another process, whose cache is not shared.
+        self.create_category('Shopping')
+        BudgetCategoryGroup.objects.update(name='Group 2')
+
+        response = self.create_category('Dining')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            BudgetCategory.objects.get(pk=response.data['pk']).group.name,
+            'Group 1',
+        )
+
+    def test_stale_moved_groups(self):
+        # Moved by another process, whose cache is not shared.
+        self.create_category('Shopping')
+        budget = Budget.objects.create(
+            month='FEB', year=2000, owner=self.user)
+        BudgetCategoryGroup.objects.update(budget=budget)
+
+        response = self.create_category('Dining')
+        self.assertEqual(response.status_code, 201)
+        group = BudgetCategory.objects.get(pk=response.data['pk']).group
+        self.assertEqual(group.budget.month, 'JAN')
+
+    def test_renamed_groups(self):
+        self.create_category('Shopping')
+        group = BudgetCategoryGroup.objects.get()
+        self.client.patch(
+            '/budgetcategorygroups/{}/'.format(group.pk), {'name': 'Group 2'})
+
+        self.create_category('Dining')
+        self.assertEqual(
+            sorted(BudgetCategoryGroup.objects.values_list('name', flat=True)),
+            ['Group 1', 'Group 2'],
+        )
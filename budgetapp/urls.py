@@ -11,6 +11,10 @@ router.register(r'budgets', views.BudgetViewSet)
 router.register(r'budgetcategories', views.BudgetCategoryViewSet)
 router.register(r'budgetcategorygroups', views.BudgetCategoryGroupViewSet)
 router.register(r'transactions', views.TransactionViewSet)
+router.register(r'payees', views.PayeeViewSet)
+router.register(r'importrules', views.ImportRuleViewSet)
+router.register(r'recurringtransactions', views.RecurringTransactionViewSet)
+router.register(r'jobs', views.JobViewSet)
 
 urlpatterns = [
     path('logout/', views.logout, name='logout'),
@@ -26,5 +30,13 @@ urlpatterns = [
          name='user-detail'),
     path('user-info/', views.UserDetailView.as_view(), name='user-info'),
     path('copy-budget/', views.CopyBudgetView.as_view(), name='copy-budget'),
+    path('changes/', views.ChangesView.as_view(), name='changes'),
+    path('events/', views.EventsView.as_view(), name='events'),
+    path('reports/spending/',
+         views.SpendingReportView.as_view(),
+         name='spending-report'),
+    path('reports/analytics/',
+         views.AnalyticsReportView.as_view(),
+         name='analytics-report'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# How far cursors are held back, since updated_at is set shortly before a
+# write's statement starts, and the clocks of the app and database servers
+# may differ a little.
+SYNC_WINDOW = timedelta(seconds=5)
+
+
+def to_cursor(timestamp):
+    """
+    Returns an opaque sync cursor (microseconds since the epoch)
+    for the given timestamp.
+    """
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def from_cursor(cursor):
+    """
+    Returns the timestamp for the given sync cursor.
+    """
+    return EPOCH + timedelta(microseconds=cursor)
+
+
+def get_cursor():
+    """
+    Returns a sync cursor before which all changes are visible. Changes are
+    only visible once their transaction commits, which may be long after
+    their updated_at, so the cursor is held back to the start of the oldest
+    other transaction that has written something, less SYNC_WINDOW. The
+    changes after it may be returned again by the next sync.
+    """
+    with connection.cursor() as cursor:
+        # Only the sessions of the same database user are visible, which
+        # are all of the app's.
+        cursor.execute(
+            """
+            SELECT min(xact_start) FROM pg_stat_activity
+            WHERE datname = current_database()
+            AND backend_xid IS NOT NULL
+            AND pid <> pg_backend_pid()
+            """
+        )
+        oldest = cursor.fetchone()[0]
+
+    now = timezone.now()
+    if oldest is not None:
+        now = min(now, oldest)
+    return to_cursor(now - SYNC_WINDOW)
@@ -1,17 +1,220 @@
+import hashlib
+import io
+import json
+from collections import defaultdict
+
 from django import forms
 from django.contrib.auth.models import User
-from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
-from rest_framework import generics, permissions, viewsets
+from django.core.files import File
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.http import (HttpResponse, HttpResponseBadRequest, JsonResponse,
+                         StreamingHttpResponse)
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import generics, permissions, status, viewsets
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.parsers import MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Budget, BudgetCategory, BudgetCategoryGroup, Transaction
+from .bulk import (merge_payees, recategorize_transactions, restore_deleted,
+                   soft_delete)
+from .events import EventStreamRenderer, listener
+from .exporters import CONTENT_TYPES, stream_export
+from .filters import BudgetCategoryFilter, TransactionFilter
+from .importers import StatementImporter, read_statement
+from .jobs import enqueue
+from .models import (Budget, BudgetCategory, BudgetCategoryGroup,
+                     IdempotencyKey, ImportRule, Job, Payee,
+                     RecurringTransaction, Tombstone, Transaction)
 from .permissions import IsOwnerOrAdmin
-from .serializers import (BudgetCategoryGroupSerializer,
+from .purge import delete_budget, delete_user, request_user_deletion
+from .reports import analytics_report, spending_report
+from .search import search_transactions
+from .serializers import (AnalyticsReportSerializer,
+                          BudgetCategoryGroupSerializer,
                           BudgetCategorySerializer, BudgetSerializer,
-                          TransactionSerializer, UserSerializer)
+                          BudgetSummarySerializer, ChangesSerializer,
+                          DictSerializer, ImportRuleSerializer, JobSerializer,
+                          PayeeMergeSerializer, PayeeSerializer,
+                          PayeeUsageSerializer, RecurringTransactionSerializer,
+                          ReportPeriodSerializer, StatementImportSerializer,
+                          TransactionBulkSerializer,
+                          TransactionExportSerializer,
+                          TransactionRecategorizeSerializer,
+                          TransactionSearchResultSerializer,
+                          TransactionSearchSerializer, TransactionSerializer,
+                          UserSerializer)
+from .utils.sync import from_cursor, get_cursor
+
+
+def is_background(request):
+    """
+    Whether the request asks for its operation to run as a background job.
+    """
+    return request.query_params.get('background', '').lower() == 'true'
+
+
+def job_response(job, request):
+    serializer = JobSerializer(job, context={'request': request})
+    return Response(
+        serializer.data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={'Location': serializer.data['url']},
+    )
+
+
+class RequestInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is in progress.'
+    default_code = 'request_in_progress'
+
+
+class Replay(Exception):
+
+    def __init__(self, record):
+        self.record = record
+
+
+def hash_body(data):
+    """
+    Returns a hash of the given parsed request body, which does not depend
+    on the order of its fields or on the boundaries of multipart bodies.
+    """
+    def default(value):
+        if isinstance(value, File):
+            digest = hashlib.sha256()
+            for chunk in value.chunks():
+                digest.update(chunk)
+            value.seek(0)
+            return digest.hexdigest()
+        return str(value)
+
+    if hasattr(data, 'lists'):
+        data = sorted(data.lists())
+    body = json.dumps(data, sort_keys=True, default=default)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+class IdempotencyMixin:
+    """
+    Handles a POST with an `Idempotency-Key` header only once. Its response
+    is stored, and returned as is to retries with the same key and body for
+    a day, without validating or writing anything again. A retry while the
+    first request is still being handled gets a 409, unless the first
+    request has not finished for a few minutes. Requests that fail with a
+    server error are not stored, so that they can be retried.
+    """
+    idempotency_key = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if request.method != 'POST' or not key:
+            return
+
+        max_length = IdempotencyKey._meta.get_field('key').max_length
+        if len(key) > max_length:
+            raise ValidationError({
+                'detail': 'Idempotency-Key must be at most {} characters.'
+                .format(max_length),
+            })
+
+        body_hash = hash_body(request.data)
+        record, claimed = IdempotencyKey.objects.claim(
+            request.user, key, request.method, request.path, body_hash)
+        if claimed:
+            self.idempotency_key = record
+        elif (record.method, record.path, record.body_hash) != (
+                request.method, request.path, body_hash):
+            raise ValidationError({
+                'detail': 'Idempotency-Key was used for another request.',
+            })
+        elif record.status_code is None:
+            raise RequestInProgress()
+        else:
+            raise Replay(record)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, Replay):
+            return exc.record.replay()
+
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            if self.idempotency_key is not None:
+                self.idempotency_key.release()
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        if self.idempotency_key is not None:
+            if response.status_code >= 500:
+                self.idempotency_key.release()
+            else:
+                if hasattr(response, 'render'):
+                    response.render()
+                self.idempotency_key.store(response)
+
+        return response
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The object was changed since it was fetched.'
+    default_code = 'precondition_failed'
+
+
+class VersionMixin:
+    """
+    Sends the version of an object as its ETag. An update or delete with
+    an `If-Match` header only goes ahead if it has the object's current
+    ETag, and otherwise gets a 412, so that clients do not overwrite changes
+    they have not seen. The object is locked until the change is saved.
+    """
+    locking_actions = ('update', 'partial_update', 'destroy')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        # Views built without an action only filter.
+        if getattr(self, 'action', None) in self.locking_actions:
+            queryset = queryset.select_for_update(of=('self',))
+        return queryset
+
+    def get_object(self):
+        instance = super().get_object()
+        if_match = self.request.META.get('HTTP_IF_MATCH')
+        if self.action in self.locking_actions and if_match:
+            etags = parse_etags(if_match)
+            if '*' not in etags and \
+                    quote_etag(str(instance.version)) not in etags:
+                raise PreconditionFailed()
+
+        return instance
+
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().update(request, *args, **kwargs)
+
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().destroy(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        data = getattr(response, 'data', None)
+        if self.detail and status.is_success(response.status_code) and \
+                isinstance(data, dict) and 'version' in data:
+            response['ETag'] = quote_etag(str(data['version']))
+
+        return response
 
 
 class OwnerMixin:
@@ -19,7 +222,48 @@ class OwnerMixin:
         serializer.save(owner=self.request.user)
 
 
-class BudgetViewSet(OwnerMixin, viewsets.ModelViewSet):
+class SoftDeleteMixin:
+    """
+    Marks objects as deleted instead of deleting them, so that a deletion
+    can be undone with the `restore` action until the object is purged.
+    """
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            soft_delete(
+                type(instance).objects.filter(pk=instance.pk), instance.owner)
+
+    @action(detail=True, methods=['post'])
+    def restore(self, request, pk=None):
+        """
+        Restores a deleted object, along with the objects deleted with it.
+        """
+        model = self.get_queryset().model
+        instance = generics.get_object_or_404(
+            model.all_objects.filter(deleted_at__isnull=False),
+            pk=pk,
+            **{model.owner_lookup: request.user}
+        )
+        try:
+            with transaction.atomic():
+                restored = restore_deleted(
+                    model.all_objects.filter(pk=instance.pk), request.user)
+        except IntegrityError:
+            # Group and category names are unique among live objects.
+            raise ValidationError(
+                'A group or category with the same name exists in the '
+                'budget.')
+        if not restored:
+            raise ValidationError(
+                'The object cannot be restored while the object it is in '
+                'is deleted.')
+
+        instance = self.get_object()
+        return Response(self.get_serializer(instance).data)
+
+
+class BudgetViewSet(IdempotencyMixin, VersionMixin, OwnerMixin,
+                    viewsets.ModelViewSet):
     queryset = Budget.objects.all()
     serializer_class = BudgetSerializer
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrAdmin)
@@ -28,12 +272,22 @@ class BudgetViewSet(OwnerMixin, viewsets.ModelViewSet):
     def get_queryset(self):
         return Budget.objects.filter(owner=self.request.user)
 
+    def perform_destroy(self, instance):
+        delete_budget(instance)
+
 
 class CopyBudgetForm(forms.Form):
+    # Copies into at most ten years of budgets at once.
+    max_months = 120
+
     source = forms.ModelChoiceField(
         queryset=Budget.objects.all(), required=False)
     target_year = forms.IntegerField()
-    target_month = forms.CharField()
+    target_month = forms.ChoiceField(choices=Budget.MONTH_CHOICES)
+    end_year = forms.IntegerField(required=False)
+    end_month = forms.ChoiceField(
+        choices=Budget.MONTH_CHOICES, required=False)
+    token = forms.CharField(max_length=100, required=False)
 
     def __init__(self, request_user, *args, **kwargs):
         self.request_user = request_user
@@ -48,45 +302,83 @@ class CopyBudgetForm(forms.Form):
 
         return source
 
+    def clean(self):
+        """
+        Sets `periods` to the range of target months, from the target month
+        to the end month, if given.
+        """
+        data = super().clean()
+        if 'target_year' not in data or 'target_month' not in data:
+            return data
+
+        start = Budget.get_period(data['target_year'], data['target_month'])
+        if data.get('end_year') is None and not data.get('end_month'):
+            end = start
+        elif data.get('end_year') is None or not data.get('end_month'):
+            raise forms.ValidationError(
+                'Both end_year and end_month are required.')
+        else:
+            end = Budget.get_period(data['end_year'], data['end_month'])
+
+        if end < start:
+            raise forms.ValidationError(
+                'The end month must not be before the target month.')
+        if end - start >= self.max_months:
+            raise forms.ValidationError(
+                'At most {} months can be copied at once.'.format(
+                    self.max_months))
+
+        data['periods'] = range(start, end + 1)
+        return data
+
+
+class CopyBudgetView(IdempotencyMixin, APIView):
+    """
+    Copies the groups and categories of a budget into the target month, or
+    into each month from the target month to the end month. The source
+    defaults to the budget of the month before the first target.
 
-class CopyBudgetView(APIView):
+    The target budgets are locked while copying, so concurrent copies into
+    them run one after the other. A copy with the same `token` as the
+    last copy into all of the targets is skipped, so that repeated
+    requests (such as a double click) copy only once.
+
+    With `background=true`, the copy is queued as a job and its status is
+    returned.
+    """
     permission_classes = (permissions.IsAuthenticated,)
 
     def post(self, request):
         form = CopyBudgetForm(request.user, request.data)
         if form.is_valid():
             params = form.cleaned_data
+            if is_background(request):
+                job = enqueue(
+                    'copy_budget',
+                    request.user,
+                    start=params['periods'].start,
+                    end=params['periods'][-1],
+                    source=params['source'] and params['source'].pk,
+                    token=params.get('token'),
+                )
+                return job_response(job, request)
+
             self.copy_budget(
-                params['target_year'],
-                params['target_month'],
+                params['periods'],
                 request.user,
                 params.get('source'),
+                params.get('token'),
             )
             return HttpResponse()
         else:
             return HttpResponseBadRequest()
 
-    def copy_budget(self, target_year, target_month, user, source=None):
-        target, created = Budget.objects.get_or_create(
-            year=target_year,
-            month=target_month,
-            owner=user,
-        )
-
-        # Default the source to the previous month's budget.
-        if not source:
-            source = target.previous
-
-        # If there is a source budget, copy the categories. Otherwise,
-        # delete all categories, since the non-existing budget appears blank
-        # in the UI.
-        if source:
-            target.copy_categories(source)
-        else:
-            target.delete_categories()
+    def copy_budget(self, periods, user, source=None, token=''):
+        Budget.objects.copy_budget(user, periods, source, token)
 
 
-class BudgetCategoryGroupViewSet(viewsets.ModelViewSet):
+class BudgetCategoryGroupViewSet(IdempotencyMixin, VersionMixin,
+                                 SoftDeleteMixin, viewsets.ModelViewSet):
     queryset = BudgetCategoryGroup.objects.all()
     serializer_class = BudgetCategoryGroupSerializer
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrAdmin)
@@ -96,25 +388,399 @@ class BudgetCategoryGroupViewSet(viewsets.ModelViewSet):
             budget__owner=self.request.user)
 
 
-class BudgetCategoryViewSet(viewsets.ModelViewSet):
+class BudgetCategoryViewSet(IdempotencyMixin, VersionMixin,
+                            SoftDeleteMixin, viewsets.ModelViewSet):
     queryset = BudgetCategory.objects.all()
     serializer_class = BudgetCategorySerializer
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrAdmin)
+    filterset_class = BudgetCategoryFilter
 
     def get_queryset(self):
         return BudgetCategory.objects.filter(
             group__budget__owner=self.request.user)
 
 
-class TransactionViewSet(viewsets.ModelViewSet):
+class ResultsPagination(PageNumberPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class TransactionViewSet(IdempotencyMixin, VersionMixin,
+                         SoftDeleteMixin, viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrAdmin)
+    filterset_class = TransactionFilter
 
     def get_queryset(self):
         return Transaction.objects.filter(
             budget_category__group__budget__owner=self.request.user)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Creates a list of transactions in one atomic batch. If any
+        transaction is invalid, none are created and a list of errors,
+        one per submitted transaction, is returned.
+        """
+        serializer = TransactionBulkSerializer(
+            data=request.data,
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        serializer.is_valid(raise_exception=True)
+        transactions = serializer.save()
+        data = self.get_serializer(transactions, many=True).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='import',
+            parser_classes=(MultiPartParser,))
+    def import_statement(self, request):
+        """
+        Imports a CSV or OFX bank statement uploaded as `file`. Rows that
+        cannot be imported are skipped and reported in the response, or in
+        the job's result with `background=true`. A statement that cannot be
+        decoded or parsed to the end gets a 400, reporting the rows that
+        were imported before.
+        """
+        serializer = StatementImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        stream = io.TextIOWrapper(
+            params['file'].file, encoding='utf-8-sig', newline='')
+        with stream:
+            if is_background(request):
+                try:
+                    payload = stream.read()
+                except UnicodeDecodeError:
+                    raise ValidationError({
+                        'file': ['The statement must be encoded as UTF-8.'],
+                    })
+                job = enqueue(
+                    'import_statement',
+                    request.user,
+                    payload=payload,
+                    file_format=params['file_format'],
+                )
+                return job_response(job, request)
+
+            importer = StatementImporter(request.user)
+            summary = importer.run(
+                read_statement(stream, params['file_format']))
+
+        # The rows before the one that could not be read are imported.
+        if importer.unreadable:
+            return Response(summary, status=status.HTTP_400_BAD_REQUEST)
+        return Response(summary)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Streams the user's transactions as CSV or JSON Lines, optionally
+        filtered by date range and categories.
+        """
+        serializer = TransactionExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        queryset = self.get_queryset()
+        if 'date_after' in params:
+            queryset = queryset.filter(date__gte=params['date_after'])
+        if 'date_before' in params:
+            queryset = queryset.filter(date__lte=params['date_before'])
+        if params.get('category'):
+            queryset = queryset.filter(
+                budget_category__in=params['category'])
+
+        file_format = params['file_format']
+        response = StreamingHttpResponse(
+            stream_export(queryset, file_format),
+            content_type=CONTENT_TYPES[file_format],
+        )
+        response['Content-Disposition'] = \
+            'attachment; filename="transactions.{}"'.format(file_format)
+        return response
+
+    def filter_bulk_queryset(self):
+        """
+        Returns the user's transactions matching the query string filters.
+        At least one filter with a value is required, so that a request
+        without filters does not change every transaction. Empty values are
+        ignored by the filters, so they do not count.
+        """
+        filterset = TransactionFilter(
+            self.request.query_params,
+            queryset=self.get_queryset(),
+            request=self.request,
+        )
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+
+        if all(value in (None, '', [])
+               for value in filterset.form.cleaned_data.values()):
+            raise ValidationError({
+                'detail': 'At least one filter is required: {}.'.format(
+                    ', '.join(sorted(filterset.filters))),
+            })
+
+        return filterset.qs
+
+    @action(detail=False, methods=['post'])
+    def recategorize(self, request):
+        """
+        Moves the transactions matching the query string filters to the
+        budget category given in the body, with one UPDATE.
+        """
+        serializer = TransactionRecategorizeSerializer(
+            data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            updated = recategorize_transactions(
+                self.filter_bulk_queryset(),
+                serializer.validated_data['budget_category'],
+            )
+
+        return Response({'updated': updated})
+
+    @action(detail=False, methods=['post'], url_path='bulk-delete')
+    def bulk_delete(self, request):
+        """
+        Deletes the transactions matching the query string filters, with one
+        UPDATE. They can be restored one at a time until they are purged.
+        """
+        with transaction.atomic():
+            deleted = soft_delete(self.filter_bulk_queryset(), request.user)
+
+        return Response({'deleted': deleted})
+
+    @action(detail=False, methods=['get'],
+            pagination_class=ResultsPagination)
+    def search(self, request):
+        """
+        Searches the user's transactions by payee, category and group name
+        (`q`), amount range and date range. Results matching `q` are ordered
+        by rank, then by date, and returned a page at a time.
+        """
+        serializer = TransactionSearchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        queryset = self.get_queryset().select_related('payee')
+        if 'amount_min' in params:
+            queryset = queryset.filter(amount__gte=params['amount_min'])
+        if 'amount_max' in params:
+            queryset = queryset.filter(amount__lte=params['amount_max'])
+        if 'date_after' in params:
+            queryset = queryset.filter(date__gte=params['date_after'])
+        if 'date_before' in params:
+            queryset = queryset.filter(date__lte=params['date_before'])
+
+        if 'q' in params:
+            queryset = search_transactions(
+                queryset, request.user, params['q'],
+            ).order_by('-rank', '-date', '-pk')
+        else:
+            queryset = queryset.order_by('-date', '-pk')
+
+        page = self.paginate_queryset(queryset)
+        serializer = TransactionSearchResultSerializer(
+            page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+
+class PayeeViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Lists the user's payees, most used first, a page at a time. `search`
+    suggests payees whose name starts with the given text.
+    """
+    queryset = Payee.objects.all()
+    serializer_class = PayeeUsageSerializer
+    permission_classes = (permissions.IsAuthenticated, IsOwnerOrAdmin)
+    pagination_class = ResultsPagination
+
+    def get_queryset(self):
+        queryset = Payee.objects.filter(owner=self.request.user)
+        search = self.request.query_params.get('search')
+        if search:
+            queryset = queryset.filter(name__istartswith=search)
+
+        # Matches the order of the payee usage index. Unused payees, which
+        # have no last used date, come last by their count.
+        return queryset.order_by('-transaction_count', '-last_used', 'name')
+
+    @action(detail=False, methods=['post'])
+    def merge(self, request):
+        """
+        Merges the payees given as `payees` into the payee `into`, moving
+        their transactions with one UPDATE.
+        """
+        serializer = PayeeMergeSerializer(
+            data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            updated = merge_payees(
+                serializer.validated_data['payees'],
+                serializer.validated_data['into'],
+            )
+
+        return Response({'updated': updated})
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The status of the user's background jobs, most recent first.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    permission_classes = (permissions.IsAuthenticated, IsOwnerOrAdmin)
+    pagination_class = ResultsPagination
+
+    def get_queryset(self):
+        return Job.objects.filter(owner=self.request.user).order_by('-pk')
+
+
+class ImportRuleViewSet(IdempotencyMixin, VersionMixin, OwnerMixin,
+                        viewsets.ModelViewSet):
+    queryset = ImportRule.objects.all()
+    serializer_class = ImportRuleSerializer
+    permission_classes = (permissions.IsAuthenticated, IsOwnerOrAdmin)
+
+    def get_queryset(self):
+        return ImportRule.objects.filter(owner=self.request.user)
+
+
+class RecurringTransactionViewSet(IdempotencyMixin, VersionMixin,
+                                  OwnerMixin, viewsets.ModelViewSet):
+    queryset = RecurringTransaction.objects.all()
+    serializer_class = RecurringTransactionSerializer
+    permission_classes = (permissions.IsAuthenticated, IsOwnerOrAdmin)
+
+    def get_queryset(self):
+        return RecurringTransaction.objects.filter(owner=self.request.user)
+
+
+class ChangesView(APIView):
+    """
+    Returns the objects created, updated or deleted since the given
+    cursor, along with a new cursor to pass as `since` on the next
+    request. Without a cursor, all of the user's objects are returned.
+    Changes made shortly before a sync, or by transactions still open
+    during it, may be returned again by the next one.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+    synced = (
+        ('budgets', Budget, BudgetSummarySerializer),
+        ('budget_category_groups', BudgetCategoryGroup,
+         BudgetCategoryGroupSerializer),
+        ('budget_categories', BudgetCategory, BudgetCategorySerializer),
+        ('transactions', Transaction, TransactionSerializer),
+        ('payees', Payee, PayeeSerializer),
+    )
+
+    def get(self, request):
+        serializer = ChangesSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        since = serializer.validated_data.get('since')
+
+        # Taken before reading, so that changes committed while reading are
+        # returned again by the next sync rather than missed.
+        data = {'cursor': get_cursor()}
+        changed = Q()
+        if since is not None:
+            changed = Q(updated_at__gt=from_cursor(since))
+
+        model_keys = {}
+        for key, model, serializer_class in self.synced:
+            model_keys[model._meta.model_name] = key
+            queryset = model.objects.filter(
+                changed,
+                **{model.owner_lookup: request.user}
+            )
+            # Always key by pk, since group names are not unique
+            # across budgets.
+            data[key] = DictSerializer(
+                queryset,
+                child=serializer_class(),
+                context={'request': request},
+            ).data
+
+        deleted = defaultdict(list)
+        if since is not None:
+            tombstones = Tombstone.objects.filter(
+                owner=request.user,
+                deleted_at__gt=from_cursor(since),
+            ).values_list('model', 'object_pk')
+            for model_name, pk in tombstones:
+                deleted[model_keys[model_name]].append(pk)
+        data['deleted'] = {key: deleted[key] for key, _, _ in self.synced}
+
+        return Response(data)
+
+
+class EventsView(APIView):
+    """
+    Streams changes to the user's budgets, groups, categories and
+    transactions as server-sent events. Each `change` event has the type,
+    pk and version (as in its ETag) of a changed object, the sync cursor of
+    its updated_at, and whether it was deleted. A `resync` event means
+    changes were missed, and should be fetched from the changes endpoint.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+    renderer_classes = (EventStreamRenderer, JSONRenderer)
+
+    def get(self, request):
+        stream = listener.stream(request.user.pk)
+
+        # The stream does not query the database, so the connection is not
+        # held for as long as the stream is open.
+        if not connection.in_atomic_block:
+            connection.close()
+
+        response = StreamingHttpResponse(
+            stream, content_type='text/event-stream')
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class SpendingReportView(APIView):
+    """
+    Returns the limit and amount spent per category and group for each
+    month in a range, in a column oriented format.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request):
+        serializer = ReportPeriodSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        return Response(
+            spending_report(request.user, params['start'], params['end']))
+
+
+class AnalyticsReportView(APIView):
+    """
+    Returns year-to-date spent, rolling averages and month-over-month
+    changes per category name or group name for each month in a range.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request):
+        serializer = AnalyticsReportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        return Response(analytics_report(
+            request.user,
+            params['start'],
+            params['end'],
+            params['group_by'],
+        ))
+
 
 class UserCreateView(generics.CreateAPIView):
     """
@@ -131,16 +797,32 @@ class UserRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
     Actions an authenticated user can do only to their own User
     object (Retrieve, Update, Destroy).
     """
-    queryset = User.objects.all()
+    queryset = User.objects.filter(deletion__isnull=True)
     serializer_class = UserSerializer
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrAdmin,)
 
+    def destroy(self, request, *args, **kwargs):
+        """
+        Deletes the user and all of their data. With `background=true` the
+        account is deactivated and hidden at once, and purged later by a
+        job.
+        """
+        user = self.get_object()
+        if is_background(request):
+            with transaction.atomic():
+                request_user_deletion(user)
+                enqueue('delete_user', user)
+            return Response(status=status.HTTP_202_ACCEPTED)
+
+        delete_user(user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class UserListView(generics.ListAPIView):
     """
     List view for Users. Only admin users can use this.
     """
-    queryset = User.objects.all()
+    queryset = User.objects.filter(deletion__isnull=True).order_by('pk')
     serializer_class = UserSerializer
     permission_classes = (permissions.IsAdminUser,)
 
@@ -0,0 +1,14 @@
+# Gunicorn settings for production.
+
+bind = '0.0.0.0:8000'
+
+# Event streams stay open for as long as clients listen, so each request
+# runs in a greenlet rather than holding a sync worker.
+worker_class = 'gevent'
+worker_connections = 1000
+
+
+def post_fork(server, worker):
+    # Lets other greenlets run while one waits on a database query.
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()